@@ -0,0 +1,211 @@
+"""
+Agregados multi-resolución del histórico, mantenidos al momento de la ingesta.
+
+Cada muestra que llega se acumula en la cubeta abierta de cada nivel
+(1 minuto, 15 minutos, 1 hora y 1 día). Cuando llega una muestra de una cubeta
+posterior, la anterior se cierra y se agrega como una fila a su propio
+histórico append-only (ver historico.py), con retención propia. Así una
+consulta de una semana, un mes o un año lee unos cientos de filas ya
+agregadas en lugar de recorrer las muestras crudas.
+
+Cada fila tiene el timestamp de inicio de la cubeta, la cantidad de muestras
+('n') y, por canal, el promedio de sus valores válidos (con el nombre del
+canal, para que la fila sirva donde se espera un registro crudo), el mínimo,
+el máximo y la integral en el tiempo (canal·hora; para ActivePower es la
+energía consumida).
+"""
+
+import math
+import os
+import threading
+
+import anillo
+import historico
+
+# Nivel (segundos por cubeta) -> filas que se conservan
+NIVELES = {
+    60: 10080,      # 1 minuto, 7 días
+    900: 5952,      # 15 minutos, 62 días
+    3600: 9600,     # 1 hora, 400 días
+    86400: 3660     # 1 día, 10 años
+}
+
+# Entre dos muestras más separadas que esto no se integra (hueco en los datos)
+MAX_HUECO_INTEGRAL = 300
+
+# Filas máximas que debería leer una consulta al elegir el nivel automáticamente
+MAX_FILAS_CONSULTA = 1000
+
+CANALES = anillo.CANALES
+
+# Estado por sensor: cubeta abierta de cada nivel y última muestra
+_estados = {}
+_lock_estados = threading.Lock()
+
+
+def nombre_nivel(segundos):
+    return f"agregado_{segundos}"
+
+
+def _carpeta_agregados(carpeta, sensor_id):
+    return historico.carpeta_sensor(carpeta, sensor_id)
+
+
+def _cubeta_vacia(inicio):
+    cubeta = {'inicio': inicio, 'n': 0}
+    for canal in CANALES:
+        cubeta[canal] = {'n': 0, 'min': math.inf, 'max': -math.inf, 'suma': 0.0, 'integral': 0.0}
+    return cubeta
+
+
+def _acumular_en_cubeta(cubeta, valores, anteriores, dt):
+    cubeta['n'] += 1
+    for canal in CANALES:
+        valor = valores.get(canal)
+        if valor is None or not math.isfinite(valor):
+            continue
+        acumulado = cubeta[canal]
+        acumulado['n'] += 1
+        acumulado['min'] = min(acumulado['min'], valor)
+        acumulado['max'] = max(acumulado['max'], valor)
+        acumulado['suma'] += valor
+        previo = anteriores.get(canal) if anteriores else None
+        if dt and previo is not None and math.isfinite(previo):
+            # Regla del trapecio, en canal·hora
+            acumulado['integral'] += (previo + valor) / 2 * dt / 3600
+
+
+def _fila(cubeta, segundos):
+    fila = {
+        'timestamp': anillo.desde_epoch(cubeta['inicio']).isoformat(),
+        'segundos': segundos,
+        'n': cubeta['n']
+    }
+    for canal in CANALES:
+        acumulado = cubeta[canal]
+        if not acumulado['n']:
+            # Canal sin ningún valor válido en la cubeta
+            fila[canal] = fila[f"{canal}_min"] = fila[f"{canal}_max"] = None
+            fila[f"{canal}_integral"] = 0.0
+            continue
+        # Promedio sobre los valores válidos del canal (None y NaN no suman)
+        fila[canal] = acumulado['suma'] / acumulado['n']
+        fila[f"{canal}_min"] = acumulado['min']
+        fila[f"{canal}_max"] = acumulado['max']
+        fila[f"{canal}_integral"] = acumulado['integral']
+    return fila
+
+
+def _acumular(estado, ts, valores):
+    """
+    Acumula una muestra en todos los niveles y devuelve las filas de las
+    cubetas que se cerraron, como pares (segundos, fila).
+    """
+    cerradas = []
+    dt = None
+    if estado['ultimo_ts'] is not None:
+        dt = ts - estado['ultimo_ts']
+        if dt <= 0 or dt > MAX_HUECO_INTEGRAL:
+            dt = None
+
+    for segundos, cubeta in estado['cubetas'].items():
+        inicio = ts - ts % segundos
+        if cubeta is None or cubeta['inicio'] != inicio:
+            if cubeta is not None and cubeta['n']:
+                cerradas.append((segundos, _fila(cubeta, segundos)))
+            cubeta = estado['cubetas'][segundos] = _cubeta_vacia(inicio)
+        _acumular_en_cubeta(cubeta, valores, estado['ultimos_valores'], dt)
+
+    estado['ultimo_ts'] = ts
+    estado['ultimos_valores'] = valores
+    return cerradas
+
+
+def _obtener_estado(carpeta, sensor_id):
+    """
+    Estado del sensor. La primera vez se reconstruyen las cubetas abiertas
+    con las muestras crudas del histórico: una cubeta solo se escribe al
+    cerrarse, así que tras un reinicio sus muestras siguen estando ahí. Las
+    cubetas que se cierran durante la reconstrucción y que aún no estaban
+    escritas (por ejemplo, al activar los agregados sobre un histórico
+    existente) se escriben en ese momento.
+    """
+    clave = historico.carpeta_sensor(carpeta, sensor_id)
+    with _lock_estados:
+        estado = _estados.get(clave)
+        if estado is not None:
+            return estado
+
+        estado = {'cubetas': {segundos: None for segundos in NIVELES}, 'ultimo_ts': None, 'ultimos_valores': None}
+        escritas_hasta = {}
+        for segundos in NIVELES:
+            ultima = leer_agregados(carpeta, sensor_id, segundos, 1)
+            escritas_hasta[segundos] = anillo.a_epoch(ultima[-1]['timestamp']) if ultima else -math.inf
+
+        for registro in historico.leer_registros(carpeta, sensor_id):
+            for segundos, fila in _acumular(estado, anillo.a_epoch(registro['timestamp']), registro):
+                if anillo.a_epoch(fila['timestamp']) > escritas_hasta[segundos]:
+                    _escribir_fila(carpeta, sensor_id, segundos, fila)
+
+        _estados[clave] = estado
+        return estado
+
+
+def _escribir_fila(carpeta, sensor_id, segundos, fila):
+    historico.anexar_registro(
+        _carpeta_agregados(carpeta, sensor_id), nombre_nivel(segundos), fila, NIVELES[segundos]
+    )
+
+
+def acumular_registro(carpeta, sensor_id, registro):
+    """
+    Incorpora un registro crudo (ya guardado en el histórico) a los agregados
+    del sensor y escribe las filas de las cubetas que se cierran.
+    """
+    estado = _obtener_estado(carpeta, sensor_id)
+    ts = anillo.a_epoch(registro['timestamp'])
+    if estado['ultimo_ts'] is not None and ts <= estado['ultimo_ts']:
+        return
+
+    for segundos, fila in _acumular(estado, ts, registro):
+        _escribir_fila(carpeta, sensor_id, segundos, fila)
+
+
+def elegir_nivel(ventana_segundos):
+    """
+    Nivel más fino que responde la ventana con a lo sumo MAX_FILAS_CONSULTA filas.
+    """
+    for segundos in sorted(NIVELES):
+        if ventana_segundos / segundos <= MAX_FILAS_CONSULTA:
+            return segundos
+    return max(NIVELES)
+
+
+def leer_agregados(carpeta, sensor_id, segundos, max_filas=None):
+    """
+    Filas agregadas de un nivel, en orden cronológico.
+    """
+    return historico.leer_registros(_carpeta_agregados(carpeta, sensor_id), nombre_nivel(segundos), max_filas)
+
+
+def consultar_agregados(carpeta, sensor_id, segundos, inicio=None, fin=None, canales=None):
+    """
+    Filas agregadas de un nivel cuyas cubetas se solapan con [inicio, fin]
+    (ver historico.consultar_rango para los tipos aceptados). Con `canales`
+    se incluyen también sus columnas _min, _max e _integral.
+    """
+    desde = historico.a_segundos(inicio)
+    if desde is not None:
+        # Incluye la cubeta que contiene el inicio del rango
+        desde -= desde % segundos
+    if canales is not None:
+        canales = ['segundos', 'n'] + [
+            f"{canal}{sufijo}" for canal in canales for sufijo in ('', '_min', '_max', '_integral')
+        ]
+    return historico.consultar_rango(
+        _carpeta_agregados(carpeta, sensor_id), nombre_nivel(segundos), desde, fin, canales
+    )
+
+
+def existen_agregados(carpeta, sensor_id, segundos):
+    return os.path.isdir(os.path.join(_carpeta_agregados(carpeta, sensor_id), nombre_nivel(segundos)))
@@ -0,0 +1,181 @@
+"""
+Buffer circular binario, mapeado en memoria, para el histórico de un sensor.
+
+Cada sensor usa un archivo de tamaño fijo con una cabecera de 64 bytes y
+`capacidad` registros de ancho fijo (timestamp + los diez canales que guarda
+actualizar_historico, todos float64). Escribir una muestra es actualizar un
+registro en su lugar y avanzar el contador de escrituras de la cabecera; el
+dashboard puede mapear el mismo archivo en solo lectura y obtener una vista
+NumPy estructurada sin copiar ni parsear nada.
+
+Los timestamps se guardan como segundos desde 1970-01-01 en hora local, sin
+zona horaria, igual que los timestamps ISO del histórico en JSON.
+"""
+
+import mmap
+import os
+import struct
+from datetime import datetime, timedelta
+
+import numpy as np
+
+CANALES = (
+    'ActivePower', 'TotalPowerFactor', 'RelativeTHDVoltage', 'Frequency',
+    'V1', 'V2', 'V3', 'I1', 'I2', 'I3'
+)
+
+ESTRUCTURA = np.dtype([('timestamp', '<f8')] + [(canal, '<f8') for canal in CANALES])
+
+# Cabecera: firma, versión, número de canales, capacidad y total de escrituras.
+# La cabeza y la cantidad de registros válidos se derivan del total de escrituras,
+# así un lector ve un estado consistente con una sola lectura de 8 bytes.
+FIRMA = b'IOTANILL'
+VERSION = 1
+FORMATO_CABECERA = '<8sHHIQ'
+OFFSET_ESCRITOS = struct.calcsize('<8sHHI')
+TAMANO_CABECERA = 64
+
+EXTENSION = '.anillo'
+
+EPOCA = datetime(1970, 1, 1)
+
+
+# ===== CONVERSIÓN DE TIEMPO =====
+def a_epoch(timestamp_iso):
+    return (datetime.fromisoformat(timestamp_iso) - EPOCA).total_seconds()
+
+
+def desde_epoch(segundos):
+    return EPOCA + timedelta(seconds=float(segundos))
+
+
+# ===== CABECERA =====
+def _leer_cabecera(buffer):
+    firma, version, canales, capacidad, escritos = struct.unpack_from(FORMATO_CABECERA, buffer, 0)
+    if firma != FIRMA or version != VERSION or canales != len(CANALES):
+        raise ValueError("Archivo de anillo con formato desconocido")
+    return capacidad, escritos
+
+
+def _crear(ruta, capacidad, registros=None):
+    """
+    Crea (o reemplaza de forma atómica) un archivo de anillo vacío con la
+    capacidad indicada, opcionalmente precargado con registros ordenados.
+    """
+    registros = registros[-capacidad:] if registros is not None else np.empty(0, dtype=ESTRUCTURA)
+    temporal = ruta + '.tmp'
+    with open(temporal, 'wb') as f:
+        cabecera = struct.pack(FORMATO_CABECERA, FIRMA, VERSION, len(CANALES), capacidad, len(registros))
+        f.write(cabecera.ljust(TAMANO_CABECERA, b'\0'))
+        f.write(registros.tobytes())
+        f.truncate(TAMANO_CABECERA + capacidad * ESTRUCTURA.itemsize)
+    os.replace(temporal, ruta)
+
+
+# ===== ESCRITURA =====
+def abrir_escritura(ruta, capacidad, registros_iniciales=None):
+    """
+    Abre (creando si hace falta) el anillo de un sensor para escritura. Un
+    anillo nuevo se precarga con registros_iniciales; si el archivo existe con
+    otra capacidad se redimensiona conservando los registros más recientes.
+    """
+    if os.path.exists(ruta):
+        with open(ruta, 'rb') as f:
+            capacidad_actual, _ = _leer_cabecera(f.read(TAMANO_CABECERA))
+        if capacidad_actual != capacidad:
+            _crear(ruta, capacidad, np.array(leer_ordenado(abrir_lectura(ruta))))
+    else:
+        _crear(ruta, capacidad, registros_iniciales)
+
+    with open(ruta, 'r+b') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_WRITE)
+
+    _, escritos = _leer_cabecera(mm)
+    return {
+        'mmap': mm,
+        'capacidad': capacidad,
+        'escritos': escritos,
+        'vista': np.frombuffer(mm, dtype=ESTRUCTURA, count=capacidad, offset=TAMANO_CABECERA)
+    }
+
+
+def escribir(anillo, timestamp, valores):
+    """
+    Escribe un registro en la cabeza del anillo. Primero se escribe el registro
+    y después se publica el nuevo total de escrituras en la cabecera.
+    """
+    cabeza = anillo['escritos'] % anillo['capacidad']
+    anillo['vista'][cabeza] = (timestamp,) + tuple(
+        np.nan if valores.get(canal) is None else float(valores[canal]) for canal in CANALES
+    )
+    anillo['escritos'] += 1
+    struct.pack_into('<Q', anillo['mmap'], OFFSET_ESCRITOS, anillo['escritos'])
+    return min(anillo['escritos'], anillo['capacidad'])
+
+
+# ===== LECTURA =====
+def abrir_lectura(ruta):
+    """
+    Mapea el anillo en solo lectura. La vista devuelta comparte memoria con el
+    archivo: refleja las escrituras del recolector sin volver a abrirlo.
+    """
+    with open(ruta, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    capacidad, _ = _leer_cabecera(mm)
+    return {
+        'mmap': mm,
+        'capacidad': capacidad,
+        'vista': np.frombuffer(mm, dtype=ESTRUCTURA, count=capacidad, offset=TAMANO_CABECERA)
+    }
+
+
+def escritos(anillo):
+    """
+    Total de registros escritos desde la creación del anillo (monótono).
+    """
+    return struct.unpack_from('<Q', anillo['mmap'], OFFSET_ESCRITOS)[0]
+
+
+def leer_ordenado(anillo):
+    """
+    Devuelve los registros válidos en orden cronológico. Mientras el anillo no
+    ha dado la vuelta es una vista sin copia; después se unen los dos tramos.
+    """
+    total = escritos(anillo)
+    capacidad = anillo['capacidad']
+    vista = anillo['vista']
+
+    if total <= capacidad:
+        return vista[:total]
+
+    cabeza = total % capacidad
+    if cabeza == 0:
+        return vista
+    return np.concatenate((vista[cabeza:], vista[:cabeza]))
+
+
+def desde_registros(registros):
+    """
+    Convierte la lista de diccionarios del histórico en JSON a un arreglo con
+    la estructura del anillo.
+    """
+    arreglo = np.empty(len(registros), dtype=ESTRUCTURA)
+    for i, registro in enumerate(registros):
+        arreglo[i] = (a_epoch(registro['timestamp']),) + tuple(
+            np.nan if registro.get(canal) is None else float(registro[canal]) for canal in CANALES
+        )
+    return arreglo
+
+
+def a_registros(arreglo):
+    """
+    Convierte registros del anillo a la lista de diccionarios que usa el resto
+    del sistema (mismo formato que el histórico en JSON).
+    """
+    registros = []
+    for fila in arreglo.tolist():
+        registro = {'timestamp': desde_epoch(fila[0]).isoformat()}
+        registro.update(zip(CANALES, fila[1:]))
+        registros.append(registro)
+    return registros
@@ -0,0 +1,315 @@
+"""
+Detección de anomalías en línea, al momento de la ingesta.
+
+Por sensor y por canal se mantiene un estado de tamaño fijo que se actualiza
+en O(1) con cada muestra, sin volver a leer el histórico:
+
+- Media y varianza acumuladas (Welford), como referencia de largo plazo.
+- Media y varianza con suavizado exponencial (EWMA): una muestra a más de
+  UMBRAL_Z desviaciones de ese nivel es un valor atípico.
+- Líneas base por franja horaria (Welford por hora del día): el consumo de
+  las 3 a. m. se compara con el de otras madrugadas, no con el de las 11.
+- Cantidad de muestras seguidas con el mismo valor: un medidor que repite
+  exactamente la misma lectura durante MUESTRAS_PEGADO muestras está pegado.
+
+Los canales son ActivePower, TotalPowerFactor, RelativeTHDVoltage y el
+desbalance entre fases de V1-V3 e I1-I3 (máxima desviación respecto del
+promedio de las tres fases, en %, como en la norma NEMA), que además se marca
+por encima de UMBRAL_DESBALANCE.
+
+Cada llamada a observar() devuelve las banderas activas del sensor. Las
+banderas se publican en historico/<id>/anomalias.json (solo cuando cambia
+el conjunto de banderas) y en el canal de eventos del recolector, para que
+el dashboard las muestre en el mapa sin calcular nada.
+"""
+
+import json
+import math
+import os
+import threading
+
+import anillo
+import historico
+
+CANALES_KPI = ('ActivePower', 'TotalPowerFactor', 'RelativeTHDVoltage')
+CANALES_DESBALANCE = {'desbalance_V': ('V1', 'V2', 'V3'), 'desbalance_I': ('I1', 'I2', 'I3')}
+CANALES = CANALES_KPI + tuple(CANALES_DESBALANCE)
+
+# Peso de cada muestra nueva en la EWMA (0.05 = memoria de unas 20 muestras)
+ALFA_EWMA = 0.05
+
+# Desviaciones a partir de las cuales una muestra es atípica (frente a la
+# EWMA y frente a la línea base de su franja horaria)
+UMBRAL_Z = 4.0
+UMBRAL_Z_FRANJA = 4.0
+
+# Muestras antes de evaluar la EWMA y cada franja horaria
+MIN_MUESTRAS = 30
+MIN_MUESTRAS_FRANJA = 20
+
+# Duración de cada franja de la línea base por hora del día
+SEGUNDOS_FRANJA = 3600
+
+# Desviación mínima por canal: un canal casi constante no vuelve atípica
+# cualquier variación pequeña
+DESVIACION_MINIMA = {
+    'ActivePower': 0.5,
+    'TotalPowerFactor': 0.005,
+    'RelativeTHDVoltage': 0.05,
+    'desbalance_V': 0.1,
+    'desbalance_I': 0.5
+}
+
+# Muestras seguidas con exactamente el mismo valor para marcar un canal pegado
+MUESTRAS_PEGADO = 20
+
+# Desbalance entre fases (%) que se marca siempre
+UMBRAL_DESBALANCE = {'desbalance_V': 2.0, 'desbalance_I': 20.0}
+
+ARCHIVO_BANDERAS = 'anomalias.json'
+
+# Estado por sensor y banderas activas
+_estados = {}
+_banderas = {}
+_lock_anomalias = threading.Lock()
+
+
+# ===== CANALES DERIVADOS =====
+def desbalance(valores):
+    """
+    Máxima desviación de las fases respecto de su promedio, en %, o None si
+    falta alguna fase o el promedio es cero.
+    """
+    if any(v is None or not math.isfinite(v) for v in valores):
+        return None
+    promedio = sum(valores) / len(valores)
+    if promedio == 0:
+        return None
+    return max(abs(v - promedio) for v in valores) / abs(promedio) * 100
+
+
+def valores_canales(registro):
+    """
+    {canal: valor} de los canales analizados (None si falta o no es finito).
+    """
+    valores = {}
+    for canal in CANALES_KPI:
+        valor = registro.get(canal)
+        valores[canal] = valor if valor is not None and math.isfinite(valor) else None
+    for canal, fases in CANALES_DESBALANCE.items():
+        valores[canal] = desbalance([registro.get(fase) for fase in fases])
+    return valores
+
+
+# ===== ESTADÍSTICAS INCREMENTALES =====
+def _welford_vacio():
+    return {'n': 0, 'media': 0.0, 'm2': 0.0}
+
+
+def _welford(acumulado, valor):
+    acumulado['n'] += 1
+    delta = valor - acumulado['media']
+    acumulado['media'] += delta / acumulado['n']
+    acumulado['m2'] += delta * (valor - acumulado['media'])
+
+
+def _varianza(acumulado):
+    return acumulado['m2'] / (acumulado['n'] - 1) if acumulado['n'] > 1 else 0.0
+
+
+def _canal_vacio():
+    return {
+        'welford': _welford_vacio(),
+        'ewma': None,
+        'ewma_var': 0.0,
+        'franjas': {},
+        'repetido': 0,
+        'anterior': None
+    }
+
+
+def _z(canal, valor, media, varianza):
+    return (valor - media) / max(math.sqrt(varianza), DESVIACION_MINIMA[canal])
+
+
+def _evaluar(canal, estado, valor, franja):
+    """
+    Banderas de una muestra según el estado previo del canal. Devuelve una
+    lista de (tipo, esperado, z).
+    """
+    banderas = []
+    if estado['welford']['n'] >= MIN_MUESTRAS:
+        z = _z(canal, valor, estado['ewma'], estado['ewma_var'])
+        if abs(z) > UMBRAL_Z:
+            banderas.append(('atipico', estado['ewma'], z))
+
+    base = estado['franjas'].get(franja)
+    if base is not None and base['n'] >= MIN_MUESTRAS_FRANJA:
+        z = _z(canal, valor, base['media'], _varianza(base))
+        if abs(z) > UMBRAL_Z_FRANJA:
+            banderas.append(('franja', base['media'], z))
+
+    if estado['repetido'] + 1 >= MUESTRAS_PEGADO and valor == estado['anterior']:
+        banderas.append(('pegado', valor, None))
+
+    if canal in UMBRAL_DESBALANCE and valor > UMBRAL_DESBALANCE[canal]:
+        banderas.append(('desbalance', UMBRAL_DESBALANCE[canal], None))
+    return banderas
+
+
+def _actualizar(estado, valor, franja):
+    _welford(estado['welford'], valor)
+    _welford(estado['franjas'].setdefault(franja, _welford_vacio()), valor)
+
+    if estado['ewma'] is None:
+        estado['ewma'] = valor
+    else:
+        # Media y varianza exponenciales en una sola pasada
+        delta = valor - estado['ewma']
+        incremento = ALFA_EWMA * delta
+        estado['ewma'] += incremento
+        estado['ewma_var'] = (1 - ALFA_EWMA) * (estado['ewma_var'] + delta * incremento)
+
+    estado['repetido'] = estado['repetido'] + 1 if valor == estado['anterior'] else 1
+    estado['anterior'] = valor
+
+
+def _franja(ts):
+    return int(ts % 86400 // SEGUNDOS_FRANJA)
+
+
+def _observar(estado, ts, registro):
+    """
+    Evalúa y después incorpora una muestra. Devuelve las banderas como
+    diccionarios (sin 'desde').
+    """
+    franja = _franja(ts)
+    banderas = []
+    for canal, valor in valores_canales(registro).items():
+        if valor is None:
+            continue
+        canal_estado = estado['canales'][canal]
+        for tipo, esperado, z in _evaluar(canal, canal_estado, valor, franja):
+            banderas.append({
+                'canal': canal,
+                'tipo': tipo,
+                'valor': round(valor, 4),
+                'esperado': round(esperado, 4),
+                'z': None if z is None else round(z, 2)
+            })
+        _actualizar(canal_estado, valor, franja)
+    estado['ultimo_ts'] = ts
+    return banderas
+
+
+# ===== ESTADO POR SENSOR =====
+def _estado_vacio():
+    return {'canales': {canal: _canal_vacio() for canal in CANALES}, 'ultimo_ts': None}
+
+
+def _obtener_estado(carpeta, sensor_id):
+    """
+    Estado del sensor. La primera vez se entrena con las muestras que conserva
+    el histórico (sin publicar banderas), así un reinicio no deja al detector
+    sin referencia.
+    """
+    clave = historico.carpeta_sensor(carpeta, sensor_id)
+    with _lock_anomalias:
+        estado = _estados.get(clave)
+        if estado is not None:
+            return estado
+
+    estado = _estado_vacio()
+    for registro in historico.leer_registros(carpeta, sensor_id):
+        _observar(estado, anillo.a_epoch(registro['timestamp']), registro)
+
+    with _lock_anomalias:
+        return _estados.setdefault(clave, estado)
+
+
+def observar(carpeta, sensor_id, registro):
+    """
+    Incorpora un registro nuevo del sensor (ya guardado en el histórico o
+    anotado en el diario del recolector, pendiente de escribir) y devuelve
+    las banderas activas del sensor. Si el conjunto de banderas cambió, se
+    publica en historico/<id>/anomalias.json.
+    """
+    estado = _obtener_estado(carpeta, sensor_id)
+    clave = historico.carpeta_sensor(carpeta, sensor_id)
+    ts = anillo.a_epoch(registro['timestamp'])
+    with _lock_anomalias:
+        if estado['ultimo_ts'] is not None and ts <= estado['ultimo_ts']:
+            return _banderas.get(clave, [])
+        banderas = _observar(estado, ts, registro)
+
+        anteriores = {(b['canal'], b['tipo']): b['desde'] for b in _banderas.get(clave, [])}
+        for bandera in banderas:
+            bandera['desde'] = anteriores.get((bandera['canal'], bandera['tipo']), registro['timestamp'])
+        cambiaron = set(anteriores) != {(b['canal'], b['tipo']) for b in banderas}
+        _banderas[clave] = banderas
+
+    if cambiaron:
+        publicar_banderas(carpeta, sensor_id, registro['timestamp'], banderas)
+    return banderas
+
+
+def estadisticas(carpeta, sensor_id):
+    """
+    Resumen del estado de cada canal del sensor (media y desviación
+    acumuladas y exponenciales), o None si todavía no hay estado.
+    """
+    with _lock_anomalias:
+        estado = _estados.get(historico.carpeta_sensor(carpeta, sensor_id))
+        if estado is None:
+            return None
+        return {
+            canal: {
+                'n': datos['welford']['n'],
+                'media': datos['welford']['media'],
+                'desviacion': math.sqrt(_varianza(datos['welford'])),
+                'ewma': datos['ewma'],
+                'ewma_desviacion': math.sqrt(datos['ewma_var'])
+            }
+            for canal, datos in estado['canales'].items()
+        }
+
+
+# ===== PUBLICACIÓN =====
+def ruta_banderas(carpeta, sensor_id):
+    return os.path.join(historico.carpeta_sensor(carpeta, sensor_id), ARCHIVO_BANDERAS)
+
+
+def publicar_banderas(carpeta, sensor_id, timestamp, banderas):
+    ruta = ruta_banderas(carpeta, sensor_id)
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    temporal = ruta + '.tmp'
+    with open(temporal, 'w', encoding='utf-8') as f:
+        json.dump({'timestamp': timestamp, 'banderas': banderas}, f, ensure_ascii=False)
+    os.replace(temporal, ruta)
+
+
+def leer_banderas(carpeta, sensor_id):
+    """
+    Últimas banderas publicadas del sensor ([] si no hay).
+    """
+    try:
+        with open(ruta_banderas(carpeta, sensor_id), 'r', encoding='utf-8') as f:
+            return json.load(f).get('banderas', [])
+    except (FileNotFoundError, ValueError):
+        return []
+
+
+def describir(bandera):
+    """
+    Texto corto de una bandera para el dashboard.
+    """
+    tipos = {
+        'atipico': 'valor atípico',
+        'franja': 'fuera de lo habitual a esta hora',
+        'pegado': 'lectura repetida',
+        'desbalance': 'desbalance entre fases'
+    }
+    texto = f"{bandera['canal']}: {tipos.get(bandera['tipo'], bandera['tipo'])} ({bandera['valor']:g}"
+    if bandera['tipo'] in ('atipico', 'franja'):
+        texto += f", esperado {bandera['esperado']:g}, z={bandera['z']:g}"
+    return texto + ")"
@@ -1,94 +1,450 @@
+import argparse
 import dash
-from dash import html, dcc, Output, Input, callback
+from dash import html, dcc, Output, Input, State, Patch, callback, ctx
+from flask import Response
 import plotly.graph_objects as go
-import json
+import hashlib
 import numpy as np
-import os
-import glob
-from datetime import datetime
+import threading
+import time
+
+import anomalias
+import cache
+import compartido
+import eventos
+import historico
+import instantanea
+import sensores
+import series
+
+CARPETA_HISTORICO = './historico'
+
+# Cada cuántos segundos se revisan los históricos en busca de registros nuevos
+# (solo mientras no hay canal de eventos con el recolector)
+REFRESCO_SEGUNDOS = 5
+
+# Canales de eventos del recolector: uno por fragmento, en PUERTO_EVENTOS + k
+# (igual que PUERTO_EVENTOS y FRAGMENTOS en getter.py). Con todos los canales
+# conectados las muestras llegan apenas se escriben y el disco no se revisa;
+# mientras falte alguno se sigue revisando. [] = solo revisión del disco
+FRAGMENTOS_RECOLECTOR = 1
+PUERTO_EVENTOS = 9200
+URLS_EVENTOS = [f"http://127.0.0.1:{PUERTO_EVENTOS + k}/eventos" for k in range(FRAGMENTOS_RECOLECTOR)]
+ESPERA_RECONEXION = 5
+
+# Actualizaciones parciales (dash.Patch) de la gráfica de tendencia antes de
+# volver a dibujarla completa (y a reducir sus series)
+MAX_PARCHES_LINEAS = 120
+
+# Resultados de callbacks en caché (figuras y tabla por entradas y versión de
+# los datos) y carpeta compartida por varios procesos del dashboard para un
+# segundo nivel en disco (None = solo en memoria)
+MAX_ENTRADAS_CACHE = 256
+CARPETA_CACHE = None
+
+# Registros que conserva el dashboard por sensor (24 horas a 30 segundos)
+MAX_REGISTROS_DASHBOARD = 2880
+
+# Arranque: se carga la instantánea que escribe el recolector (ver
+# instantanea.py) y lo que falte se lee del histórico repartido entre
+# PROCESOS_CARGA procesos (None = uno por CPU, 1 = sin procesos)
+USAR_INSTANTANEA = True
+PROCESOS_CARGA = None
+
+# Datos de varios procesos del dashboard (ver compartido.py): 'local' = cada
+# proceso carga y refresca sus propios datos; 'compartido' = un cargador
+# (python app.py --cargador) mantiene las series en memoria compartida y los
+# workers (por ejemplo, gunicorn -w 4 app:server) las leen sin copiarlas
+MODO_DATOS = 'local'
+NOMBRE_PLANO = 'iot_viz'
+
+# Cada cuántos segundos los workers revisan si hay datos nuevos en el plano
+# compartido (y como mucho cada cuánto publica el cargador)
+INTERVALO_PLANO = 0.25
+
+# Puntos por serie que se envían a la gráfica de tendencia (del orden del ancho
+# del gráfico en píxeles) y método de reducción: 'lttb' o 'min_max'
+PUNTOS_MAX_LINEAS = 600
+METODO_REDUCCION = 'lttb'
 
 # ===== CONFIGURACIÓN DE UBICACIONES =====
-ubicaciones_bloques = {
-    'SM_B3_RECT': {'lat': 6.243467736814663, 'lon': -75.58954632082104, 'nombre': 'Bloque 03 - Rectoria'},
-    'SM_B4_PRIM': {'lat': 6.243449072723936, 'lon': -75.58845868506315, 'nombre': 'Bloque 04 - Primaria'},
-    'SM_B10_ARQ': {'lat': 6.240100188926724, 'lon': -75.5897769907676, 'nombre': 'Bloque 10 - Arquidiseño'},
-    'SM_B12_DERE': {'lat': 6.243161112214128, 'lon': -75.59074392708648, 'nombre': 'Bloque 12 - Derecho'},
-    'SM_B15_BIBL': {'lat': 6.242413214051972, 'lon': -75.59040596877229, 'nombre': 'Bloque 15 - Biblioteca'},
-    'SM_B17_POLI': {'lat': 6.24181192187392, 'lon': -75.59048647758016, 'nombre': 'Bloque 17 - Polideportivo'},
-    'SM_B18_PARQ': {'lat': 6.242081617459467, 'lon': -75.59131711957072, 'nombre': 'Bloque 18 - Parqueadero'},
-    'SM_B5_BACH': {'lat': 6.2422549273955745, 'lon': -75.58828085911723, 'nombre': 'Bloque 05 - Bachillerato'},
-    'SM_B7_CTIC': {'lat': 6.241906666238077, 'lon': -75.58933076643933, 'nombre': 'Bloque 07 - CTIC'},
-    'SM_B7_TAC': {'lat': 6.241953236208937, 'lon': -75.58939213634756, 'nombre': 'Bloque 07 - TAC'},
-    'SM_B8_AA': {'lat': 6.240980072888442, 'lon': -75.58884425260584, 'nombre': 'Bloque 08 - AA'},
-    'SM_B8_CPA': {'lat': 6.2409894049830035, 'lon': -75.58940885757534, 'nombre': 'Bloque 08 - Comunicaciones'},
-    'SM_B8_LABS': {'lat': 6.2412053762679, 'lon': -75.58934448456219, 'nombre': 'Bloque 08 - Labs'},
-    'SM_B9_SFA1': {'lat': 6.240625503626784, 'lon': -75.58945280690212, 'nombre': 'Bloque 09 - SFA1'},
-    'SM_B9_SFA2': {'lat': 6.240612838632484, 'lon': -75.58923621853498, 'nombre': 'Bloque 09 - SFA2'},
-    'SM_ECOVILLA': {'lat': 6.241485389390946, 'lon': -75.58882785221495, 'nombre': 'Ecovilla'}
-}
+# Nombre y coordenadas de cada medidor, del registro compartido con getter.py
+# (ver sensores.py)
+ARCHIVO_SENSORES = sensores.ARCHIVO_SENSORES
+ubicaciones_bloques = sensores.ubicaciones(sensores.cargar_sensores(ARCHIVO_SENSORES))
 
 
 # ===== FUNCIÓN PARA CARGAR DATOS JSON =====
+def columnas_registros(registros):
+    """
+    Convierte registros del histórico (diccionarios con timestamp ISO) a
+    columnas NumPy de los KPIs: (tiempos en ms, {kpi: valores}).
+    """
+    return instantanea.columnas_registros(registros, KPIS)
+
+
+def datos_sensor(sensor_id, serie, posicion, banderas):
+    """
+    Datos de un sensor en datos_bloques a partir de su serie columnar.
+    """
+    return {
+        **{kpi: float(series.columnas_serie(serie, kpi)[1][-1]) for kpi in KPIS},
+        'nombre': ubicaciones_bloques[sensor_id]['nombre'],
+        'lat': ubicaciones_bloques[sensor_id]['lat'],
+        'lon': ubicaciones_bloques[sensor_id]['lon'],
+        'serie': serie,
+        'posicion': posicion,
+        'anomalias': banderas
+    }
+
+
+def cargar_sensor(sensor_id):
+    """
+    Carga el histórico de un sensor en una serie columnar (ver
+    instantanea.cargar_sensor).
+    """
+    cargado = instantanea.cargar_sensor(CARPETA_HISTORICO, sensor_id, KPIS, MAX_REGISTROS_DASHBOARD)
+    if cargado is None:
+        return None
+    return datos_sensor(sensor_id, cargado['serie'], cargado['posicion'],
+                        anomalias.leer_banderas(CARPETA_HISTORICO, sensor_id))
+
+
 def cargar_datos_json():
+    """
+    Carga todos los sensores: primero de las instantáneas del recolector y,
+    los que no estén ahí, de su histórico en paralelo.
+    """
     datos_energia = {}
-    archivos_json = glob.glob("./historico/SM_*.json")
+    sensores_historico = historico.listar_sensores(CARPETA_HISTORICO)
 
-    if not archivos_json:
-        print("⚠️ No se encontraron archivos en ./historico/.")
+    if not sensores_historico:
+        print(f"⚠️ No se encontraron históricos en {CARPETA_HISTORICO}/.")
         return {}
 
-    print(f"📂 Encontrados {len(archivos_json)} archivos JSON en ./historico/")
+    print(f"📂 Encontrados {len(sensores_historico)} históricos en {CARPETA_HISTORICO}/")
+    sensores_historico = [s for s in sensores_historico if s in ubicaciones_bloques]
 
-    for archivo in archivos_json:
-        try:
-            with open(archivo, 'r', encoding='utf-8') as f:
-                data = json.load(f)
+    guardados = {}
+    if USAR_INSTANTANEA:
+        guardados = instantanea.leer_instantaneas(CARPETA_HISTORICO, KPIS, MAX_REGISTROS_DASHBOARD)
+    for sensor_id in sensores_historico:
+        if sensor_id in guardados:
+            datos = guardados[sensor_id]
+            datos_energia[sensor_id] = datos_sensor(sensor_id, datos['serie'], datos['posicion'], datos['anomalias'])
+    if datos_energia:
+        print(f"⚡ {len(datos_energia)} sensores desde la instantánea del recolector")
+
+    faltantes = [s for s in sensores_historico if s not in datos_energia]
+    if faltantes:
+        print(f"📖 Leyendo {len(faltantes)} históricos...")
+        cargados = instantanea.cargar_sensores(
+            CARPETA_HISTORICO, faltantes, KPIS, MAX_REGISTROS_DASHBOARD, PROCESOS_CARGA
+        )
+        for sensor_id, cargado in cargados.items():
+            if isinstance(cargado, str):
+                print(f"❌ Error leyendo histórico de {sensor_id}: {cargado}")
+            elif cargado is not None:
+                datos_energia[sensor_id] = datos_sensor(
+                    sensor_id, cargado['serie'], cargado['posicion'],
+                    anomalias.leer_banderas(CARPETA_HISTORICO, sensor_id)
+                )
+
+    return datos_energia
+
+
+def columnas_sensor(datos, kpi):
+    """
+    Devuelve (tiempos en ms, valores) del KPI de un sensor como vistas NumPy.
+    """
+    return series.columnas_serie(datos['serie'], kpi)
+
+
+# ===== REFRESCO INCREMENTAL =====
+# refrescar_datos y aplicar_evento reemplazan datos_bloques por turnos
+_lock_datos = threading.Lock()
+# Avisa a los navegadores suscritos (ruta /eventos) que cambió version_datos
+_cambio_version = threading.Condition()
+_canales_conectados = 0
+_lock_canales = threading.Lock()
+
+
+def _nueva_version():
+    global version_datos
+    with _cambio_version:
+        version_datos += 1
+        _cambio_version.notify_all()
 
-            sensor_id = data.get("sensor_id")
-            if not sensor_id or sensor_id not in ubicaciones_bloques:
+
+def _incorporar(datos, nuevos):
+    """
+    Agrega registros a la serie columnar del sensor y devuelve sus datos
+    actualizados, o None si todos ya estaban en la serie. Un registro anterior
+    al último de la serie (por ejemplo, uno del diario del recolector que
+    llega al reconectarse el canal) se intercala en su lugar.
+    """
+    tiempos, columnas = columnas_registros(nuevos)
+    ultimo_ts = series.ultimo_tiempo(datos['serie'])
+    if not series.intercalar_serie(datos['serie'], tiempos, columnas, MAX_REGISTROS_DASHBOARD):
+        return None
+
+    if ultimo_ts is not None and tiempos.max() < ultimo_ts:
+        # Solo llegaron muestras atrasadas: los valores actuales no cambian
+        return {**datos}
+    ultimo = nuevos[int(tiempos.argmax())]
+    return {
+        **datos,
+        'ActivePower': ultimo.get('ActivePower', 0),
+        'TotalPowerFactor': ultimo.get('TotalPowerFactor', 0.9),
+        'RelativeTHDVoltage': ultimo.get('RelativeTHDVoltage', 2.0)
+    }
+
+
+def refrescar_datos():
+    """
+    Incorpora los registros que el recolector agregó desde la última revisión.
+    Por cada sensor solo se lee la cola nueva de su histórico y se agrega a su
+    serie columnar; un sensor se recarga completo únicamente si su archivo
+    cambió de forma no incremental.
+
+    datos_bloques no se modifica en el lugar: se construye una copia y se
+    reemplaza de una vez, así los callbacks que se estén ejecutando siguen
+    viendo una foto consistente.
+    """
+    global datos_bloques
+
+    with _lock_datos:
+        bloques = dict(datos_bloques)
+        cambios = False
+
+        for sensor_id in historico.listar_sensores(CARPETA_HISTORICO):
+            if sensor_id not in ubicaciones_bloques:
                 continue
 
-            registros = data.get("registros", [])
-            if not registros:
+            datos = bloques.get(sensor_id)
+            nuevos = None
+            if datos is not None:
+                posicion = dict(datos['posicion'])
+                nuevos = historico.leer_nuevos(CARPETA_HISTORICO, sensor_id, posicion)
+
+            if nuevos is None:
+                datos = cargar_sensor(sensor_id)
+                if datos is None:
+                    continue
+                bloques[sensor_id] = datos
+                cambios = True
+                continue
+
+            actualizados = _incorporar(datos, nuevos) if nuevos else None
+            if actualizados is not None:
+                # Las banderas del recolector cambian junto con las muestras
+                actualizados['anomalias'] = anomalias.leer_banderas(CARPETA_HISTORICO, sensor_id)
+            bloques[sensor_id] = {**(actualizados or datos), 'posicion': posicion}
+            cambios = cambios or actualizados is not None
+
+        datos_bloques = bloques
+    if cambios:
+        _nueva_version()
+    return cambios
+
+
+def aplicar_evento(evento):
+    """
+    Incorpora las muestras publicadas por el recolector ({'registros':
+    {sensor_id: registro o lista de registros}, 'anomalias': {sensor_id:
+    banderas}}) sin leer el disco, salvo para cargar un sensor que todavía no
+    estaba en memoria. Las listas son las muestras del diario del recolector
+    que todavía no están en el histórico (ver eventos_pendientes en
+    getter.py). La posición de lectura de cada sensor no avanza: si después
+    se vuelve a revisar el disco, los registros que ya llegaron por el canal
+    se descartan por timestamp.
+    """
+    global datos_bloques
+
+    with _lock_datos:
+        bloques = dict(datos_bloques)
+        cambios = False
+        for sensor_id, registro in evento.get('registros', {}).items():
+            if sensor_id not in ubicaciones_bloques:
                 continue
+            datos = bloques.get(sensor_id)
+            if datos is None:
+                datos = cargar_sensor(sensor_id)
+                if datos is None:
+                    continue
+                bloques[sensor_id] = datos
+                cambios = True
+                continue
+            actualizados = _incorporar(datos, registro if isinstance(registro, list) else [registro])
+            if actualizados is not None:
+                if sensor_id in evento.get('anomalias', {}):
+                    actualizados['anomalias'] = evento['anomalias'][sensor_id]
+                bloques[sensor_id] = actualizados
+                cambios = True
+        datos_bloques = bloques
+    if cambios:
+        _nueva_version()
+    return cambios
 
-            ultimo = registros[-1]
 
-            datos_energia[sensor_id] = {
-                'ActivePower': ultimo.get('ActivePower', 0),
-                'TotalPowerFactor': ultimo.get('TotalPowerFactor', 0.9),
-                'RelativeTHDVoltage': ultimo.get('RelativeTHDVoltage', 2.0),
-                'nombre': ubicaciones_bloques[sensor_id]['nombre'],
-                'lat': ubicaciones_bloques[sensor_id]['lat'],
-                'lon': ubicaciones_bloques[sensor_id]['lon'],
-                'serie': registros
-            }
+def _bucle_refresco():
+    # La primera revisión es inmediata: lo cargado de una instantánea puede
+    # tener algunos minutos
+    while True:
+        if not (URLS_EVENTOS and _canales_conectados == len(URLS_EVENTOS)):
+            # Con los canales conectados todo llega por los eventos
+            try:
+                refrescar_datos()
+            except Exception as e:
+                print(f"❌ Error refrescando datos: {e}")
+        time.sleep(REFRESCO_SEGUNDOS)
 
-            print(f"✅ {sensor_id}: {datos_energia[sensor_id]['ActivePower']:.1f} kW")
 
+def _suscribir_canal(url):
+    def al_conectar():
+        global _canales_conectados
+        with _lock_canales:
+            _canales_conectados += 1
+        print(f"📣 Conectado al canal de eventos {url}")
+        # Lo escrito mientras no había canal se recupera del disco una vez
+        try:
+            refrescar_datos()
         except Exception as e:
-            print(f"❌ Error leyendo {archivo}: {e}")
+            print(f"❌ Error refrescando datos: {e}")
 
-    return datos_energia
+    def al_desconectar():
+        global _canales_conectados
+        with _lock_canales:
+            _canales_conectados -= 1
+        print(f"⚠️ Canal de eventos {url} desconectado, se revisa el disco mientras tanto")
+
+    def al_recibir(evento):
+        try:
+            aplicar_evento(evento)
+        except Exception as e:
+            print(f"❌ Error aplicando evento de {url}: {e}")
+
+    eventos.suscribir(url, al_recibir, al_conectar, al_desconectar, ESPERA_RECONEXION)
+
+
+def iniciar_refresco():
+    """
+    Hilo que vigila los históricos y agrega los registros nuevos en memoria,
+    e hilos suscritos a los canales de eventos del recolector.
+    """
+    threading.Thread(target=_bucle_refresco, name='refresco-datos', daemon=True).start()
+    for url in URLS_EVENTOS:
+        threading.Thread(target=_suscribir_canal, args=(url,), name='canal-eventos', daemon=True).start()
+
+
+# ===== PLANO DE DATOS COMPARTIDO =====
+_plano = {'lector': None, 'secuencia': None, 'hilo': None}
+_lock_plano = threading.Lock()
+
+
+def sincronizar_plano():
+    """
+    (Workers en modo compartido) Reemplaza datos_bloques por las series del
+    plano compartido si el cargador publicó algo nuevo; los sensores sin
+    cambios conservan sus datos. Devuelve True si hubo cambios.
+    """
+    global datos_bloques
+
+    with _lock_plano:
+        lector = _plano['lector']
+        if lector is None or not compartido.vigente(lector):
+            # Primera conexión o cargador reiniciado
+            lector = compartido.abrir_lectura(compartido.ruta_predeterminada(NOMBRE_PLANO))
+            _plano.update(lector=lector, secuencia=None)
+        if compartido.secuencia(lector) == _plano['secuencia']:
+            return False
+
+        secuencia, series_plano, banderas = compartido.leer(lector, KPIS)
+        anteriores = datos_bloques if _plano['secuencia'] is not None else {}
+        bloques = {}
+        for sensor_id, serie in series_plano.items():
+            if sensor_id not in ubicaciones_bloques:
+                continue
+            previo = anteriores.get(sensor_id)
+            banderas_sensor = banderas.get(sensor_id, [])
+            if (previo is not None and previo['anomalias'] == banderas_sensor
+                    and (previo['serie']['actual']['inicio'], previo['serie']['actual']['fin'])
+                    == (serie['actual']['inicio'], serie['actual']['fin'])):
+                bloques[sensor_id] = previo
+            else:
+                bloques[sensor_id] = datos_sensor(sensor_id, serie, None, banderas_sensor)
+        datos_bloques = bloques
+        _plano['secuencia'] = secuencia
+    _nueva_version()
+    return True
+
+
+def _bucle_plano():
+    while True:
+        time.sleep(INTERVALO_PLANO)
+        try:
+            sincronizar_plano()
+        except FileNotFoundError:
+            # El cargador todavía no creó el plano
+            pass
+        except Exception as e:
+            print(f"❌ Error leyendo el plano de datos compartido: {e}")
+
+
+def conectar_plano():
+    """
+    Primera lectura del plano y arranque del hilo que lo sigue. Se llama en la
+    primera solicitud de cada worker (después del fork de gunicorn).
+    """
+    with _lock_plano:
+        if _plano['hilo'] is not None:
+            return
+        _plano['hilo'] = threading.Thread(target=_bucle_plano, name='plano-datos', daemon=True)
+    try:
+        sincronizar_plano()
+        print(f"🔗 {len(datos_bloques)} sensores en el plano de datos compartido")
+    except FileNotFoundError:
+        print("⚠️ El plano de datos compartido no existe todavía (python app.py --cargador)")
+    _plano['hilo'].start()
 
 
-# ===== GENERAR SERIES TEMPORALES =====
-def generar_datos_temporales():
-    datos_temporales = {}
-    for sensor_id, datos in datos_bloques.items():
-        serie = datos.get('serie', [])
-        if not serie:
+def ejecutar_cargador():
+    """
+    Proceso cargador del modo compartido: carga y refresca los datos igual que
+    un dashboard local y publica cada versión en el plano compartido.
+    """
+    global datos_bloques
+
+    ruta = compartido.ruta_predeterminada(NOMBRE_PLANO)
+    print(f"🚀 Cargador del plano de datos compartido: {ruta}")
+    datos_bloques = cargar_datos_json()
+    inicio = time.perf_counter()
+    publicada = version_datos
+    bloques = datos_bloques
+    plano = compartido.crear(
+        ruta, list(ubicaciones_bloques), KPIS, MAX_REGISTROS_DASHBOARD,
+        {sensor_id: datos['serie'] for sensor_id, datos in bloques.items()},
+        {sensor_id: datos['anomalias'] for sensor_id, datos in bloques.items()}
+    )
+    print(f"✅ {len(bloques)} sensores publicados en {time.perf_counter() - inicio:.2f} s")
+    iniciar_refresco()
+
+    while True:
+        with _cambio_version:
+            _cambio_version.wait_for(lambda: version_datos != publicada, timeout=eventos.INTERVALO_LATIDO)
+            version = version_datos
+        if version == publicada:
             continue
-        datos_temporales[sensor_id] = [
-            {
-                'timestamp': datetime.fromisoformat(p['timestamp']),
-                'ActivePower': p['ActivePower'],
-                'TotalPowerFactor': p['TotalPowerFactor'],
-                'RelativeTHDVoltage': p['RelativeTHDVoltage']
-            }
-            for p in serie
-        ]
-    return datos_temporales
+        bloques = datos_bloques
+        compartido.publicar(
+            plano,
+            {sensor_id: datos['serie'] for sensor_id, datos in bloques.items()},
+            {sensor_id: datos['anomalias'] for sensor_id, datos in bloques.items()}
+        )
+        publicada = version
+        # Como mucho una publicación por intervalo: los eventos que lleguen
+        # mientras tanto salen juntos en la siguiente
+        time.sleep(INTERVALO_PLANO)
 
 
 # ===== KPIS CONFIG =====
@@ -106,16 +462,43 @@ kpis_config = {
     'TotalPowerFactor': {'titulo': '⚡ Eficiencia Energética', 'colorscale': 'RdYlGn', 'unidad': '%'},
     'RelativeTHDVoltage': {'titulo': '⚙️ Calidad Energética', 'colorscale': 'RdYlGn_r', 'unidad': '%'}
 }
+KPIS = tuple(kpis_config)
 
 # ===== CARGA DE DATOS =====
-print("🚀 Iniciando carga de datos...")
-datos_bloques = cargar_datos_json()
-datos_temporales = generar_datos_temporales()
-print(f"✅ {len(datos_bloques)} sensores cargados con datos históricos")
+datos_bloques = {}
+version_datos = 0
+if MODO_DATOS == 'local':
+    print("🚀 Iniciando carga de datos...")
+    datos_bloques = cargar_datos_json()
+    print(f"✅ {len(datos_bloques)} sensores cargados con datos históricos")
+    iniciar_refresco()
+else:
+    # Los datos llegan del cargador cuando el worker atiende su primera solicitud
+    print(f"🔗 Datos del plano compartido {compartido.ruta_predeterminada(NOMBRE_PLANO)}")
+
+cache.configurar(MAX_ENTRADAS_CACHE, CARPETA_CACHE)
 
 # ===== DASH APP =====
 app = dash.Dash(__name__)
+server = app.server
+
+
+@server.before_request
+def _conectar_plano():
+    if MODO_DATOS == 'compartido' and _plano['hilo'] is None:
+        conectar_plano()
+
+
 app.layout = html.Div([
+    # ===== REFRESCO =====
+    # El navegador recibe cada versión nueva por /eventos; el intervalo solo
+    # corre mientras esa conexión no está abierta
+    dcc.Interval(id='intervalo-refresco', interval=REFRESCO_SEGUNDOS * 1000),
+    dcc.Store(id='version-datos', data=0),
+    dcc.Store(id='canal-navegador'),
+    dcc.Store(id='sensores-dibujados'),
+    dcc.Store(id='estado-lineas'),
+
     # ===== ENCABEZADO =====
     html.Div([
         html.H1("🏫 Monitor Energético UPB",
@@ -182,8 +565,9 @@ app.layout = html.Div([
                     id="map-options",
                     options=[
                         {"label": " 🏢 Landmarks edificios", "value": "landmarks"},
+                        {"label": " ⚠️ Anomalías detectadas", "value": "anomalias"},
                     ],
-                    value=["heatmap"],
+                    value=["heatmap", "anomalias"],
                     style={'fontSize': '14px'}
                 )
             ], style={'width': '40%', 'display': 'inline-block', 'verticalAlign': 'top'})
@@ -208,6 +592,14 @@ app.layout = html.Div([
 
             html.Div([
                 html.H3("📊 Promedio por intervalos", style={'textAlign': 'center'}),
+                dcc.Dropdown(
+                    id='intervalo-barras',
+                    options=[{'label': f"Cada {etiqueta}", 'value': segundos}
+                             for segundos, etiqueta in series.INTERVALOS_AGREGACION.items()],
+                    value=30,
+                    clearable=False,
+                    style={'width': '160px', 'margin': '0 auto'}
+                ),
                 dcc.Graph(id="grafica-barras", style={'height': '300px'})
             ])
         ], style={'width': '38%', 'display': 'inline-block', 'paddingLeft': '2%', 'verticalAlign': 'top'})
@@ -224,26 +616,113 @@ app.layout = html.Div([
 ])
 
 
-# ===== CALLBACK PRINCIPAL =====
+# ===== CALLBACK DE REFRESCO =====
+@app.server.route('/eventos')
+def eventos_navegador():
+    """
+    Server-Sent Events con version_datos: uno al conectarse y otro cada vez
+    que llegan datos nuevos.
+    """
+    def flujo():
+        enviada = None
+        while True:
+            with _cambio_version:
+                _cambio_version.wait_for(lambda: version_datos != enviada, timeout=eventos.INTERVALO_LATIDO)
+                actual = version_datos
+            if actual == enviada:
+                yield b': latido\n\n'
+                continue
+            enviada = actual
+            yield eventos.formatear(actual)
+
+    return Response(flujo(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+app.clientside_callback(
+    """
+    function(_) {
+        if (!window.EventSource || window.fuenteVersionDatos) {
+            return window.dash_clientside.no_update;
+        }
+        const fuente = new EventSource('/eventos');
+        window.fuenteVersionDatos = fuente;
+        fuente.onopen = function() {
+            window.dash_clientside.set_props('intervalo-refresco', {disabled: true});
+        };
+        fuente.onerror = function() {
+            window.dash_clientside.set_props('intervalo-refresco', {disabled: false});
+        };
+        fuente.onmessage = function(evento) {
+            window.dash_clientside.set_props('version-datos', {data: JSON.parse(evento.data)});
+        };
+        return true;
+    }
+    """,
+    Output('canal-navegador', 'data'),
+    Input('canal-navegador', 'id')
+)
+
+
 @callback(
-    [Output('mapa-energia', 'figure'),
-     Output('resultados-simples', 'children'),
-     Output('grafica-lineas', 'figure'),
-     Output('grafica-barras', 'figure'),
-     Output('tabla-tecnica', 'children')],
-    [Input('kpi-selector', 'value'),
-     Input('map-options', 'value')]
+    Output('version-datos', 'data'),
+    Input('intervalo-refresco', 'n_intervals'),
+    State('version-datos', 'data')
 )
-def actualizar_dashboard(kpi_seleccionado, map_options):
-    config = kpis_config[kpi_seleccionado]
-    sensores = list(datos_bloques.keys())
+def sincronizar_version(_, version_cliente):
+    # Solo se redibuja el dashboard cuando el hilo de refresco trajo datos nuevos
+    if version_cliente == version_datos:
+        return dash.no_update
+    return version_datos
 
-    if not sensores:
-        empty_fig = go.Figure()
-        return empty_fig, "⚠️ Sin datos", empty_fig, empty_fig, html.Div("Sin datos")
 
-    lats = [datos_bloques[b]['lat'] for b in sensores]
-    lons = [datos_bloques[b]['lon'] for b in sensores]
+# ===== CACHÉ DE RESULTADOS =====
+_huella = {'version': None, 'valor': None}
+
+
+def huella_datos():
+    """
+    Huella del contenido de datos_bloques (último timestamp de cada sensor):
+    la misma en todos los procesos que leen el mismo histórico, a diferencia
+    de version_datos, que cada proceso numera por su cuenta.
+    """
+    version = version_datos
+    if _huella['version'] != version:
+        ultimos = sorted((sid, series.ultimo_tiempo(datos['serie'])) for sid, datos in datos_bloques.items())
+        _huella['valor'] = hashlib.sha1(repr(ultimos).encode('utf-8')).hexdigest()
+        _huella['version'] = version
+    return _huella['valor']
+
+
+def memorizada(calcular, *clave):
+    """
+    Resultado de calcular() desde la caché, por los valores de entrada del
+    callback (`clave`) y la versión actual de los datos. La versión se lee
+    antes de calcular: como sube después de reemplazar datos_bloques, un
+    resultado nunca queda guardado con datos más viejos que su versión.
+    """
+    return cache.obtener(clave, version_datos, calcular, huella_datos)
+
+
+# ===== FIGURAS =====
+def disparador():
+    """
+    Id del componente que disparó el callback en curso, o None si la función
+    se llama fuera de un callback (por ejemplo, desde benchmark.py) o en la
+    carga inicial de la página.
+    """
+    try:
+        return ctx.triggered_id
+    except (dash.exceptions.MissingCallbackContextException, LookupError):
+        # En un hilo sin contexto de callback la variable de contexto no existe
+        return None
+
+
+def valores_mapa(kpi_seleccionado, sensores):
+    """
+    (nombres, valores, tamaños, mínimo, máximo) del KPI para los marcadores
+    del mapa.
+    """
     nombres = [datos_bloques[b]['nombre'] for b in sensores]
     valores_raw = [datos_bloques[b].get(kpi_seleccionado, 0) for b in sensores]
     valores = [v * 100 if kpi_seleccionado == 'TotalPowerFactor' else v for v in valores_raw]
@@ -251,143 +730,332 @@ def actualizar_dashboard(kpi_seleccionado, map_options):
     min_v, max_v = min(valores), max(valores)
     span = max_v - min_v if max_v != min_v else 1.0
     sizes = [15 + 25 * ((v - min_v) / span) for v in valores]
+    return nombres, valores, sizes, min_v, max_v
 
-    # ===== MAPA =====
-    fig_mapa = go.Figure()
+
+def capas_visibles(map_options):
+    """
+    Visibilidad de cada traza de figura_mapa, en su orden: calor, borde y
+    centro de los landmarks, sombra y texto de las etiquetas y anomalías.
+    """
     mostrar_heatmap = 'heatmap' in map_options
-    mostrar_landmarks = 'landmarks' in map_options
+    mostrar_landmarks = mostrar_heatmap and 'landmarks' in map_options
     mostrar_labels = 'labels' in map_options
+    mostrar_anomalias = 'anomalias' in map_options
+    return [mostrar_heatmap, mostrar_landmarks, mostrar_landmarks, mostrar_labels, mostrar_labels,
+            mostrar_anomalias]
+
+
+def capa_anomalias(sensores):
+    """
+    (lats, lons, textos) de los sensores con banderas de anomalías activas,
+    tal como las publicó el recolector (ver anomalias.py).
+    """
+    lats, lons, textos = [], [], []
+    for sensor_id in sensores:
+        datos = datos_bloques[sensor_id]
+        if datos.get('anomalias'):
+            lats.append(datos['lat'])
+            lons.append(datos['lon'])
+            textos.append(f"<b>{datos['nombre']}</b><br>" +
+                          "<br>".join(anomalias.describir(b) for b in datos['anomalias']))
+    return lats, lons, textos
+
+
+def hover_mapa(config, nombre):
+    return (f"<b>{nombre}</b><br>" +
+            f"{config['titulo']}: %{{customdata[1]:.2f}} {config['unidad']}<br><extra></extra>")
+
+
+def figura_mapa(config, lats, lons, nombres, valores, sizes, min_v, max_v, map_options, alertas=([], [], [])):
+    """
+    Mapa con todas las capas; las que no están en map_options quedan ocultas
+    (visible=False), así que activarlas o cambiar de KPI es un parche sobre
+    trazas que ya existen en el navegador.
+    """
+    fig_mapa = go.Figure()
+    visibles = capas_visibles(map_options)
+    customdata = list(zip(nombres, valores))
 
     # Capa 1: Puntos de calor
-    if mostrar_heatmap:
-        fig_mapa.add_trace(go.Scattermapbox(
-            lat=lats, lon=lons, mode='markers',
-            marker=dict(size=sizes, color=valores, colorscale=config['colorscale'],
-                        cmin=min_v, cmax=max_v, opacity=0.7, showscale=True,
-                        colorbar=dict(title=f"{config['titulo']}<br>({config['unidad']})", x=1.02)),
-            customdata=list(zip(nombres, valores)),
-            hovertemplate="<b>%{customdata[0]}</b><br>" +
-                          f"{config['titulo']}: %{{customdata[1]:.2f}} {config['unidad']}<br><extra></extra>",
-            name="Calor", showlegend=False
-        ))
+    fig_mapa.add_trace(go.Scattermapbox(
+        lat=lats, lon=lons, mode='markers', visible=visibles[0],
+        marker=dict(size=sizes, color=valores, colorscale=config['colorscale'],
+                    cmin=min_v, cmax=max_v, opacity=0.7, showscale=True,
+                    colorbar=dict(title=f"{config['titulo']}<br>({config['unidad']})", x=1.02)),
+        customdata=customdata,
+        hovertemplate=hover_mapa(config, '%{customdata[0]}'),
+        name="Calor", showlegend=False
+    ))
+
+    # Capa 2: Landmarks (marcadores de sensores fijos)
+    # Capa del borde blanco
+    fig_mapa.add_trace(go.Scattermapbox(
+        lat=lats, lon=lons, mode='markers', visible=visibles[1],
+        marker=dict(
+            size=32,  # borde más grande
+            color='white',
+            symbol='circle'
+        ),
+        hoverinfo='skip',  # no mostrar tooltip en el borde
+        showlegend=False
+    ))
+
+    # Capa del centro rojo (pin)
+    fig_mapa.add_trace(go.Scattermapbox(
+        lat=lats, lon=lons, mode='markers', visible=visibles[2],
+        marker=dict(
+            size=22,  # más pequeño para quedar centrado
+            color='red',
+            symbol='circle'
+        ),
+        text=nombres,
+        customdata=customdata,
+        hovertemplate=hover_mapa(config, '%{text}'),
+        name="Sensores",
+        showlegend=False
+    ))
 
-        # Capa 2: Landmarks (marcadores de sensores fijos)
-        if mostrar_landmarks:
-            # Capa del borde blanco
-            fig_mapa.add_trace(go.Scattermapbox(
-                lat=lats, lon=lons, mode='markers',
-                marker=dict(
-                    size=32,  # borde más grande
-                    color='white',
-                    symbol='circle'
-                ),
-                hoverinfo='skip',  # no mostrar tooltip en el borde
-                showlegend=False
-            ))
-
-            # Capa del centro rojo (pin)
-            fig_mapa.add_trace(go.Scattermapbox(
-                lat=lats, lon=lons, mode='markers',
-                marker=dict(
-                    size=22,  # más pequeño para quedar centrado
-                    color='red',
-                    symbol='circle'
-                ),
-                text=nombres,
-                customdata=list(zip(nombres, valores)),
-                hovertemplate="<b>%{text}</b><br>" +
-                              f"{config['titulo']}: %{{customdata[1]:.2f}} {config['unidad']}<br><extra></extra>",
-                name="Sensores",
-                showlegend=False
-            ))
     # Capa 3: Etiquetas con fondo de contraste
-    if mostrar_labels:
-        nombres_cortos = [n.split(' - ')[0] if ' - ' in n else n[:12] for n in nombres]
-        # Sombra para contraste
-        fig_mapa.add_trace(go.Scattermapbox(
-            lat=[lat + 0.00002 for lat in lats],
-            lon=[lon + 0.00002 for lon in lons],
-            mode='text', text=nombres_cortos, textposition='top center',
-            textfont=dict(size=11, color='rgba(0,0,0,0.9)', family='Arial Black'),
-            hoverinfo='skip', showlegend=False
-        ))
-        # Texto principal blanco
-        fig_mapa.add_trace(go.Scattermapbox(
-            lat=lats, lon=lons, mode='text', text=nombres_cortos,
-            textposition='top center',
-            textfont=dict(size=11, color='white', family='Arial Black'),
-            hoverinfo='skip', showlegend=False
-        ))
+    nombres_cortos = [n.split(' - ')[0] if ' - ' in n else n[:12] for n in nombres]
+    # Sombra para contraste
+    fig_mapa.add_trace(go.Scattermapbox(
+        lat=[lat + 0.00002 for lat in lats],
+        lon=[lon + 0.00002 for lon in lons],
+        mode='text', text=nombres_cortos, textposition='top center', visible=visibles[3],
+        textfont=dict(size=11, color='rgba(0,0,0,0.9)', family='Arial Black'),
+        hoverinfo='skip', showlegend=False
+    ))
+    # Texto principal blanco
+    fig_mapa.add_trace(go.Scattermapbox(
+        lat=lats, lon=lons, mode='text', text=nombres_cortos,
+        textposition='top center', visible=visibles[4],
+        textfont=dict(size=11, color='white', family='Arial Black'),
+        hoverinfo='skip', showlegend=False
+    ))
+
+    # Capa 4: Anomalías detectadas por el recolector (halo naranja)
+    lats_alerta, lons_alerta, textos_alerta = alertas
+    fig_mapa.add_trace(go.Scattermapbox(
+        lat=lats_alerta, lon=lons_alerta, mode='markers+text', visible=visibles[5],
+        marker=dict(size=48, color='rgba(230,126,34,0.45)'),
+        text=['!'] * len(lats_alerta), textposition='middle right',
+        textfont=dict(size=18, color='#d35400', family='Arial Black'),
+        customdata=textos_alerta,
+        hovertemplate="⚠️ %{customdata}<extra></extra>",
+        name="Anomalías", showlegend=False
+    ))
 
     fig_mapa.update_layout(
         mapbox_style="open-street-map",
         mapbox=dict(zoom=16.8, center=dict(lat=float(np.mean(lats)), lon=float(np.mean(lons)))),
-        margin={"r": 100, "t": 10, "l": 10, "b": 10}, height=650
+        margin={"r": 100, "t": 10, "l": 10, "b": 10}, height=650,
+        # Conserva el zoom y el centro que eligió el usuario entre redibujos
+        uirevision='mapa'
     )
 
-    # ===== GRÁFICA LÍNEAS =====
-    fig_lineas = go.Figure()
-    colores = ['#e74c3c', '#3498db', '#27ae60', '#f39c12', '#9b59b6']
+    return fig_mapa
 
-    for idx, (sensor_id, serie) in enumerate(list(datos_temporales.items())[:5]):
-        if not serie:
-            continue
-        timestamps = [p['timestamp'] for p in serie]
-        valores_t = [p[kpi_seleccionado] * (100 if kpi_seleccionado == 'TotalPowerFactor' else 1) for p in serie]
 
-        fig_lineas.add_trace(go.Scatter(
-            x=timestamps, y=valores_t, mode='lines+markers',
-            name=datos_bloques[sensor_id]['nombre'].split(' - ')[0],
-            line=dict(color=colores[idx], width=2),
-            marker=dict(size=4)
-        ))
+def parche_mapa(config, nombres, valores, sizes, min_v, max_v, cambio_kpi=False, alertas=([], [], [])):
+    """
+    Actualización parcial (dash.Patch) del mapa armado por figura_mapa para
+    la misma lista de sensores: los valores de las capas que dependen de los
+    datos, las anomalías y, al cambiar de KPI, la escala de colores y los
+    textos.
+    """
+    customdata = list(zip(nombres, valores))
+    parche = Patch()
+    parche['data'][0]['customdata'] = customdata
+    parche['data'][0]['marker']['color'] = valores
+    parche['data'][0]['marker']['size'] = sizes
+    parche['data'][0]['marker']['cmin'] = min_v
+    parche['data'][0]['marker']['cmax'] = max_v
+    parche['data'][2]['customdata'] = customdata
+    lats_alerta, lons_alerta, textos_alerta = alertas
+    parche['data'][5]['lat'] = lats_alerta
+    parche['data'][5]['lon'] = lons_alerta
+    parche['data'][5]['text'] = ['!'] * len(lats_alerta)
+    parche['data'][5]['customdata'] = textos_alerta
+    if cambio_kpi:
+        parche['data'][0]['marker']['colorscale'] = config['colorscale']
+        parche['data'][0]['marker']['colorbar']['title']['text'] = f"{config['titulo']}<br>({config['unidad']})"
+        parche['data'][0]['hovertemplate'] = hover_mapa(config, '%{customdata[0]}')
+        parche['data'][2]['hovertemplate'] = hover_mapa(config, '%{text}')
+    return parche
 
-    fig_lineas.update_layout(
-        xaxis_title="Tiempo", yaxis_title=config['unidad'],
-        margin=dict(t=20, l=50, r=20, b=40),
-        legend=dict(orientation="h", y=1.1, x=0),
-        hovermode='x unified'
-    )
-
-    # ===== GRÁFICA BARRAS =====
-    horas = {}
-    for sensor_id, serie in datos_temporales.items():
-        for p in serie:
-            ts = p['timestamp'].replace(
-                second=0 if p['timestamp'].second < 30 else 30,
-                microsecond=0
-            )
-            valor = p[kpi_seleccionado] * (100 if kpi_seleccionado == 'TotalPowerFactor' else 1)
-            horas.setdefault(ts, []).append(valor)
-
-    horas_prom = {ts: np.mean(v) for ts, v in horas.items()}
-    horas_ord = sorted(horas_prom.keys())
-    valores_ord = [horas_prom[ts] for ts in horas_ord]
-    x_labels = [ts.strftime("%H:%M:%S") for ts in horas_ord]
-
-    # Colores según nivel
-    colores_barras = []
-    for v in valores_ord:
-        if v < np.percentile(valores_ord, 33):
-            colores_barras.append('#27ae60')  # Verde
-        elif v < np.percentile(valores_ord, 66):
-            colores_barras.append('#f39c12')  # Amarillo
-        else:
-            colores_barras.append('#e74c3c')  # Rojo
 
+def figura_barras(config, ancho_barras, x_labels, valores_ord, colores_barras):
     fig_barras = go.Figure(go.Bar(
         x=x_labels, y=valores_ord, marker_color=colores_barras,
         hovertemplate="<b>%{x}</b><br>Promedio: %{y:.2f}<extra></extra>"
     ))
     fig_barras.update_layout(
-        xaxis=dict(title="Tiempo (cada 30s)", tickangle=45),
+        xaxis=dict(title=titulo_eje_barras(ancho_barras), tickangle=45),
         yaxis=dict(title=config['unidad']),
         margin=dict(t=20, l=50, r=20, b=80)
     )
+    return fig_barras
+
+
+def titulo_eje_barras(ancho_barras):
+    return f"Tiempo (cada {series.INTERVALOS_AGREGACION.get(ancho_barras, f'{ancho_barras} s')})"
+
+
+# ===== CALLBACKS PRINCIPALES =====
+# Cada salida se actualiza solo cuando cambian sus propias entradas. Las
+# figuras se dibujan completas en la carga de la página; después, las
+# capas, el KPI y los datos nuevos llegan como parches (dash.Patch) sobre
+# las trazas que ya tiene el navegador.
+@callback(
+    [Output('mapa-energia', 'figure'),
+     Output('sensores-dibujados', 'data')],
+    [Input('kpi-selector', 'value'),
+     Input('version-datos', 'data')],
+    [State('map-options', 'value'),
+     State('sensores-dibujados', 'data')]
+)
+def actualizar_mapa(kpi_seleccionado, _version=None, map_options=('heatmap',), sensores_dibujados=None):
+    config = kpis_config[kpi_seleccionado]
+    sensores = list(datos_bloques.keys())
+
+    if not sensores:
+        return go.Figure(), []
+
+    # Con los mismos sensores ya dibujados solo se envía lo que cambió
+    origen = disparador()
+    if origen is not None and sensores_dibujados == sensores:
+        cambio_kpi = origen == 'kpi-selector'
+        parche = memorizada(
+            lambda: parche_mapa(config, *valores_mapa(kpi_seleccionado, sensores), cambio_kpi,
+                                capa_anomalias(sensores)),
+            'parche_mapa', kpi_seleccionado, cambio_kpi
+        )
+        return parche, dash.no_update
+
+    map_options = list(map_options or [])
+
+    def calcular():
+        lats = [datos_bloques[b]['lat'] for b in sensores]
+        lons = [datos_bloques[b]['lon'] for b in sensores]
+        return figura_mapa(config, lats, lons, *valores_mapa(kpi_seleccionado, sensores), map_options,
+                           capa_anomalias(sensores))
+
+    return memorizada(calcular, 'mapa', kpi_seleccionado, tuple(map_options)), sensores
+
+
+@callback(
+    Output('mapa-energia', 'figure', allow_duplicate=True),
+    Input('map-options', 'value'),
+    State('sensores-dibujados', 'data'),
+    prevent_initial_call=True
+)
+def alternar_capas(map_options, sensores_dibujados):
+    """
+    Mostrar u ocultar capas solo cambia la visibilidad de las trazas.
+    """
+    if not sensores_dibujados:
+        return dash.no_update
+    parche = Patch()
+    for idx, visible in enumerate(capas_visibles(map_options or [])):
+        parche['data'][idx]['visible'] = visible
+    return parche
+
+
+@callback(
+    Output('resultados-simples', 'children'),
+    [Input('kpi-selector', 'value'),
+     Input('map-options', 'value'),
+     Input('version-datos', 'data')]
+)
+def actualizar_resumen(kpi_seleccionado, map_options, _version=None):
+    if not datos_bloques:
+        return "⚠️ Sin datos"
+
+    config = kpis_config[kpi_seleccionado]
+    map_options = map_options or []
+    opciones_activas = []
+    if 'heatmap' in map_options:
+        opciones_activas.append("Puntos de calor")
+    if 'landmarks' in map_options:
+        opciones_activas.append("Landmarks")
+    if 'labels' in map_options:
+        opciones_activas.append("Etiquetas")
+    if 'anomalias' in map_options:
+        alertas = sum(1 for datos in datos_bloques.values() if datos.get('anomalias'))
+        opciones_activas.append(f"Anomalías ({alertas} sensores)")
+
+    return f"📊 Mostrando {config['titulo']} | Opciones: {', '.join(opciones_activas) if opciones_activas else 'Ninguna'}"
+
+
+@callback(
+    Output('grafica-barras', 'figure'),
+    [Input('kpi-selector', 'value'),
+     Input('intervalo-barras', 'value'),
+     Input('version-datos', 'data')]
+)
+def actualizar_barras(kpi_seleccionado, intervalo_barras=30, _version=None):
+    ancho_barras = intervalo_barras or 30
+    origen = disparador()
+    return memorizada(lambda: barras_kpi(kpi_seleccionado, ancho_barras, origen),
+                      'barras', kpi_seleccionado, ancho_barras, origen)
+
+
+def barras_kpi(kpi_seleccionado, ancho_barras, origen):
+    """
+    Figura de barras completa (origen None, carga inicial) o parche según
+    la entrada que cambió.
+    """
+    config = kpis_config[kpi_seleccionado]
+    sensores = list(datos_bloques.keys())
+
+    # Agregación columnar: todas las muestras de todos los sensores se agrupan
+    # en intervalos fijos con bincount y los percentiles se calculan una vez
+    columnas = [columnas_sensor(datos_bloques[sid], kpi_seleccionado) for sid in sensores]
+    tiempos_ms = np.concatenate([t for t, _ in columnas]) if columnas else np.empty(0, dtype=np.int64)
+    valores_kpi = np.concatenate([v for _, v in columnas]) if columnas else np.empty(0)
+    if kpi_seleccionado == 'TotalPowerFactor':
+        valores_kpi = valores_kpi * 100
+
+    inicios_ms, valores_ord, _ = series.agregar_por_intervalo(tiempos_ms, valores_kpi, ancho_barras)
+    x_labels = series.etiquetas_intervalo(inicios_ms, ancho_barras)
+
+    # Colores según nivel
+    paleta_barras = np.array(['#27ae60', '#f39c12', '#e74c3c'])  # Verde, amarillo, rojo
+    colores_barras = paleta_barras[series.clasificar_por_percentil(valores_ord)]
+
+    # La figura siempre tiene una sola traza de barras (vacía si no hay
+    # datos): después de la carga inicial todo cambio es un parche
+    if origen is None:
+        return figura_barras(config, ancho_barras, x_labels, valores_ord, colores_barras)
+
+    fig_barras = Patch()
+    fig_barras['data'][0]['x'] = x_labels
+    fig_barras['data'][0]['y'] = valores_ord
+    fig_barras['data'][0]['marker']['color'] = colores_barras
+    if origen == 'kpi-selector':
+        fig_barras['layout']['yaxis']['title']['text'] = config['unidad']
+    elif origen == 'intervalo-barras':
+        fig_barras['layout']['xaxis']['title']['text'] = titulo_eje_barras(ancho_barras)
+    return fig_barras
+
+
+@callback(
+    Output('tabla-tecnica', 'children'),
+    [Input('kpi-selector', 'value'),
+     Input('version-datos', 'data')]
+)
+def actualizar_tabla(kpi_seleccionado, _version=None):
+    return memorizada(lambda: tabla_ranking(kpi_seleccionado), 'tabla', kpi_seleccionado)
+
+
+def tabla_ranking(kpi_seleccionado):
+    config = kpis_config[kpi_seleccionado]
+    if not datos_bloques:
+        return html.Div("Sin datos")
 
-    # ===== TABLA TÉCNICA =====
     datos_ord = sorted(
-        [(sid, datos_bloques[sid]) for sid in sensores],
+        datos_bloques.items(),
         key=lambda x: x[1].get(kpi_seleccionado, 0),
         reverse=True
     )
@@ -410,7 +1078,7 @@ def actualizar_dashboard(kpi_seleccionado, map_options):
             html.Td(f"{datos.get('RelativeTHDVoltage', 0):.2f}%", style={'padding': '10px', 'textAlign': 'right'})
         ], style={'backgroundColor': bg, 'borderBottom': '1px solid #ddd'}))
 
-    tabla_tecnica = html.Div([
+    return html.Div([
         html.H3("📋 Ranking de Sensores", style={'textAlign': 'center', 'color': '#2c3e50'}),
         html.P(f"Ordenados por {config['titulo']}",
                style={'textAlign': 'center', 'color': '#7f8c8d', 'marginBottom': '20px'}),
@@ -427,20 +1095,123 @@ def actualizar_dashboard(kpi_seleccionado, map_options):
                   'boxShadow': '0 2px 10px rgba(0,0,0,0.1)', 'borderRadius': '8px'})
     ])
 
-    # Mensaje de estado
-    opciones_activas = []
-    if mostrar_heatmap:
-        opciones_activas.append("Puntos de calor")
-    if mostrar_landmarks:
-        opciones_activas.append("Landmarks")
-    if mostrar_labels:
-        opciones_activas.append("Etiquetas")
 
-    mensaje = f"📊 Mostrando {config['titulo']} | Opciones: {', '.join(opciones_activas) if opciones_activas else 'Ninguna'}"
+# ===== CALLBACK TENDENCIA HISTÓRICA =====
+def rango_relayout(relayout):
+    """
+    Extrae el rango del eje x (en ms) de relayoutData, o None si el usuario
+    no ha hecho zoom o volvió a la vista completa.
+    """
+    if not relayout or relayout.get('xaxis.autorange'):
+        return None
+    if 'xaxis.range[0]' in relayout:
+        extremos = relayout['xaxis.range[0]'], relayout['xaxis.range[1]']
+    elif 'xaxis.range' in relayout:
+        extremos = relayout['xaxis.range']
+    else:
+        return None
+    inicio, fin = (np.datetime64(str(e).replace(' ', 'T'), 'ms').astype(np.int64) for e in extremos)
+    return int(inicio), int(fin)
+
+
+def parche_lineas(kpi_seleccionado, estado):
+    """
+    Agrega a cada traza de la tendencia (dash.Patch) los puntos posteriores
+    al último que ya tiene el navegador. Devuelve (parche, estado), o None si
+    hay que redibujar la gráfica completa.
+    """
+    if not estado or estado['kpi'] != kpi_seleccionado or estado['parches'] >= MAX_PARCHES_LINEAS:
+        return None
+    trazas = [sid for sid in list(datos_bloques)[:5] if len(columnas_sensor(datos_bloques[sid], kpi_seleccionado)[0])]
+    if trazas != estado['trazas']:
+        return None
 
-    return fig_mapa, mensaje, fig_lineas, fig_barras, tabla_tecnica
+    parche = Patch()
+    ultimos = []
+    for idx, (sensor_id, ultimo) in enumerate(zip(trazas, estado['ultimos'])):
+        tiempos_ms, valores_t = columnas_sensor(datos_bloques[sensor_id], kpi_seleccionado)
+        desde = int(np.searchsorted(tiempos_ms, ultimo, 'right'))
+        if desde < len(tiempos_ms):
+            valores_t = valores_t[desde:] * 100 if kpi_seleccionado == 'TotalPowerFactor' else valores_t[desde:]
+            parche['data'][idx]['x'].extend(np.datetime_as_string(tiempos_ms[desde:].astype('datetime64[ms]')).tolist())
+            parche['data'][idx]['y'].extend(valores_t.tolist())
+        ultimos.append(int(tiempos_ms[-1]))
+    return parche, {**estado, 'ultimos': ultimos, 'parches': estado['parches'] + 1}
+
+
+@callback(
+    [Output('grafica-lineas', 'figure'),
+     Output('estado-lineas', 'data')],
+    [Input('kpi-selector', 'value'),
+     Input('grafica-lineas', 'relayoutData'),
+     Input('version-datos', 'data')],
+    State('estado-lineas', 'data')
+)
+def actualizar_lineas(kpi_seleccionado, relayout, _version=None, estado=None):
+    """
+    Cada serie se recorta al rango visible y se reduce a unos PUNTOS_MAX_LINEAS
+    puntos antes de enviarla al navegador; al hacer zoom se vuelve a consultar
+    el tramo visible con resolución completa. Con datos nuevos, y sin zoom,
+    solo se envían los puntos nuevos de cada serie (ver parche_lineas).
+    """
+    rango = rango_relayout(relayout)
+
+    if disparador() == 'version-datos' and not rango:
+        resultado = parche_lineas(kpi_seleccionado, estado)
+        if resultado is not None:
+            return resultado
+    return memorizada(lambda: figura_lineas(kpi_seleccionado, rango), 'lineas', kpi_seleccionado, rango)
+
+
+def figura_lineas(kpi_seleccionado, rango):
+    """
+    Figura de tendencia completa y el estado inicial para parche_lineas.
+    """
+    config = kpis_config[kpi_seleccionado]
+    fig_lineas = go.Figure()
+    colores = ['#e74c3c', '#3498db', '#27ae60', '#f39c12', '#9b59b6']
+    trazas, ultimos = [], []
+
+    for idx, sensor_id in enumerate(list(datos_bloques)[:5]):
+        tiempos_ms, valores_t = columnas_sensor(datos_bloques[sensor_id], kpi_seleccionado)
+        if not len(tiempos_ms):
+            continue
+        trazas.append(sensor_id)
+        ultimos.append(int(tiempos_ms[-1]))
+        if kpi_seleccionado == 'TotalPowerFactor':
+            valores_t = valores_t * 100
+        if rango:
+            tiempos_ms, valores_t = series.recortar_rango(tiempos_ms, valores_t, *rango)
+        tiempos_ms, valores_t = series.reducir_serie(tiempos_ms, valores_t, PUNTOS_MAX_LINEAS, METODO_REDUCCION)
+
+        fig_lineas.add_trace(go.Scatter(
+            x=tiempos_ms.astype('datetime64[ms]'), y=valores_t, mode='lines+markers',
+            name=datos_bloques[sensor_id]['nombre'].split(' - ')[0],
+            line=dict(color=colores[idx], width=2),
+            marker=dict(size=4)
+        ))
+
+    fig_lineas.update_layout(
+        xaxis_title="Tiempo", yaxis_title=config['unidad'],
+        margin=dict(t=20, l=50, r=20, b=40),
+        legend=dict(orientation="h", y=1.1, x=0),
+        hovermode='x unified'
+    )
+    if rango:
+        fig_lineas.update_xaxes(range=[np.datetime64(rango[0], 'ms'), np.datetime64(rango[1], 'ms')])
+
+    estado = {'kpi': kpi_seleccionado, 'trazas': trazas, 'ultimos': ultimos, 'parches': 0}
+    return fig_lineas, estado
 
 
 if __name__ == '__main__':
-    print("🚀 Dashboard UPB iniciado en http://127.0.0.1:8050")
-    app.run(debug=True, host='127.0.0.1', port=8050)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Dashboard de monitoreo energético UPB')
+    parser.add_argument('--cargador', action='store_true',
+                        help='mantiene el plano de datos compartido para los workers (MODO_DATOS = compartido)')
+    args = parser.parse_args()
+
+    if args.cargador:
+        ejecutar_cargador()
+    else:
+        print("🚀 Dashboard UPB iniciado en http://127.0.0.1:8050")
+        app.run(debug=True, host='127.0.0.1', port=8050)
\ No newline at end of file
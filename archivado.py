@@ -0,0 +1,306 @@
+"""
+Archivo de largo plazo del histórico: las muestras que salen de la ventana
+de retención (ver historico.py) se guardan en segmentos diarios comprimidos
+en lugar de descartarse.
+
+Cada sensor tiene una carpeta archivado/ dentro de su carpeta de histórico:
+
+    historico/<id>/archivado/2026-10-16.npz    segmentos diarios sellados
+    historico/<id>/archivado/pendientes.bin    muestras del día en curso
+    historico/<id>/archivado/indice.json       metadatos de cada segmento
+
+Las muestras descartadas se agregan a pendientes.bin (registros binarios con
+la estructura del anillo). Cuando llega una muestra de un día posterior, los
+días completos se sellan: se escriben una sola vez en un .npz por columnas y
+no se vuelven a tocar.
+
+Cada columna se guarda como enteros (el valor dividido por RESOLUCION, así que
+los valores con hasta tres decimales se conservan exactos), en diferencias
+entre muestras consecutivas, con el tipo entero más chico que alcanza y con
+los bytes agrupados por posición antes de comprimir: una serie que cambia poco
+queda en bytes casi constantes que comprimen muy bien. Los NaN se guardan
+aparte como una máscara de bits.
+
+El índice tiene, por segmento, el primer y el último timestamp, la cantidad de
+muestras y el mínimo y el máximo de cada canal, para que una consulta abra
+solo los días que necesita (ver segmentos() y leer_rango()).
+"""
+
+import io
+import json
+import os
+import threading
+
+import numpy as np
+
+import anillo
+
+CARPETA = 'archivado'
+ARCHIVO_PENDIENTES = 'pendientes.bin'
+ARCHIVO_INDICE = 'indice.json'
+EXTENSION = '.npz'
+
+# Resolución de los valores guardados (exacta para valores con tres decimales)
+RESOLUCION = 0.001
+
+CANALES = anillo.CANALES
+SEGUNDOS_DIA = 86400
+
+_TIPOS_ENTEROS = (np.int8, np.int16, np.int32, np.int64)
+
+# Día (número de días desde anillo.EPOCA) de la muestra más antigua
+# pendiente, por carpeta; None si no hay pendientes
+_dia_pendiente = {}
+_lock_archivado = threading.Lock()
+
+
+# ===== RUTAS =====
+def carpeta_archivado(carpeta, sensor_id):
+    return os.path.join(carpeta, sensor_id, CARPETA)
+
+
+def nombre_dia(dia):
+    return anillo.desde_epoch(int(dia) * SEGUNDOS_DIA).date().isoformat()
+
+
+def _dias(tiempos):
+    return (np.asarray(tiempos) // SEGUNDOS_DIA).astype(np.int64)
+
+
+# ===== CODIFICACIÓN =====
+def _comprimir_enteros(enteros):
+    """
+    Diferencias de una columna entera con el tipo más chico que alcanza, con
+    los bytes agrupados por posición (arreglo uint8 de tamaño_tipo x n).
+    """
+    diferencias = np.diff(enteros, prepend=enteros[:1])
+    minimo, maximo = (int(diferencias.min()), int(diferencias.max())) if len(diferencias) else (0, 0)
+    tipo = next(t for t in _TIPOS_ENTEROS if np.iinfo(t).min <= minimo and maximo <= np.iinfo(t).max)
+    diferencias = diferencias.astype(np.dtype(tipo).newbyteorder('<'))
+    return diferencias.view(np.uint8).reshape(-1, diferencias.itemsize).T.copy()
+
+
+def _descomprimir_enteros(bytes_columna, base):
+    tamano = bytes_columna.shape[0]
+    diferencias = np.ascontiguousarray(bytes_columna.T).view(f'<i{tamano}').ravel()
+    return base + np.cumsum(diferencias, dtype=np.int64)
+
+
+def _metadatos(arreglo, dia):
+    minimos, maximos = {}, {}
+    for canal in CANALES:
+        valores = arreglo[canal][~np.isnan(arreglo[canal])]
+        minimos[canal] = float(valores.min()) if len(valores) else None
+        maximos[canal] = float(valores.max()) if len(valores) else None
+    return {
+        'dia': nombre_dia(dia),
+        'inicio': float(arreglo['timestamp'][0]),
+        'fin': float(arreglo['timestamp'][-1]),
+        'muestras': len(arreglo),
+        'minimos': minimos,
+        'maximos': maximos
+    }
+
+
+def codificar(arreglo, dia):
+    """
+    Contenido (bytes) del .npz de un día a partir de sus muestras ordenadas
+    (arreglo con la estructura del anillo). Devuelve (contenido, metadatos).
+    """
+    columnas = {}
+    bases = []
+    tiempos_ms = np.round(arreglo['timestamp'] * 1000).astype(np.int64)
+    columnas['timestamp'] = _comprimir_enteros(tiempos_ms)
+    bases.append(tiempos_ms[0])
+    for canal in CANALES:
+        valores = arreglo[canal]
+        nulos = np.isnan(valores)
+        enteros = np.round(np.where(nulos, 0.0, valores) / RESOLUCION).astype(np.int64)
+        columnas[canal] = _comprimir_enteros(enteros)
+        bases.append(enteros[0])
+        if nulos.any():
+            columnas[f"{canal}_nulos"] = np.packbits(nulos)
+
+    metadatos = _metadatos(arreglo, dia)
+    metadatos['resolucion'] = RESOLUCION
+    contenido = io.BytesIO()
+    np.savez_compressed(contenido, bases=np.array(bases, dtype=np.int64),
+                        metadatos=np.array(json.dumps(metadatos)), **columnas)
+    return contenido.getvalue(), metadatos
+
+
+def decodificar(ruta, canales=None):
+    """
+    Muestras de un segmento como arreglo estructurado (timestamp y los
+    canales pedidos; todos si `canales` es None). Solo se descomprimen las
+    columnas pedidas.
+    """
+    canales = CANALES if canales is None else tuple(canales)
+    with np.load(ruta) as npz:
+        metadatos = json.loads(str(npz['metadatos']))
+        bases = npz['bases']
+        n = metadatos['muestras']
+        arreglo = np.empty(n, dtype=[('timestamp', '<f8')] + [(canal, '<f8') for canal in canales])
+        arreglo['timestamp'] = _descomprimir_enteros(npz['timestamp'], bases[0]) / 1000
+        for canal in canales:
+            valores = _descomprimir_enteros(npz[canal], bases[1 + CANALES.index(canal)]) * metadatos['resolucion']
+            if f"{canal}_nulos" in npz.files:
+                valores[np.unpackbits(npz[f"{canal}_nulos"], count=n).astype(bool)] = np.nan
+            arreglo[canal] = valores
+    return arreglo
+
+
+# ===== ESCRITURA =====
+def _escribir_atomico(ruta, contenido):
+    temporal = ruta + '.tmp'
+    with open(temporal, 'wb') as f:
+        f.write(contenido)
+    os.replace(temporal, ruta)
+
+
+def _leer_pendientes(directorio):
+    ruta = os.path.join(directorio, ARCHIVO_PENDIENTES)
+    try:
+        with open(ruta, 'rb') as f:
+            contenido = f.read()
+    except FileNotFoundError:
+        return np.empty(0, dtype=anillo.ESTRUCTURA)
+    # Un registro a medio escribir (corte durante la escritura) se ignora
+    completos = len(contenido) // anillo.ESTRUCTURA.itemsize
+    return np.frombuffer(contenido, dtype=anillo.ESTRUCTURA, count=completos).copy()
+
+
+def _sellar(directorio, hasta_dia):
+    """
+    Escribe los segmentos de los días pendientes anteriores a hasta_dia y deja
+    en pendientes.bin solo el resto.
+    """
+    pendientes = _leer_pendientes(directorio)
+    pendientes = pendientes[np.argsort(pendientes['timestamp'], kind='stable')]
+    dias = _dias(pendientes['timestamp'])
+    cerrados = dias < hasta_dia
+    if not cerrados.any():
+        return
+
+    indice = leer_indice(directorio)
+    for dia in np.unique(dias[cerrados]):
+        muestras = pendientes[dias == dia]
+        ruta = os.path.join(directorio, nombre_dia(dia) + EXTENSION)
+        if os.path.exists(ruta):
+            # Día que ya tenía segmento (por ejemplo, muestras que llegaron
+            # tarde): se une con lo que ya estaba, sin repetir timestamps
+            muestras = np.concatenate((decodificar(ruta).astype(anillo.ESTRUCTURA), muestras))
+            _, unicos = np.unique(muestras['timestamp'][::-1], return_index=True)
+            muestras = muestras[::-1][unicos]
+        contenido, metadatos = codificar(muestras, dia)
+        metadatos['bytes'] = len(contenido)
+        _escribir_atomico(ruta, contenido)
+        indice[metadatos['dia']] = metadatos
+
+    _escribir_atomico(os.path.join(directorio, ARCHIVO_INDICE),
+                      json.dumps(indice, ensure_ascii=False, sort_keys=True).encode('utf-8'))
+    restantes = pendientes[~cerrados]
+    _escribir_atomico(os.path.join(directorio, ARCHIVO_PENDIENTES), restantes.tobytes())
+    _dia_pendiente[directorio] = int(dias[~cerrados][0]) if len(restantes) else None
+
+
+def archivar(carpeta, sensor_id, arreglo):
+    """
+    Agrega al archivo del sensor las muestras descartadas por la retención
+    (arreglo con la estructura del anillo, en orden cronológico) y sella los
+    días que quedaron completos.
+    """
+    if not len(arreglo):
+        return
+    directorio = carpeta_archivado(carpeta, sensor_id)
+    with _lock_archivado:
+        if directorio not in _dia_pendiente:
+            os.makedirs(directorio, exist_ok=True)
+            pendientes = _leer_pendientes(directorio)
+            _dia_pendiente[directorio] = int(_dias(pendientes['timestamp'].min())) if len(pendientes) else None
+
+        with open(os.path.join(directorio, ARCHIVO_PENDIENTES), 'ab') as f:
+            f.write(np.ascontiguousarray(arreglo, dtype=anillo.ESTRUCTURA).tobytes())
+
+        primer_dia = int(_dias(arreglo['timestamp'].min()))
+        if _dia_pendiente[directorio] is None or primer_dia < _dia_pendiente[directorio]:
+            _dia_pendiente[directorio] = primer_dia
+        ultimo_dia = int(_dias(arreglo['timestamp'].max()))
+        if ultimo_dia > _dia_pendiente[directorio]:
+            _sellar(directorio, ultimo_dia)
+
+
+# ===== LECTURA =====
+def leer_indice(directorio):
+    """
+    Metadatos de los segmentos ({día: metadatos}). Si el índice falta o
+    está dañado se reconstruye con los metadatos guardados en cada segmento.
+    """
+    try:
+        with open(os.path.join(directorio, ARCHIVO_INDICE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        pass
+
+    indice = {}
+    try:
+        nombres = sorted(os.listdir(directorio))
+    except FileNotFoundError:
+        return indice
+    for nombre in nombres:
+        if nombre.endswith(EXTENSION):
+            ruta = os.path.join(directorio, nombre)
+            with np.load(ruta) as npz:
+                metadatos = json.loads(str(npz['metadatos']))
+            metadatos['bytes'] = os.path.getsize(ruta)
+            indice[metadatos['dia']] = metadatos
+    return indice
+
+
+def segmentos(carpeta, sensor_id, desde=None, hasta=None, canal=None, minimo=None, maximo=None):
+    """
+    Metadatos de los segmentos, en orden, que tienen muestras en [desde,
+    hasta] (segundos desde anillo.EPOCA; None deja el extremo abierto). Con
+    `canal`, solo los que tienen algún valor de ese canal en [minimo, maximo]
+    según su mínimo y máximo.
+    """
+    elegidos = []
+    for dia, metadatos in sorted(leer_indice(carpeta_archivado(carpeta, sensor_id)).items()):
+        if desde is not None and metadatos['fin'] < desde:
+            continue
+        if hasta is not None and metadatos['inicio'] > hasta:
+            continue
+        if canal is not None:
+            menor, mayor = metadatos['minimos'][canal], metadatos['maximos'][canal]
+            if menor is None or (maximo is not None and menor > maximo) or (minimo is not None and mayor < minimo):
+                continue
+        elegidos.append(metadatos)
+    return elegidos
+
+
+def leer_rango(carpeta, sensor_id, desde=None, hasta=None, canales=None):
+    """
+    Muestras archivadas del sensor con timestamp en [desde, hasta], incluidas
+    las pendientes de sellar, como arreglo estructurado (timestamp y los
+    canales pedidos). Solo se abren los segmentos de los días del rango.
+    """
+    directorio = carpeta_archivado(carpeta, sensor_id)
+    canales = CANALES if canales is None else tuple(canales)
+    estructura = [('timestamp', '<f8')] + [(canal, '<f8') for canal in canales]
+
+    partes = [
+        decodificar(os.path.join(directorio, metadatos['dia'] + EXTENSION), canales)
+        for metadatos in segmentos(carpeta, sensor_id, desde, hasta)
+    ]
+    pendientes = _leer_pendientes(directorio)
+    if len(pendientes):
+        partes.append(np.array(pendientes[['timestamp', *canales]], dtype=estructura))
+    if not partes:
+        return np.empty(0, dtype=estructura)
+
+    arreglo = np.concatenate([np.asarray(parte, dtype=estructura) for parte in partes])
+    arreglo = arreglo[np.argsort(arreglo['timestamp'], kind='stable')]
+    tiempos = arreglo['timestamp']
+    primero = 0 if desde is None else int(tiempos.searchsorted(desde, 'left'))
+    ultimo = len(tiempos) if hasta is None else int(tiempos.searchsorted(hasta, 'right'))
+    return arreglo[primero:ultimo]
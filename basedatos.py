@@ -0,0 +1,255 @@
+"""
+Histórico de sensores en una base SQLite (modo WAL) compartida por el
+recolector y el dashboard.
+
+Todas las muestras van en una tabla cuya clave primaria es (sensor_id, ts) y
+sin rowid, así que las filas de cada sensor quedan guardadas juntas y en
+orden de tiempo: leer las últimas N muestras o un rango de tiempo es recorrer
+un tramo contiguo del índice. Los canales son los de anillo.CANALES y ts son
+segundos desde 1970-01-01 en hora local, como en el anillo.
+
+En modo WAL los lectores no bloquean al escritor ni entre sí: el dashboard
+lee con una conexión por hilo mientras el recolector escribe. Las muestras de
+un ciclo se insertan en una sola transacción y la retención borra por rango
+(las filas más antiguas que la ventana) cada HOLGURA_RETENCION inserciones,
+no en cada una.
+"""
+
+import os
+import sqlite3
+import threading
+
+import numpy as np
+
+import anillo
+
+ARCHIVO = 'historico.sqlite'
+
+# Filas de más que puede acumular un sensor antes de aplicar la retención
+HOLGURA_RETENCION = 360
+
+# Espera máxima por el bloqueo de escritura (varios procesos recolectores)
+ESPERA_BLOQUEO_MS = 10000
+
+CANALES = anillo.CANALES
+
+_ESQUEMA = f"""
+CREATE TABLE IF NOT EXISTS muestras (
+    sensor_id TEXT NOT NULL,
+    ts REAL NOT NULL,
+    {', '.join(f'{canal} REAL' for canal in CANALES)},
+    PRIMARY KEY (sensor_id, ts)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS sensores (
+    sensor_id TEXT PRIMARY KEY
+) WITHOUT ROWID;
+"""
+
+_COLUMNAS = ', '.join(('ts',) + CANALES)
+_INSERTAR = (
+    f"INSERT OR REPLACE INTO muestras (sensor_id, {_COLUMNAS}) "
+    f"VALUES ({', '.join('?' * (len(CANALES) + 2))})"
+)
+
+# Conexión de escritura por ruta (una por proceso) y filas por sensor
+_escritores = {}
+_conteos = {}
+_lock_escritura = threading.Lock()
+# Conexiones de lectura por hilo
+_lectores = threading.local()
+
+
+# ===== CONEXIONES =====
+def _conectar(ruta):
+    conexion = sqlite3.connect(ruta, timeout=ESPERA_BLOQUEO_MS / 1000, isolation_level=None,
+                               check_same_thread=False)
+    conexion.execute(f"PRAGMA busy_timeout = {ESPERA_BLOQUEO_MS}")
+    conexion.execute("PRAGMA journal_mode = WAL")
+    # En WAL, NORMAL no sincroniza en cada commit sino en los checkpoints: un
+    # corte de energía puede perder las últimas transacciones, no corromper
+    conexion.execute("PRAGMA synchronous = NORMAL")
+    return conexion
+
+
+def _escritor(ruta):
+    conexion = _escritores.get(ruta)
+    if conexion is None:
+        os.makedirs(os.path.dirname(ruta) or '.', exist_ok=True)
+        conexion = _conectar(ruta)
+        conexion.executescript(_ESQUEMA)
+        _escritores[ruta] = conexion
+    return conexion
+
+
+def _lector(ruta):
+    """
+    Conexión de lectura del hilo actual, o None si la base no existe.
+    """
+    conexiones = getattr(_lectores, 'conexiones', None)
+    if conexiones is None:
+        conexiones = _lectores.conexiones = {}
+    conexion = conexiones.get(ruta)
+    if conexion is None:
+        if not os.path.exists(ruta):
+            return None
+        conexion = conexiones[ruta] = _conectar(ruta)
+    return conexion
+
+
+# ===== ESCRITURA =====
+def _fila(sensor_id, registro):
+    return (sensor_id, anillo.a_epoch(registro['timestamp'])) + tuple(registro.get(canal) for canal in CANALES)
+
+
+def anexar(ruta, filas, max_registros, descartados=None):
+    """
+    Inserta en una sola transacción las muestras de `filas`, pares
+    (sensor_id, registro), y aplica la retención a los sensores que
+    superaron max_registros + HOLGURA_RETENCION. Devuelve {sensor_id: filas
+    que conserva}. Con un diccionario en `descartados`, se agregan ahí las
+    filas que borra la retención ({sensor_id: arreglo como leer_arreglo}).
+    """
+    with _lock_escritura:
+        conexion = _escritor(ruta)
+        conexion.execute("BEGIN IMMEDIATE")
+        try:
+            conexion.executemany(_INSERTAR, [_fila(sensor_id, registro) for sensor_id, registro in filas])
+            conservados = {}
+            for sensor_id in {sensor_id for sensor_id, _ in filas}:
+                clave = (ruta, sensor_id)
+                if clave not in _conteos:
+                    conexion.execute("INSERT OR IGNORE INTO sensores (sensor_id) VALUES (?)", (sensor_id,))
+                    _conteos[clave] = conexion.execute(
+                        "SELECT COUNT(*) FROM muestras WHERE sensor_id = ?", (sensor_id,)
+                    ).fetchone()[0]
+                else:
+                    _conteos[clave] += sum(1 for s, _ in filas if s == sensor_id)
+
+                if _conteos[clave] >= max_registros + HOLGURA_RETENCION:
+                    condicion = (
+                        "WHERE sensor_id = ? AND ts < ("
+                        "SELECT ts FROM muestras WHERE sensor_id = ? ORDER BY ts DESC LIMIT 1 OFFSET ?)"
+                    )
+                    parametros = (sensor_id, sensor_id, max_registros - 1)
+                    if descartados is not None:
+                        descartados[sensor_id] = _a_arreglo(conexion.execute(
+                            f"SELECT {_COLUMNAS} FROM muestras {condicion} ORDER BY ts", parametros
+                        ).fetchall())
+                    conexion.execute(f"DELETE FROM muestras {condicion}", parametros)
+                    _conteos[clave] = max_registros
+                conservados[sensor_id] = min(_conteos[clave], max_registros)
+            conexion.execute("COMMIT")
+        except BaseException:
+            if conexion.in_transaction:
+                conexion.execute("ROLLBACK")
+            _conteos.clear()
+            if descartados is not None:
+                descartados.clear()
+            raise
+    return conservados
+
+
+def contiene(ruta, sensor_id):
+    conexion = _lector(ruta)
+    if conexion is None:
+        return False
+    try:
+        return conexion.execute("SELECT 1 FROM sensores WHERE sensor_id = ?", (sensor_id,)).fetchone() is not None
+    except sqlite3.OperationalError:
+        # Base recién creada por otro proceso, todavía sin tablas
+        return False
+
+
+def listar_sensores(ruta):
+    conexion = _lector(ruta)
+    if conexion is None:
+        return []
+    try:
+        return [fila[0] for fila in conexion.execute("SELECT sensor_id FROM sensores")]
+    except sqlite3.OperationalError:
+        return []
+
+
+# ===== LECTURA =====
+def _a_arreglo(filas):
+    arreglo = np.empty(len(filas), dtype=anillo.ESTRUCTURA)
+    for i, fila in enumerate(filas):
+        arreglo[i] = tuple(np.nan if valor is None else valor for valor in fila)
+    return arreglo
+
+
+def _a_registros(filas):
+    registros = []
+    for fila in filas:
+        registro = {'timestamp': anillo.desde_epoch(fila[0]).isoformat()}
+        registro.update(zip(CANALES, fila[1:]))
+        registros.append(registro)
+    return registros
+
+
+def _ultimas(ruta, sensor_id, max_registros=None):
+    conexion = _lector(ruta)
+    if max_registros:
+        filas = conexion.execute(
+            f"SELECT {_COLUMNAS} FROM muestras WHERE sensor_id = ? ORDER BY ts DESC LIMIT ?",
+            (sensor_id, max_registros)
+        ).fetchall()
+        filas.reverse()
+        return filas
+    return conexion.execute(
+        f"SELECT {_COLUMNAS} FROM muestras WHERE sensor_id = ? ORDER BY ts", (sensor_id,)
+    ).fetchall()
+
+
+def leer_registros(ruta, sensor_id, max_registros=None):
+    """
+    Últimas max_registros muestras del sensor (todas si es None), en orden
+    cronológico y con el formato de registro del histórico en JSON.
+    """
+    return _a_registros(_ultimas(ruta, sensor_id, max_registros))
+
+
+def leer_arreglo(ruta, sensor_id, max_registros=None):
+    """
+    Como leer_registros, pero como arreglo NumPy con la estructura del anillo
+    (los valores nulos quedan como NaN).
+    """
+    return _a_arreglo(_ultimas(ruta, sensor_id, max_registros))
+
+
+def leer_rango(ruta, sensor_id, desde=None, hasta=None):
+    """
+    Muestras con ts en [desde, hasta] (None deja el extremo abierto).
+    """
+    condiciones, parametros = ["sensor_id = ?"], [sensor_id]
+    if desde is not None:
+        condiciones.append("ts >= ?")
+        parametros.append(desde)
+    if hasta is not None:
+        condiciones.append("ts <= ?")
+        parametros.append(hasta)
+    filas = _lector(ruta).execute(
+        f"SELECT {_COLUMNAS} FROM muestras WHERE {' AND '.join(condiciones)} ORDER BY ts", parametros
+    ).fetchall()
+    return _a_registros(filas)
+
+
+def leer_posteriores(ruta, sensor_id, ts):
+    """
+    Muestras con ts estrictamente mayor que `ts`.
+    """
+    filas = _lector(ruta).execute(
+        f"SELECT {_COLUMNAS} FROM muestras WHERE sensor_id = ? AND ts > ? ORDER BY ts", (sensor_id, ts)
+    ).fetchall()
+    return _a_registros(filas)
+
+
+def extremo(ruta, sensor_id, ultimo=False):
+    """
+    ts de la muestra más antigua (o la más reciente con ultimo=True), o None.
+    """
+    fila = _lector(ruta).execute(
+        f"SELECT ts FROM muestras WHERE sensor_id = ? ORDER BY ts {'DESC' if ultimo else 'ASC'} LIMIT 1",
+        (sensor_id,)
+    ).fetchone()
+    return fila[0] if fila else None
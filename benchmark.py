@@ -0,0 +1,315 @@
+"""
+Benchmark del recolector y del dashboard con una flota sintética de medidores.
+
+Para cada tamaño de flota levanta el servidor de prueba (stub_servidor.py) en
+un puerto local, apunta getter.py a carpetas temporales y mide:
+
+- Duración de procesar_todos_sensores (el primer ciclo se informa aparte:
+  incluye la reconstrucción de los agregados desde el histórico).
+- Bytes escritos por muestra en patch_archivo_local y en actualizar_historico
+  (contador wchar de /proc/self/io; en sistemas sin /proc se informa null).
+- Tiempo de arranque del dashboard (cargar_datos_json), leyendo el histórico
+  y desde la instantánea que escribe el recolector (ver instantanea.py).
+- Latencia de los callbacks del dashboard (mapa, barras, tabla y tendencia) por KPI.
+
+Los resultados se escriben en JSON para comparar entre versiones. Uso:
+
+    python benchmark.py --sensores 16,100,1000 --latencia 0.01 --salida benchmark.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+import anillo
+import historico
+import instantanea
+import stub_servidor
+
+CARPETA_REPO = os.path.dirname(os.path.abspath(__file__))
+
+# Intervalo nominal entre muestras del histórico precargado, en segundos
+INTERVALO_MUESTRAS = 30
+
+
+# ===== UTILIDADES =====
+def resumen_tiempos(tiempos):
+    """
+    Estadísticos de una lista de duraciones, en segundos.
+    """
+    if not tiempos:
+        return None
+    arreglo = np.asarray(tiempos, dtype=np.float64)
+    return {
+        'n': len(tiempos),
+        'media': float(arreglo.mean()),
+        'p50': float(np.percentile(arreglo, 50)),
+        'p95': float(np.percentile(arreglo, 95)),
+        'max': float(arreglo.max())
+    }
+
+
+def bytes_escritos():
+    """
+    Bytes pasados a write() por el proceso hasta ahora (Linux), o None.
+    """
+    try:
+        with open('/proc/self/io', 'r') as f:
+            for linea in f:
+                if linea.startswith('wchar:'):
+                    return int(linea.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def commit_actual():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=CARPETA_REPO,
+                              capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def configurar_getter(getter, carpeta, sensores, puerto, args):
+    getter.BASE_URL = f"http://127.0.0.1:{puerto}/data"
+    getter.URL_NGSI = f"http://127.0.0.1:{puerto}/v2"
+    getter.MODO_ADQUISICION = args.modo
+    getter.FORMATO_HISTORICO = args.formato_historico
+    getter.SENSORES = sensores
+    getter.LIMITE_POR_HOST = args.limite_por_host
+    getter.CARPETA_DATOS_ACTUALES = os.path.join(carpeta, 'datos')
+    getter.CARPETA_HISTORICO = os.path.join(carpeta, 'historico')
+    os.makedirs(getter.CARPETA_DATOS_ACTUALES, exist_ok=True)
+    os.makedirs(getter.CARPETA_HISTORICO, exist_ok=True)
+    # Cachés por sensor de la corrida anterior
+    getter._validadores_http.clear()
+    getter._ultimo_patch.clear()
+    for clave in getter.estadisticas:
+        if clave != 'ultima_actualizacion':
+            getter.estadisticas[clave] = 0
+
+
+def precargar_historico(carpeta, sensores, plantillas, cantidad, formato):
+    """
+    Escribe `cantidad` muestras por sensor, espaciadas INTERVALO_MUESTRAS y
+    terminando en el momento actual, para medir el arranque del dashboard.
+    """
+    inicio = datetime.now() - timedelta(seconds=INTERVALO_MUESTRAS * (cantidad + 1))
+    for i in range(cantidad):
+        registros = {}
+        for sensor_id in sensores:
+            base = plantillas[f"SmartMeter_{sensor_id}"]
+            registro = {'timestamp': (inicio + timedelta(seconds=INTERVALO_MUESTRAS * i)).isoformat()}
+            for canal in anillo.CANALES:
+                valor = base.get(canal, {}).get('value', 0) or 0
+                registro[canal] = valor * (1 + 0.05 * random.uniform(-1, 1))
+            registros[sensor_id] = registro
+        historico.anexar_registros(carpeta, registros, max(cantidad, 1), formato)
+
+
+# ===== MEDICIONES =====
+def medir_ciclos(getter, ciclos):
+    tiempos = []
+    for _ in range(ciclos):
+        inicio = time.perf_counter()
+        getter.procesar_todos_sensores()
+        tiempos.append(time.perf_counter() - inicio)
+    return tiempos
+
+
+def medir_bytes_por_muestra(getter, sensores, plantillas, rondas):
+    """
+    Bytes escritos por muestra en el "patch" de datos/ y en el histórico, con
+    payloads que cambian en cada ronda (sin pasar por HTTP).
+    """
+    if bytes_escritos() is None:
+        return {'patch': None, 'historico': None}
+
+    totales = {'patch': 0, 'historico': 0}
+    for ronda in range(rondas):
+        payloads = {
+            sensor_id: stub_servidor.entidad_en_periodo(plantillas[f"SmartMeter_{sensor_id}"], -ronda - 1, 0.05)
+            for sensor_id in sensores
+        }
+        antes = bytes_escritos()
+        for sensor_id in sensores:
+            getter.patch_archivo_local(sensor_id, payloads[sensor_id])
+        medio = bytes_escritos()
+        # Como en un ciclo: un registro por sensor, guardados juntos
+        getter.guardar_historico({s: getter.registro_historico(payloads[s]) for s in sensores})
+        despues = bytes_escritos()
+        totales['patch'] += medio - antes
+        totales['historico'] += despues - medio
+
+    muestras = len(sensores) * rondas
+    return {etapa: total / muestras for etapa, total in totales.items()}
+
+
+def medir_dashboard(app, carpeta_historico, sensores, repeticiones):
+    """
+    Arranque del dashboard sobre el histórico de la flota y latencia de los
+    callbacks por KPI.
+    """
+    app.CARPETA_HISTORICO = carpeta_historico
+    for i, sensor_id in enumerate(sensores):
+        if sensor_id not in app.ubicaciones_bloques:
+            app.ubicaciones_bloques[sensor_id] = {
+                'lat': 6.2405 + (i % 100) * 0.00003,
+                'lon': -75.5910 + (i // 100 % 100) * 0.00003,
+                'nombre': sensor_id
+            }
+
+    # Sin instantánea (la carpeta es nueva) y con la que escribiría el recolector
+    with contextlib.redirect_stdout(io.StringIO()):
+        inicio = time.perf_counter()
+        datos = app.cargar_datos_json()
+        carga = time.perf_counter() - inicio
+
+        bloques = {}
+        instantanea.actualizar(carpeta_historico, bloques, sensores, app.KPIS, app.MAX_REGISTROS_DASHBOARD)
+        instantanea.escribir(instantanea.ruta_instantanea(carpeta_historico, 'benchmark'), bloques,
+                             app.KPIS, app.MAX_REGISTROS_DASHBOARD)
+        inicio = time.perf_counter()
+        app.cargar_datos_json()
+        carga_instantanea = time.perf_counter() - inicio
+    app.datos_bloques = datos
+
+    # Dibujo completo de cada salida, como en la carga de la página. La caché
+    # de resultados se vacía antes de cada llamada: se mide el cálculo, no
+    # la consulta a la caché
+    funciones = {
+        'actualizar_mapa': lambda kpi: app.actualizar_mapa(kpi, None, ['heatmap']),
+        'actualizar_barras': lambda kpi: app.actualizar_barras(kpi, 30, None),
+        'actualizar_tabla': lambda kpi: app.actualizar_tabla(kpi, None),
+        'actualizar_lineas': lambda kpi: app.actualizar_lineas(kpi, None, None)
+    }
+    callbacks = {}
+    for kpi in app.KPIS:
+        tiempos = {nombre: [] for nombre in funciones}
+        for _ in range(repeticiones):
+            for nombre, funcion in funciones.items():
+                app.cache.limpiar()
+                inicio = time.perf_counter()
+                funcion(kpi)
+                tiempos[nombre].append(time.perf_counter() - inicio)
+        callbacks[kpi] = {nombre: resumen_tiempos(t) for nombre, t in tiempos.items()}
+
+    return {'sensores_cargados': len(datos), 'carga_s': carga, 'carga_instantanea_s': carga_instantanea,
+            'callbacks_s': callbacks}
+
+
+def ejecutar_escenario(getter, app, modelos, cantidad, args):
+    carpeta = tempfile.mkdtemp(prefix=f'bench_{cantidad}_')
+    plantillas = stub_servidor.generar_flota(modelos, cantidad)
+    sensores = stub_servidor.ids_sensores(plantillas)
+
+    # Periodo corto: cada ciclo recibe valores nuevos, como un medidor real
+    servidor = stub_servidor.crear_servidor(
+        plantillas, periodo=0.001, latencia=args.latencia, tasa_fallas=args.tasa_fallas,
+        en_segundo_plano=True
+    )
+    try:
+        configurar_getter(getter, carpeta, sensores, servidor.server_address[1], args)
+
+        inicio = time.perf_counter()
+        precargar_historico(getter.CARPETA_HISTORICO, sensores, plantillas, args.registros, args.formato_historico)
+        precarga = time.perf_counter() - inicio
+
+        ciclos = medir_ciclos(getter, args.ciclos + 1)
+        resultado = {
+            'sensores': cantidad,
+            'precarga_historico_s': precarga,
+            'primer_ciclo_s': ciclos[0],
+            'ciclo_s': resumen_tiempos(ciclos[1:]),
+            'get_exitosos': getter.estadisticas['get_exitosos'],
+            'get_fallidos': getter.estadisticas['get_fallidos'],
+            'bytes_por_muestra': medir_bytes_por_muestra(getter, sensores, plantillas, args.rondas_bytes)
+        }
+        resultado['dashboard'] = medir_dashboard(app, getter.CARPETA_HISTORICO, sensores, args.repeticiones)
+        return resultado
+    finally:
+        servidor.shutdown()
+        servidor.server_close()
+        if not args.conservar:
+            shutil.rmtree(carpeta, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark del recolector y del dashboard con una flota sintética')
+    parser.add_argument('--sensores', default='16,100,1000', help='tamaños de flota separados por coma (hasta 10000)')
+    parser.add_argument('--latencia', type=float, default=0.0, help='demora del servidor por solicitud, en segundos')
+    parser.add_argument('--tasa-fallas', type=float, default=0.0, help='fracción de solicitudes que fallan (503)')
+    parser.add_argument('--modo', choices=('individual', 'lote'), default='individual', help='MODO_ADQUISICION del recolector')
+    parser.add_argument('--formato-historico', choices=('jsonl', 'anillo', 'sqlite'), default='jsonl',
+                        help='FORMATO_HISTORICO del recolector')
+    parser.add_argument('--limite-por-host', type=int, default=0, help='LIMITE_POR_HOST del recolector (0 = sin límite)')
+    parser.add_argument('--ciclos', type=int, default=3, help='ciclos medidos además del primero')
+    parser.add_argument('--registros', type=int, default=360, help='muestras precargadas por sensor')
+    parser.add_argument('--rondas-bytes', type=int, default=3, help='rondas para medir bytes por muestra')
+    parser.add_argument('--repeticiones', type=int, default=5, help='llamadas por callback y KPI')
+    parser.add_argument('--plantillas', default=os.path.join(CARPETA_REPO, 'datos'), help='JSON de medidores de ejemplo')
+    parser.add_argument('--salida', default='benchmark.json', help='archivo JSON de resultados')
+    parser.add_argument('--conservar', action='store_true', help='no borra las carpetas temporales')
+    args = parser.parse_args()
+
+    tamanos = [int(n) for n in args.sensores.split(',') if n.strip()]
+    modelos = stub_servidor.cargar_plantillas(args.plantillas)
+    salida = os.path.abspath(args.salida)
+
+    # getter y app crean y leen carpetas relativas al directorio actual al
+    # importarse: se importan desde una carpeta temporal vacía
+    base = tempfile.mkdtemp(prefix='bench_base_')
+    directorio_original = os.getcwd()
+    os.chdir(base)
+    sys.path.insert(0, CARPETA_REPO)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            import getter
+            import app
+        # Las fallas simuladas no se registran una por una
+        logging.getLogger().setLevel(logging.ERROR)
+        app.REFRESCO_SEGUNDOS = 3600
+
+        resultados = []
+        for cantidad in tamanos:
+            print(f"⏱️ Flota de {cantidad} medidores...")
+            with contextlib.redirect_stdout(io.StringIO()):
+                resultado = ejecutar_escenario(getter, app, modelos, cantidad, args)
+            resultados.append(resultado)
+            ciclo = resultado['ciclo_s']
+            print(f"   ciclo p50 {ciclo['p50']:.3f} s | patch {resultado['bytes_por_muestra']['patch']} B/muestra | "
+                  f"histórico {resultado['bytes_por_muestra']['historico']} B/muestra | "
+                  f"carga dashboard {resultado['dashboard']['carga_s']:.3f} s")
+    finally:
+        os.chdir(directorio_original)
+        shutil.rmtree(base, ignore_errors=True)
+
+    informe = {
+        'fecha': datetime.now().isoformat(),
+        'commit': commit_actual(),
+        'python': platform.python_version(),
+        'plataforma': platform.platform(),
+        'parametros': {k: v for k, v in vars(args).items() if k not in ('salida', 'plantillas')},
+        'resultados': resultados
+    }
+    with open(salida, 'w', encoding='utf-8') as f:
+        json.dump(informe, f, indent=2, ensure_ascii=False)
+    print(f"✅ Resultados en {salida}")
+
+
+if __name__ == '__main__':
+    main()
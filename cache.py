@@ -0,0 +1,161 @@
+"""
+Caché de resultados de los callbacks del dashboard (figuras, parches y la
+tabla de ranking).
+
+Cada resultado se guarda bajo una clave con los valores de las entradas del
+callback y la versión de los datos: mientras los datos no cambian, todos los
+navegadores que piden lo mismo reciben el resultado ya calculado, y al subir
+la versión las claves viejas dejan de usarse y salen por antigüedad (LRU).
+Si varios hilos piden a la vez una clave que falta, uno la calcula y los
+demás esperan ese resultado.
+
+Opcionalmente hay un segundo nivel en disco (una carpeta compartida por
+varios procesos del dashboard, un archivo pickle por clave). Como cada
+proceso numera sus versiones por su cuenta, en disco la versión se
+reemplaza por una huella del contenido de los datos que todos los procesos
+calculan igual.
+"""
+
+import hashlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+# Resultados que conserva la caché en memoria
+MAX_ENTRADAS = 256
+
+# Archivos que conserva la caché en disco y cada cuántas escrituras se podan
+MAX_ARCHIVOS = 2048
+PODA_CADA = 64
+
+_entradas = OrderedDict()
+_calculando = {}
+_lock_cache = threading.Lock()
+_configuracion = {'max_entradas': MAX_ENTRADAS, 'carpeta': None, 'max_archivos': MAX_ARCHIVOS}
+_estadisticas = {'aciertos': 0, 'aciertos_disco': 0, 'fallos': 0}
+_escrituras_disco = 0
+
+
+def configurar(max_entradas=MAX_ENTRADAS, carpeta=None, max_archivos=MAX_ARCHIVOS):
+    """
+    Fija el tamaño de la caché en memoria y, con `carpeta`, activa la caché
+    en disco. Vacía la caché en memoria.
+    """
+    if carpeta:
+        os.makedirs(carpeta, exist_ok=True)
+    with _lock_cache:
+        _configuracion.update(max_entradas=max_entradas, carpeta=carpeta, max_archivos=max_archivos)
+        _entradas.clear()
+
+
+def limpiar():
+    with _lock_cache:
+        _entradas.clear()
+
+
+def estadisticas():
+    with _lock_cache:
+        return {**_estadisticas, 'entradas': len(_entradas)}
+
+
+# ===== DISCO =====
+def _archivo(clave, huella):
+    resumen = hashlib.sha1(repr((clave, huella)).encode('utf-8')).hexdigest()
+    return os.path.join(_configuracion['carpeta'], f"{resumen}.pkl")
+
+
+def _leer_disco(ruta):
+    try:
+        with open(ruta, 'rb') as f:
+            return True, pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return False, None
+
+
+def _escribir_disco(ruta, valor):
+    global _escrituras_disco
+    temporal = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(temporal, 'wb') as f:
+            pickle.dump(valor, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporal, ruta)
+    except (OSError, pickle.PicklingError, TypeError, AttributeError):
+        # Un resultado que no se puede guardar queda solo en memoria
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        return
+
+    with _lock_cache:
+        _escrituras_disco += 1
+        podar = _escrituras_disco % PODA_CADA == 0
+    if podar:
+        _podar_disco()
+
+
+def _podar_disco():
+    """
+    Borra los archivos más viejos de la carpeta por encima de max_archivos.
+    """
+    carpeta = _configuracion['carpeta']
+    archivos = []
+    for nombre in os.listdir(carpeta):
+        if nombre.endswith('.pkl'):
+            ruta = os.path.join(carpeta, nombre)
+            try:
+                archivos.append((os.path.getmtime(ruta), ruta))
+            except OSError:
+                pass
+    archivos.sort()
+    for _, ruta in archivos[:max(0, len(archivos) - _configuracion['max_archivos'])]:
+        try:
+            os.remove(ruta)
+        except OSError:
+            # Otro proceso ya lo borró
+            pass
+
+
+# ===== CONSULTA =====
+def obtener(clave, version, calcular, huella=None):
+    """
+    Resultado de calcular() para `clave` (tupla de valores hashables) en la
+    versión de datos `version`. `huella` es una función que devuelve la
+    huella de los datos actuales; solo se llama si hay caché en disco y el
+    resultado no está en memoria.
+    """
+    clave_memoria = (clave, version)
+    while True:
+        with _lock_cache:
+            if clave_memoria in _entradas:
+                _entradas.move_to_end(clave_memoria)
+                _estadisticas['aciertos'] += 1
+                return _entradas[clave_memoria]
+            evento = _calculando.get(clave_memoria)
+            if evento is None:
+                evento = _calculando[clave_memoria] = threading.Event()
+                break
+        # Otro hilo la está calculando: se espera y se vuelve a buscar (si
+        # ese hilo falló, este la calcula)
+        evento.wait()
+
+    try:
+        ruta = None
+        encontrado = False
+        if _configuracion['carpeta'] and huella is not None:
+            ruta = _archivo(clave, huella())
+            encontrado, valor = _leer_disco(ruta)
+        if not encontrado:
+            valor = calcular()
+            if ruta is not None:
+                _escribir_disco(ruta, valor)
+
+        with _lock_cache:
+            _estadisticas['aciertos_disco' if encontrado else 'fallos'] += 1
+            _entradas[clave_memoria] = valor
+            while len(_entradas) > _configuracion['max_entradas']:
+                _entradas.popitem(last=False)
+        return valor
+    finally:
+        with _lock_cache:
+            _calculando.pop(clave_memoria, None)
+        evento.set()
@@ -0,0 +1,297 @@
+"""
+Plano de datos compartido entre varios procesos del dashboard.
+
+Un proceso cargador (python app.py --cargador) mantiene las series
+columnares de todos los sensores en un archivo mapeado en memoria, en
+/dev/shm cuando existe (memoria, sin escrituras a disco). Cada worker del
+dashboard mapea el mismo archivo en solo lectura y arma sus series con
+vistas NumPy sobre él: los datos existen una sola vez sin importar cuántos
+workers atienden navegadores.
+
+Cada sensor tiene un lugar fijo con dos mitades de `mitad` registros por
+canal. Las muestras nuevas se escriben a continuación de las visibles y
+después se publica el nuevo final; cuando la mitad se llena (o el sensor se
+recarga completo) la ventana se copia a la otra mitad. Así, lo que un worker
+está leyendo no se sobrescribe hasta la alternancia siguiente, horas
+después. El índice (inicio y fin de cada sensor) y los metadatos se publican
+con un contador de secuencia (seqlock): impar mientras el cargador escribe,
+y un lector que ve cambiar la secuencia vuelve a leer.
+
+Si el cargador se reinicia, el archivo se reemplaza por uno nuevo y los
+workers lo detectan (cambia el inodo) y vuelven a mapearlo.
+"""
+
+import json
+import mmap
+import os
+import struct
+import tempfile
+import time
+
+import numpy as np
+
+import series
+
+FIRMA = b'IOTPLANO'
+VERSION = 1
+
+# Cabecera: firma, versión, canales, lugares, registros por mitad, registros
+# por sensor, capacidad de metadatos, largo de metadatos y secuencia
+FORMATO_CABECERA = '<8sHHIIIQQQ'
+OFFSET_SECUENCIA = struct.calcsize('<8sHHIIIQQ')
+OFFSET_LARGO_META = struct.calcsize('<8sHHIIIQ')
+TAMANO_CABECERA = 128
+
+EXTENSION = '.plano'
+
+# Registros de sobra en cada mitad, por encima de la ventana del dashboard:
+# cuántas muestras de un sensor pueden llegar antes de alternar de mitad
+MARGEN_MITAD = 1024
+
+# Metadatos (ids de los lugares y banderas de anomalías, en JSON)
+BYTES_META_BASE = 65536
+BYTES_META_POR_SENSOR = 4096
+
+
+# ===== RUTAS =====
+def ruta_predeterminada(nombre):
+    carpeta = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(carpeta, f"{nombre}{EXTENSION}")
+
+
+# ===== ESTRUCTURA =====
+def _disposicion(canales, lugares, mitad, bytes_meta):
+    """
+    Offsets de cada parte del archivo: índice (inicio y fin por lugar, int64),
+    metadatos y una matriz lugares x (2 * mitad) por columna.
+    """
+    offsets = {'indice': TAMANO_CABECERA}
+    offsets['meta'] = offsets['indice'] + lugares * 2 * 8
+    posicion = offsets['meta'] + bytes_meta
+    for columna in ('tiempos',) + tuple(canales):
+        offsets[columna] = posicion
+        posicion += lugares * 2 * mitad * 8
+    offsets['total'] = posicion
+    return offsets
+
+
+def _mapear(mm, canales, lugares, mitad, bytes_meta):
+    offsets = _disposicion(canales, lugares, mitad, bytes_meta)
+    columnas = {}
+    for columna in ('tiempos',) + tuple(canales):
+        tipo = np.int64 if columna == 'tiempos' else np.float64
+        columnas[columna] = np.frombuffer(mm, dtype=tipo, count=lugares * 2 * mitad,
+                                          offset=offsets[columna]).reshape(lugares, 2 * mitad)
+    indice = np.frombuffer(mm, dtype=np.int64, count=lugares * 2, offset=offsets['indice']).reshape(lugares, 2)
+    return offsets, indice, columnas
+
+
+def _secuencia(mm):
+    return struct.unpack_from('<Q', mm, OFFSET_SECUENCIA)[0]
+
+
+# ===== CARGADOR (ESCRITURA) =====
+def crear(ruta, sensor_ids, canales, max_registros, series_sensores=None, banderas=None):
+    """
+    Crea (o reemplaza de forma atómica) el plano para `sensor_ids` con las
+    series y banderas iniciales (ver publicar) y lo abre para escritura. Los
+    workers no ven el archivo nuevo hasta que tiene todos los datos.
+    """
+    sensor_ids = list(sensor_ids)
+    mitad = max_registros + MARGEN_MITAD
+    bytes_meta = BYTES_META_BASE + BYTES_META_POR_SENSOR * len(sensor_ids)
+    offsets = _disposicion(canales, len(sensor_ids), mitad, bytes_meta)
+
+    temporal = ruta + '.tmp'
+    with open(temporal, 'wb') as f:
+        cabecera = struct.pack(FORMATO_CABECERA, FIRMA, VERSION, len(canales), len(sensor_ids), mitad,
+                               max_registros, bytes_meta, 0, 0)
+        f.write(cabecera.ljust(TAMANO_CABECERA, b'\0'))
+        f.truncate(offsets['total'])
+    with open(temporal, 'r+b') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_WRITE)
+
+    _, indice, columnas = _mapear(mm, canales, len(sensor_ids), mitad, bytes_meta)
+    plano = {
+        'mmap': mm,
+        'ruta': ruta,
+        'canales': tuple(canales),
+        'ids': sensor_ids,
+        'lugares': {sensor_id: i for i, sensor_id in enumerate(sensor_ids)},
+        'mitad': mitad,
+        'max_registros': max_registros,
+        'bytes_meta': bytes_meta,
+        'offset_meta': offsets['meta'],
+        'indice': indice,
+        'columnas': columnas,
+        'meta': None
+    }
+    publicar(plano, series_sensores or {}, banderas or {})
+    os.replace(temporal, ruta)
+    return plano
+
+
+def _escribir_tramo(plano, lugar, desde, tiempos, valores):
+    hasta = desde + len(tiempos)
+    plano['columnas']['tiempos'][lugar, desde:hasta] = tiempos
+    for canal in plano['canales']:
+        plano['columnas'][canal][lugar, desde:hasta] = valores[canal]
+
+
+def _actualizar_lugar(plano, lugar, serie):
+    """
+    Escribe en el lugar lo que la serie tiene y el plano todavía no (sin
+    tocar la parte visible) y devuelve el (inicio, fin) a publicar, o None si
+    no hay cambios.
+    """
+    inicio, fin = (int(v) for v in plano['indice'][lugar])
+    tiempos, valores = series.foto_serie(serie)
+    tiempos = tiempos[-plano['max_registros']:]
+    valores = {canal: valores[canal][-plano['max_registros']:] for canal in plano['canales']}
+    mitad = plano['mitad']
+
+    if fin > inicio:
+        publicados = plano['columnas']['tiempos'][lugar, inicio:fin]
+        desde = int(np.searchsorted(tiempos, publicados[-1], 'right'))
+        # Lo publicado sigue siendo el comienzo de la serie si los tiempos
+        # coinciden (una muestra atrasada intercalada en la serie lo cambia)
+        comunes = min(desde, len(publicados))
+        continua = comunes and np.array_equal(tiempos[desde - comunes:desde], publicados[-comunes:])
+        if continua and desde == len(tiempos):
+            return None
+        if continua and fin + len(tiempos) - desde <= (inicio // mitad + 1) * mitad:
+            # Continuación de lo publicado: se anexa en la misma mitad
+            _escribir_tramo(plano, lugar, fin, tiempos[desde:], {c: v[desde:] for c, v in valores.items()})
+            nuevo_fin = fin + len(tiempos) - desde
+            return max(inicio, nuevo_fin - plano['max_registros']), nuevo_fin
+        base = (1 - inicio // mitad) * mitad
+    else:
+        if not len(tiempos):
+            return None
+        base = 0
+
+    # Mitad llena, sensor recargado o lugar vacío: ventana completa en la otra mitad
+    _escribir_tramo(plano, lugar, base, tiempos, valores)
+    return base, base + len(tiempos)
+
+
+def publicar(plano, series_sensores, banderas):
+    """
+    Publica las series ({sensor_id: serie}) y banderas de anomalías
+    ({sensor_id: banderas}) del cargador. Los sensores que faltan quedan sin
+    datos. Devuelve la cantidad de sensores que cambiaron.
+    """
+    cambios = {}
+    for sensor_id, lugar in plano['lugares'].items():
+        serie = series_sensores.get(sensor_id)
+        if serie is None:
+            if plano['indice'][lugar, 1] > plano['indice'][lugar, 0]:
+                cambios[lugar] = (0, 0)
+            continue
+        nuevo = _actualizar_lugar(plano, lugar, serie)
+        if nuevo is not None:
+            cambios[lugar] = nuevo
+
+    meta = json.dumps({
+        'ids': plano['ids'],
+        'anomalias': {sensor_id: b for sensor_id, b in banderas.items() if b and sensor_id in plano['lugares']}
+    }, ensure_ascii=False).encode('utf-8')
+    if len(meta) > plano['bytes_meta']:
+        # Sin lugar para todas las banderas se publican solo los ids
+        meta = json.dumps({'ids': plano['ids'], 'anomalias': {}}, ensure_ascii=False).encode('utf-8')
+    cambia_meta = meta != plano['meta']
+    if not cambios and not cambia_meta:
+        return 0
+
+    # Seqlock: secuencia impar mientras cambian el índice y los metadatos
+    mm = plano['mmap']
+    secuencia = _secuencia(mm)
+    struct.pack_into('<Q', mm, OFFSET_SECUENCIA, secuencia + 1)
+    for lugar, (inicio, fin) in cambios.items():
+        plano['indice'][lugar] = (inicio, fin)
+    if cambia_meta:
+        mm[plano['offset_meta']:plano['offset_meta'] + len(meta)] = meta
+        struct.pack_into('<Q', mm, OFFSET_LARGO_META, len(meta))
+        plano['meta'] = meta
+    struct.pack_into('<Q', mm, OFFSET_SECUENCIA, secuencia + 2)
+    return len(cambios)
+
+
+def cerrar(plano):
+    plano['indice'] = plano['columnas'] = None
+    plano['mmap'].close()
+
+
+# ===== WORKERS (LECTURA) =====
+def abrir_lectura(ruta):
+    """
+    Mapea el plano en solo lectura. Lanza FileNotFoundError si el cargador
+    todavía no lo creó.
+    """
+    with open(ruta, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        inodo = os.fstat(f.fileno()).st_ino
+    firma, version, canales, lugares, mitad, max_registros, bytes_meta, _, _ = \
+        struct.unpack_from(FORMATO_CABECERA, mm, 0)
+    if firma != FIRMA or version != VERSION:
+        mm.close()
+        raise ValueError("Plano de datos con formato desconocido")
+    return {
+        'mmap': mm,
+        'ruta': ruta,
+        'inodo': inodo,
+        'lugares': lugares,
+        'mitad': mitad,
+        'max_registros': max_registros,
+        'bytes_meta': bytes_meta,
+        'canales_n': canales
+    }
+
+
+def vigente(lector):
+    """
+    False si el cargador reemplazó (o borró) el archivo desde que se mapeó.
+    """
+    try:
+        return os.stat(lector['ruta']).st_ino == lector['inodo']
+    except FileNotFoundError:
+        return False
+
+
+def secuencia(lector):
+    return _secuencia(lector['mmap'])
+
+
+def leer(lector, canales):
+    """
+    Foto consistente del plano: (secuencia, {sensor_id: serie},
+    {sensor_id: banderas}). Las series son vistas de solo lectura sobre la
+    memoria compartida, sin copias.
+    """
+    mm = lector['mmap']
+    if lector['canales_n'] != len(canales):
+        raise ValueError("El plano de datos tiene otros canales")
+    _, indice, columnas = _mapear(mm, canales, lector['lugares'], lector['mitad'], lector['bytes_meta'])
+    offset_meta = _disposicion(canales, lector['lugares'], lector['mitad'], lector['bytes_meta'])['meta']
+
+    while True:
+        antes = _secuencia(mm)
+        if antes % 2:
+            time.sleep(0.0005)
+            continue
+        filas = indice.copy()
+        largo = struct.unpack_from('<Q', mm, OFFSET_LARGO_META)[0]
+        meta = bytes(mm[offset_meta:offset_meta + largo])
+        if _secuencia(mm) == antes:
+            break
+
+    meta = json.loads(meta) if meta else {'ids': [], 'anomalias': {}}
+    series_sensores = {}
+    for lugar, sensor_id in enumerate(meta['ids']):
+        inicio, fin = (int(v) for v in filas[lugar])
+        if fin <= inicio:
+            continue
+        actual = {'inicio': inicio, 'fin': fin, 'tiempos': columnas['tiempos'][lugar]}
+        actual.update({canal: columnas[canal][lugar] for canal in canales})
+        series_sensores[sensor_id] = {'canales': tuple(canales), 'actual': actual}
+    return antes, series_sensores, meta['anomalias']
@@ -0,0 +1,273 @@
+"""
+Compresión con pérdida del histórico en JSON Lines: banda muerta y puerta
+giratoria (swinging door).
+
+Con compresión, cada línea del histórico lleva el timestamp y solo los
+canales que hay que guardar en esa muestra; al leer, los que faltan se
+reconstruyen por interpolación lineal entre los puntos guardados de cada
+canal. Cada canal comprimido usa uno de dos métodos, con un umbral en sus
+propias unidades:
+
+- 'banda' (banda muerta): el valor se guarda cuando se aparta más del umbral
+  del último guardado. Junto con él se guarda el valor sostenido en la
+  muestra anterior, para que la interpolación reproduzca el escalón.
+- 'puerta' (puerta giratoria): desde el último punto guardado se mantiene el
+  rango de pendientes de las rectas que pasan a menos del umbral de todas las
+  muestras siguientes. Cuando una muestra deja el rango vacío se guarda el
+  punto de la recta en la muestra anterior y se empieza de nuevo desde ahí:
+  la interpolación entre puntos guardados queda a menos del umbral de cada
+  muestra. Sirve para rampas lentas, que la banda muerta guardaría enteras.
+
+Los puntos que corresponden a la muestra anterior van en la línea actual
+bajo la clave '_anterior', con su timestamp, porque esa línea ya está
+escrita. Cada canal se guarda al menos cada MAX_SIN_GUARDAR segundos y la
+primera y la última línea de cada segmento van completas, así que cada
+segmento se reconstruye sin leer los vecinos. Las muestras posteriores al
+último punto guardado de un canal (las más recientes) repiten ese valor hasta
+que se guarda el siguiente.
+
+Un histórico sin compresión tiene todas las líneas completas y se lee igual
+que siempre: la compresión se puede activar o desactivar sin migrar nada.
+"""
+
+import math
+
+import numpy as np
+
+import anillo
+
+BANDA = 'banda'
+PUERTA = 'puerta'
+METODOS = (BANDA, PUERTA)
+
+# Clave de la línea con los puntos guardados en la muestra anterior
+CLAVE_ANTERIOR = '_anterior'
+
+# Segundos máximos sin guardar un canal: acotan cuánto se aparta la cola que
+# repite el último valor y cuánto hay que leer para reconstruir una muestra
+MAX_SIN_GUARDAR = 600
+
+# Decimales de los puntos calculados sobre la recta de la puerta giratoria
+DECIMALES = 6
+
+
+# ===== CONFIGURACIÓN =====
+def validar(umbrales):
+    """
+    Revisa la configuración {canal: (método, umbral)} y lanza ValueError si
+    tiene un método desconocido o un umbral negativo.
+    """
+    for canal, (metodo, umbral) in (umbrales or {}).items():
+        if metodo not in METODOS:
+            raise ValueError(f"Método de compresión desconocido para {canal}: {metodo!r}")
+        if umbral < 0:
+            raise ValueError(f"El umbral de compresión de {canal} no puede ser negativo")
+
+
+# ===== ESCRITURA =====
+def _es_numero(valor):
+    return isinstance(valor, (int, float)) and not isinstance(valor, bool) and math.isfinite(valor)
+
+
+def nuevo_estado():
+    """
+    Estado de compresión de un sensor: el de cada canal y la última muestra.
+    """
+    return {'canales': {}, 'segundos': None, 'timestamp': None, 'cola': {}}
+
+
+def reanudar(lineas):
+    """
+    Estado para seguir comprimiendo un segmento que ya tiene `lineas` (por
+    ejemplo, después de reiniciar el recolector). La primera línea nueva va
+    completa y guarda en '_anterior' el valor que repetía la cola de cada
+    canal, así la reconstrucción de esas muestras no cambia.
+    """
+    estado = nuevo_estado()
+    if not lineas:
+        return estado
+    registros, _ = reconstruir(lineas)
+    ultima = lineas[-1]
+    estado['segundos'] = anillo.a_epoch(ultima['timestamp'])
+    estado['timestamp'] = ultima['timestamp']
+    estado['cola'] = {
+        canal: valor for canal, valor in registros[-1].items()
+        if canal != 'timestamp' and canal not in ultima
+    }
+    return estado
+
+
+def _banda(canal, segundos, valor, umbral, forzar):
+    """
+    Devuelve (valor a guardar en la muestra anterior o None, valor a guardar
+    en esta muestra o None).
+    """
+    if abs(valor - canal['valor']) <= umbral:
+        if not forzar:
+            canal['pendiente'] = True
+            return None, None
+        # Se guarda el valor sostenido, que está a menos del umbral de la muestra
+        canal.update(segundos=segundos, pendiente=False)
+        return None, canal['valor']
+    anterior = canal['valor'] if canal['pendiente'] else None
+    canal.update(segundos=segundos, valor=valor, pendiente=False)
+    return anterior, valor
+
+
+def _puerta(canal, segundos, valor, umbral, forzar):
+    """
+    Como _banda, con la puerta giratoria. El punto guardado en la muestra
+    anterior está sobre una recta que pasa a menos del umbral de todas las
+    muestras desde el último punto guardado.
+    """
+    anterior = None
+    paso = segundos - canal['segundos']
+    maxima = min(canal['maxima'], (valor + umbral - canal['valor']) / paso)
+    minima = max(canal['minima'], (valor - umbral - canal['valor']) / paso)
+    if minima > maxima:
+        # La puerta se cerró: se guarda la muestra anterior y se sigue desde ahí
+        pendiente = (canal['minima'] + canal['maxima']) / 2
+        anterior = round(canal['valor'] + pendiente * (canal['previa'] - canal['segundos']), DECIMALES)
+        canal.update(segundos=canal['previa'], valor=anterior)
+        paso = segundos - canal['segundos']
+        maxima = (valor + umbral - anterior) / paso
+        minima = (valor - umbral - anterior) / paso
+
+    if not forzar:
+        canal.update(maxima=maxima, minima=minima, previa=segundos)
+        return anterior, None
+    # Punto de la recta en esta muestra (a menos del umbral de su valor)
+    actual = round(canal['valor'] + (minima + maxima) / 2 * paso, DECIMALES)
+    canal.update(segundos=segundos, valor=actual, maxima=math.inf, minima=-math.inf, previa=segundos)
+    return anterior, actual
+
+
+def comprimir(estado, registro, umbrales, completa=False):
+    """
+    Línea a escribir para `registro` con los umbrales {canal: (método,
+    umbral)}: el timestamp, los canales que hay que guardar y, si hace falta,
+    los puntos de la muestra anterior en '_anterior'. Con `completa` (o si la
+    muestra no va después de la anterior) se guardan todos los canales.
+    Actualiza `estado` (ver nuevo_estado y reanudar).
+    """
+    segundos = anillo.a_epoch(registro['timestamp'])
+    completa = completa or estado['segundos'] is None or segundos <= estado['segundos']
+
+    linea = {'timestamp': registro['timestamp']}
+    anteriores = {} if estado['segundos'] is None or segundos <= estado['segundos'] else dict(estado['cola'])
+    for nombre, valor in registro.items():
+        if nombre == 'timestamp':
+            continue
+        configuracion = umbrales.get(nombre)
+        canal = estado['canales'].get(nombre)
+        if configuracion is None or not _es_numero(valor) or canal is None or segundos <= canal['segundos']:
+            # Sin compresión, valor no numérico o primera muestra del canal
+            linea[nombre] = valor
+            estado['canales'][nombre] = {
+                'segundos': segundos, 'valor': valor, 'pendiente': False,
+                'maxima': math.inf, 'minima': -math.inf, 'previa': segundos
+            } if configuracion is not None and _es_numero(valor) else None
+            continue
+
+        metodo, umbral = configuracion
+        forzar = completa or segundos - canal['segundos'] >= MAX_SIN_GUARDAR
+        anterior, actual = (_banda if metodo == BANDA else _puerta)(canal, segundos, valor, umbral, forzar)
+        if anterior is not None:
+            anteriores[nombre] = anterior
+        if actual is not None:
+            linea[nombre] = actual
+
+    if anteriores:
+        linea[CLAVE_ANTERIOR] = {'timestamp': estado['timestamp'], **anteriores}
+    estado.update(segundos=segundos, timestamp=registro['timestamp'], cola={})
+    return linea
+
+
+# ===== LECTURA =====
+def canales_de(lineas):
+    """
+    Canales que aparecen en las líneas, en orden de aparición.
+    """
+    canales = {}
+    for linea in lineas:
+        for nombre in linea:
+            if nombre != 'timestamp' and nombre != CLAVE_ANTERIOR:
+                canales[nombre] = None
+    return list(canales)
+
+
+def incompleto(lineas, canales=()):
+    """
+    True si alguna línea está comprimida: le falta alguno de `canales` o de
+    los que aparecen en las demás líneas, o trae puntos de la muestra anterior.
+    """
+    largo = max(len(canales) + 1, max(map(len, lineas), default=0))
+    return any(len(linea) < largo or CLAVE_ANTERIOR in linea for linea in lineas)
+
+
+def reconstruir(lineas, previos=None, canales=()):
+    """
+    Registros completos a partir de las líneas de un histórico (comprimido o
+    no), en orden. `previos` ({canal: [segundos, valor]}) son los últimos
+    puntos guardados antes de las líneas, como los devuelve esta función
+    junto con los registros; `canales` agrega canales que se sabe que tiene
+    el histórico aunque no aparezcan en las líneas.
+    """
+    previos = previos or {}
+    if not lineas:
+        return [], dict(previos)
+    ultimo = anillo.a_epoch(lineas[-1]['timestamp'])
+    if not previos and not incompleto(lineas, canales):
+        return lineas, {canal: [ultimo, valor] for canal, valor in lineas[-1].items() if canal != 'timestamp'}
+    todos = list(dict.fromkeys([*previos, *canales, *canales_de(lineas)]))
+
+    # Solo se interpolan los canales que faltan en alguna línea
+    faltantes = [canal for canal in todos if any(canal not in linea for linea in lineas)]
+    puntos = {canal: ([], []) for canal in faltantes}
+    for canal in faltantes:
+        if canal in previos:
+            puntos[canal][0].append(previos[canal][0])
+            puntos[canal][1].append(previos[canal][1])
+
+    tiempos = np.empty(len(lineas))
+    for i, linea in enumerate(lineas):
+        tiempos[i] = anillo.a_epoch(linea['timestamp'])
+        anterior = linea.get(CLAVE_ANTERIOR)
+        if anterior:
+            segundos_anterior = anillo.a_epoch(anterior['timestamp'])
+            for canal, valor in anterior.items():
+                if canal in puntos:
+                    puntos[canal][0].append(segundos_anterior)
+                    puntos[canal][1].append(valor)
+        for canal, (xs, ys) in puntos.items():
+            if canal in linea:
+                xs.append(tiempos[i])
+                ys.append(linea[canal])
+
+    # Interpolación lineal entre puntos guardados; después del último se
+    # repite su valor y antes del primero no hay dato. Los valores guardados
+    # en cada línea se conservan tal cual
+    columnas = {}
+    ultimos = {}
+    for canal in todos:
+        if canal not in puntos:
+            columnas[canal] = [linea[canal] for linea in lineas]
+            ultimos[canal] = [ultimo, lineas[-1][canal]]
+            continue
+        xs, ys = puntos[canal]
+        if not xs:
+            continue
+        try:
+            valores = np.array(ys, dtype=np.float64)
+        except (TypeError, ValueError):
+            valores = np.array([y if _es_numero(y) else np.nan for y in ys], dtype=np.float64)
+        columna = [None if math.isnan(v) else v for v in np.interp(tiempos, xs, valores, left=np.nan).tolist()]
+        for i, linea in enumerate(lineas):
+            if canal in linea:
+                columna[i] = linea[canal]
+        columnas[canal] = columna
+        ultimos[canal] = [float(xs[-1]), ys[-1]]
+
+    nombres = ('timestamp', *columnas)
+    filas = zip([linea['timestamp'] for linea in lineas], *columnas.values())
+    return [dict(zip(nombres, fila)) for fila in filas], ultimos
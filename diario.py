@@ -0,0 +1,273 @@
+"""
+Diario de escritura anticipada (write-ahead) y escrituras agrupadas del
+recolector.
+
+Con el diario activo, cada muestra se anexa como una línea JSON a un archivo
+secuencial (historico/diario/<proceso>/<n>.jsonl) y queda en memoria; los
+almacenes principales (datos/ y el histórico) se escriben en tandas, cuando
+hay MAX_PENDIENTES entradas o la más vieja lleva MAX_ESPERA segundos. Así
+cada ciclo hace una escritura secuencial pequeña en lugar de reescribir un
+archivo por sensor.
+
+Con FSYNC = 'siempre' cada anotación espera a que el diario esté en disco;
+las de varios hilos que llegan juntas comparten un mismo fsync (group
+commit). Antes de borrar un diario ya vaciado se sincronizan los almacenes
+principales. Con 'nunca' el sistema operativo decide cuándo escribir.
+
+Al arrancar, iniciar() vuelve a aplicar lo que quedó en los diarios de una
+ejecución anterior (por ejemplo, tras un corte de luz) antes de aceptar
+muestras nuevas. La función que vacía las entradas debe tolerar entradas que
+ya estaban escritas (las de un diario recuperado o una tanda que se
+reintenta después de fallar a medias).
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+CARPETA = 'diario'
+EXTENSION = '.jsonl'
+
+# Entradas en memoria que disparan el vaciado y antigüedad máxima (segundos)
+# de la entrada más vieja
+MAX_PENDIENTES = 512
+MAX_ESPERA = 60
+
+# 'siempre': cada anotación espera su fsync (compartido entre los hilos que
+# anotan a la vez); 'nunca': sin fsync
+FSYNC = 'siempre'
+
+_estado = {
+    'carpeta': None,
+    'vaciar': None,
+    'archivo': None,
+    'numero': 0,
+    'escritos': 0,
+    'sincronizados': 0,
+    'pendientes': [],
+    'vaciando': [],
+    'primera': None,
+    'vaciados': [],
+    'hilo': None
+}
+_configuracion = {'max_pendientes': MAX_PENDIENTES, 'max_espera': MAX_ESPERA, 'fsync': FSYNC}
+_lock_diario = threading.Lock()
+_lock_fsync = threading.Lock()
+_lock_vaciado = threading.Lock()
+_aviso = threading.Condition(_lock_diario)
+
+log = logging.getLogger('diario')
+
+
+# ===== ARCHIVOS =====
+def _ruta(carpeta, numero):
+    return os.path.join(carpeta, f"{numero:08d}{EXTENSION}")
+
+
+def _listar(carpeta):
+    """
+    Números de los diarios de la carpeta, en orden.
+    """
+    try:
+        nombres = os.listdir(carpeta)
+    except FileNotFoundError:
+        return []
+    numeros = (nombre[:-len(EXTENSION)] for nombre in nombres if nombre.endswith(EXTENSION))
+    return sorted(int(numero) for numero in numeros if numero.isdigit())
+
+
+def leer(ruta):
+    """
+    Entradas de un diario. Una última línea incompleta (el proceso terminó a
+    mitad de la escritura) se ignora.
+    """
+    entradas = []
+    with open(ruta, 'r', encoding='utf-8') as f:
+        for linea in f:
+            if not linea.endswith('\n'):
+                break
+            try:
+                entradas.append(json.loads(linea))
+            except ValueError:
+                break
+    return entradas
+
+
+def _sincronizar_almacenes():
+    if _configuracion['fsync'] != 'nunca' and hasattr(os, 'sync'):
+        os.sync()
+
+
+def _abrir_siguiente():
+    _estado['numero'] += 1
+    _estado['archivo'] = open(_ruta(_estado['carpeta'], _estado['numero']), 'a', encoding='utf-8')
+
+
+# ===== CICLO DE VIDA =====
+def activo():
+    return _estado['archivo'] is not None
+
+
+def iniciar(carpeta, vaciar, max_pendientes=MAX_PENDIENTES, max_espera=MAX_ESPERA, fsync=FSYNC):
+    """
+    Activa el diario en `carpeta`. `vaciar(entradas)` escribe una lista de
+    entradas en los almacenes principales. Primero se aplican las entradas
+    de los diarios que dejó una ejecución anterior y se borran esos diarios.
+    Devuelve cuántas entradas se recuperaron.
+    """
+    if fsync not in ('siempre', 'nunca'):
+        raise ValueError(f"fsync debe ser 'siempre' o 'nunca', no {fsync!r}")
+    os.makedirs(carpeta, exist_ok=True)
+    _configuracion.update(max_pendientes=max_pendientes, max_espera=max_espera, fsync=fsync)
+
+    numeros = _listar(carpeta)
+    recuperadas = []
+    for numero in numeros:
+        recuperadas.extend(leer(_ruta(carpeta, numero)))
+    if recuperadas:
+        vaciar(recuperadas)
+        _sincronizar_almacenes()
+    for numero in numeros:
+        os.remove(_ruta(carpeta, numero))
+
+    with _lock_diario:
+        _estado.update(carpeta=carpeta, vaciar=vaciar, numero=numeros[-1] if numeros else 0,
+                       pendientes=[], primera=None, vaciados=[])
+        _abrir_siguiente()
+    _estado['hilo'] = threading.Thread(target=_bucle_vaciado, name='diario', daemon=True)
+    _estado['hilo'].start()
+    return len(recuperadas)
+
+
+def detener():
+    """
+    Vacía lo pendiente y cierra el diario (que queda vacío y se borra).
+    """
+    if not activo():
+        return
+    vaciar()
+    with _lock_fsync, _lock_diario:
+        archivo = _estado['archivo']
+        _estado['archivo'] = None
+        _aviso.notify_all()
+    archivo.close()
+    if not _estado['pendientes']:
+        os.remove(archivo.name)
+
+
+# ===== ANOTACIÓN =====
+def anotar(entradas):
+    """
+    Anexa entradas (diccionarios serializables en JSON) al diario y las deja
+    pendientes de vaciar. Con FSYNC = 'siempre' vuelve cuando están en disco.
+    """
+    if not entradas:
+        return
+    texto = ''.join(json.dumps(e, ensure_ascii=False, separators=(',', ':')) + '\n' for e in entradas)
+    with _lock_diario:
+        _estado['archivo'].write(texto)
+        _estado['archivo'].flush()
+        _estado['escritos'] += len(texto)
+        hasta = _estado['escritos']
+        if _estado['primera'] is None:
+            _estado['primera'] = time.monotonic()
+        _estado['pendientes'].extend(entradas)
+        if len(_estado['pendientes']) >= _configuracion['max_pendientes']:
+            _aviso.notify_all()
+
+    if _configuracion['fsync'] == 'siempre':
+        _sincronizar(hasta)
+
+
+def _sincronizar(hasta):
+    """
+    Group commit: un solo fsync cubre todo lo escrito hasta ese momento, así
+    que los hilos que esperaban detrás encuentran su parte ya sincronizada.
+    """
+    with _lock_fsync:
+        if _estado['sincronizados'] >= hasta or _estado['archivo'] is None:
+            return
+        with _lock_diario:
+            objetivo = _estado['escritos']
+            descriptor = _estado['archivo'].fileno()
+        os.fsync(descriptor)
+        _estado['sincronizados'] = objetivo
+
+
+# ===== VACIADO =====
+def vaciar():
+    """
+    Escribe las entradas pendientes en los almacenes principales. Las nuevas
+    anotaciones van a un diario nuevo mientras tanto; el anterior se borra
+    cuando las entradas quedaron escritas (y sincronizadas). Si la escritura
+    falla, las entradas vuelven a quedar pendientes y el diario se conserva.
+    """
+    with _lock_vaciado:
+        with _lock_fsync, _lock_diario:
+            entradas = _estado['pendientes']
+            if not entradas:
+                return 0
+            anterior = _estado['archivo']
+            if _configuracion['fsync'] == 'siempre':
+                os.fsync(anterior.fileno())
+            anterior.close()
+            _estado['vaciados'].append(anterior.name)
+            _estado['sincronizados'] = _estado['escritos']
+            _estado['vaciando'] = entradas
+            _estado['pendientes'] = []
+            _estado['primera'] = None
+            _abrir_siguiente()
+
+        try:
+            _estado['vaciar'](entradas)
+            _sincronizar_almacenes()
+        except Exception:
+            with _lock_diario:
+                _estado['pendientes'][:0] = entradas
+                _estado['vaciando'] = []
+                _estado['primera'] = time.monotonic()
+            raise
+        with _lock_diario:
+            _estado['vaciando'] = []
+
+        for ruta in _estado['vaciados']:
+            os.remove(ruta)
+        _estado['vaciados'] = []
+        return len(entradas)
+
+
+def pendientes():
+    with _lock_diario:
+        return len(_estado['pendientes'])
+
+
+def entradas_pendientes():
+    """
+    Copia de las entradas que todavía no están en los almacenes principales
+    (las pendientes y las que se están vaciando), en orden de anotación.
+    """
+    with _lock_diario:
+        return _estado['vaciando'] + _estado['pendientes']
+
+
+def _bucle_vaciado():
+    while True:
+        with _lock_diario:
+            while _estado['archivo'] is not None:
+                primera = _estado['primera']
+                if len(_estado['pendientes']) >= _configuracion['max_pendientes']:
+                    break
+                if primera is not None and time.monotonic() - primera >= _configuracion['max_espera']:
+                    break
+                espera = _configuracion['max_espera'] if primera is None else \
+                    _configuracion['max_espera'] - (time.monotonic() - primera)
+                _aviso.wait(espera)
+            if _estado['archivo'] is None:
+                return
+        try:
+            vaciar()
+        except Exception as e:
+            log.error("❌ Error vaciando el diario (las entradas siguen pendientes): %s", e)
+            time.sleep(_configuracion['max_espera'])
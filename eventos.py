@@ -0,0 +1,171 @@
+"""
+Canal local de eventos entre el recolector y el dashboard (Server-Sent Events).
+
+El recolector publica las muestras nuevas de cada ciclo con publicar() y las
+sirve en un endpoint HTTP mínimo:
+
+    GET http://<host>:<puerto>/eventos
+
+Cada suscriptor recibe un evento SSE por publicación ('data:' con el JSON y
+'id:' con un número de secuencia) y un comentario cada INTERVALO_LATIDO
+segundos para que las conexiones muertas se detecten de los dos lados. Un
+suscriptor que no lee a tiempo pierde eventos (su cola es acotada) en lugar
+de frenar al recolector; al reconectarse debe ponerse al día con el disco.
+Lo que el recolector todavía no escribió en disco (por ejemplo, muestras en
+un diario pendiente de vaciar) se lo entrega al_suscribir: sus eventos van a
+la cola del suscriptor antes que cualquier publicación posterior.
+"""
+
+import json
+import queue
+import threading
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Segundos entre latidos de una conexión sin eventos
+INTERVALO_LATIDO = 15
+
+# Eventos pendientes por suscriptor antes de descartar los nuevos
+MAX_PENDIENTES = 256
+
+_suscriptores = set()
+_lock_suscriptores = threading.Lock()
+_secuencia = 0
+
+
+# ===== PUBLICACIÓN =====
+def formatear(datos, id_evento=None):
+    """
+    Evento SSE (bytes) con `datos` serializado en JSON.
+    """
+    texto = f"id: {id_evento}\n" if id_evento is not None else ''
+    texto += f"data: {json.dumps(datos, ensure_ascii=False, separators=(',', ':'))}\n\n"
+    return texto.encode('utf-8')
+
+
+def publicar(datos):
+    """
+    Envía `datos` a todos los suscriptores conectados. No bloquea.
+    """
+    global _secuencia
+    with _lock_suscriptores:
+        if not _suscriptores:
+            return
+        _secuencia += 1
+        evento = formatear(datos, _secuencia)
+        for cola in _suscriptores:
+            try:
+                cola.put_nowait(evento)
+            except queue.Full:
+                pass
+
+
+def hay_suscriptores():
+    with _lock_suscriptores:
+        return bool(_suscriptores)
+
+
+class _ManejadorEventos(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/eventos':
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        # El suscriptor queda registrado antes de enviar la cabecera: cuando
+        # el cliente se pone al día con el disco (al recibirla), lo que todavía
+        # no está escrito ya está en su cola
+        cola = queue.Queue(MAX_PENDIENTES)
+        al_suscribir = self.server.al_suscribir
+        with _lock_suscriptores:
+            # Bajo el mismo lock que publicar(): ninguna publicación se cuela
+            # entre lo que se repite y lo que llega después
+            for datos in (al_suscribir() if al_suscribir else ()):
+                try:
+                    cola.put_nowait(formatear(datos))
+                except queue.Full:
+                    break
+            _suscriptores.add(cola)
+        try:
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+            self.wfile.write(b': conectado\n\n')
+            self.wfile.flush()
+            while True:
+                try:
+                    evento = cola.get(timeout=INTERVALO_LATIDO)
+                except queue.Empty:
+                    evento = b': latido\n\n'
+                self.wfile.write(evento)
+                self.wfile.flush()
+        except OSError:
+            # El suscriptor cerró la conexión
+            pass
+        finally:
+            with _lock_suscriptores:
+                _suscriptores.discard(cola)
+
+    def log_message(self, *args):
+        pass
+
+
+def iniciar_servidor(puerto, host='127.0.0.1', al_suscribir=None):
+    """
+    Sirve /eventos en un hilo en segundo plano. Devuelve el servidor.
+    al_suscribir() devuelve los datos de los eventos que recibe primero cada
+    suscriptor nuevo (lo publicado que todavía no se puede leer del disco).
+    """
+    servidor = ThreadingHTTPServer((host, puerto), _ManejadorEventos)
+    servidor.daemon_threads = True
+    servidor.al_suscribir = al_suscribir
+    threading.Thread(target=servidor.serve_forever, name='eventos', daemon=True).start()
+    return servidor
+
+
+# ===== SUSCRIPCIÓN =====
+def leer_eventos(respuesta):
+    """
+    Itera los datos (ya decodificados de JSON) de los eventos de una
+    respuesta SSE abierta.
+    """
+    lineas = []
+    for crudo in respuesta:
+        linea = crudo.decode('utf-8').rstrip('\r\n')
+        if linea:
+            if linea.startswith('data:'):
+                lineas.append(linea[5:].lstrip(' '))
+            continue
+        if lineas:
+            yield json.loads('\n'.join(lineas))
+            lineas = []
+
+
+def suscribir(url, al_recibir, al_conectar=None, al_desconectar=None, espera_reconexion=5, detener=None):
+    """
+    Bucle de suscripción (bloqueante): llama a al_recibir(datos) por cada
+    evento y se reconecta tras espera_reconexion segundos si la conexión se
+    cae. al_conectar y al_desconectar permiten ponerse al día con el disco y
+    volver a leerlo mientras no hay canal.
+    """
+    detener = detener or threading.Event()
+    while not detener.is_set():
+        conectado = False
+        try:
+            with urllib.request.urlopen(url, timeout=INTERVALO_LATIDO * 3) as respuesta:
+                conectado = True
+                if al_conectar:
+                    al_conectar()
+                for datos in leer_eventos(respuesta):
+                    al_recibir(datos)
+                    if detener.is_set():
+                        break
+        except (OSError, ValueError):
+            pass
+        finally:
+            if conectado and al_desconectar:
+                al_desconectar()
+        detener.wait(espera_reconexion)
+
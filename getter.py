@@ -1,43 +1,101 @@
 """
 Servicio de Recolección de Datos Energéticos UPB
 Realiza GET requests al servidor y aplica PATCH en archivos JSON locales cada 30 segundos,
-además de almacenar históricos en JSON.
+además de almacenar históricos en segmentos JSON Lines (append-only).
 """
 
+import argparse
 import requests
 import json
 import time
 import os
-from datetime import datetime
+import hashlib
+import logging
+import multiprocessing
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 from pathlib import Path
+from urllib.parse import urlsplit
+from requests.adapters import HTTPAdapter
+
+import agregados
+import anomalias
+import anillo
+import compresion
+import diario
+import eventos
+import historico
+import instantanea
+import metricas
+import planificador
+import sensores
 
 # ===== CONFIGURACIÓN =====
 # URL base de tu servidor local para las solicitudes GET
 BASE_URL = "http://10.38.32.137:5555/data"
 
+# Registro de sensores (id, nombre, ubicación, intervalo y grupo de cada
+# medidor), compartido con app.py; ver sensores.py
+ARCHIVO_SENSORES = sensores.ARCHIVO_SENSORES
+REGISTRO_SENSORES = sensores.cargar_sensores(ARCHIVO_SENSORES)
+
 # Lista de IDs de sensores a monitorear
-SENSORES = [
-    'SM_B3_RECT',
-    'SM_B4_PRIM',
-    'SM_B10_ARQ',
-    'SM_B12_DERE',
-    'SM_B15_BIBL',
-    'SM_B17_POLI',
-    'SM_B18_PARQ',
-    'SM_B5_BACH',
-    'SM_B7_CTIC',
-    'SM_B7_TAC',
-    'SM_B8_AA',
-    'SM_B8_CPA',
-    'SM_B8_LABS',
-    'SM_B9_SFA1',
-    'SM_B9_SFA2',
-    'SM_ECOVILLA'
-]
-
-# Intervalo de actualización en segundos
+SENSORES = sensores.ids_sensores(REGISTRO_SENSORES)
+
+# Intervalo de actualización en segundos. Los ticks se alinean al reloj
+# (con 30 s: en los segundos :00 y :30) y no se corren con la duración de
+# cada consulta (ver planificador.py)
 INTERVALO_ACTUALIZACION = 30
 
+# Intervalos propios de algunos sensores, en segundos (campo 'intervalo' del
+# registro); el resto usa INTERVALO_ACTUALIZACION. Ejemplo: {'SM_ECOVILLA': 60}
+INTERVALOS_POR_SENSOR = sensores.intervalos_propios(REGISTRO_SENSORES)
+
+# Desfase máximo con que se despacha cada sensor dentro de su tick, en
+# segundos, para no consultar todos los medidores en el mismo instante. El
+# timestamp guardado sigue siendo el del tick.
+JITTER_MAX = 5.0
+
+# Un tick que no pudo despacharse antes de esta fracción del intervalo se
+# omite (no se acumulan consultas atrasadas)
+TOLERANCIA_RETRASO = 0.5
+
+# Medidores que fallan: retroceso exponencial (hasta BACKOFF_MAX segundos) y,
+# tras UMBRAL_CIRCUITO fallas seguidas, pausa de ESPERA_CIRCUITO segundos
+BACKOFF_MAX = 600
+UMBRAL_CIRCUITO = 5
+ESPERA_CIRCUITO = 300
+
+# Número máximo de solicitudes GET simultáneas (1 = recorrido secuencial)
+MAX_CONCURRENCIA = 16
+
+# Máximo de solicitudes por segundo hacia un mismo host (0 = sin límite)
+LIMITE_POR_HOST = 50
+
+# Timeout de conexión y de lectura de cada GET, en segundos
+TIMEOUT_GET = (3.05, 10)
+
+# Segundos que se espera al detener el servicio a que terminen los ticks en
+# curso (un GET puede tardar hasta su timeout)
+ESPERA_DETENCION = 2 * sum(TIMEOUT_GET)
+
+# Modo de adquisición: 'individual' (un GET por sensor a BASE_URL/<id>.json) o
+# 'lote' (varias entidades por solicitud con una consulta NGSI v2 a
+# URL_NGSI/entities). Si una consulta por lote falla, los sensores que no
+# llegaron se piden de forma individual.
+MODO_ADQUISICION = 'individual'
+URL_NGSI = "http://10.38.32.137:1026/v2"
+TIPO_ENTIDAD = 'SmartMeter'
+PREFIJO_ENTIDAD = 'SmartMeter_'
+
+# Entidades por consulta en modo 'lote'
+TAMANO_LOTE = 20
+
+# Atributos que se piden en modo 'lote': solo los que guarda actualizar_historico
+ATRIBUTOS_LOTE = anillo.CANALES
+
 # Carpetas de almacenamiento
 CARPETA_DATOS_ACTUALES = './datos'
 CARPETA_HISTORICO = './historico'
@@ -45,6 +103,79 @@ CARPETA_HISTORICO = './historico'
 # Cantidad máxima de registros históricos por sensor
 MAX_REGISTROS_HISTORICOS = 2880  # 24 horas a 30 segundos = 2880 registros
 
+# Formato del histórico: 'jsonl' (segmentos append-only), 'anillo' (buffer
+# circular binario mapeado en memoria, de tamaño MAX_REGISTROS_HISTORICOS) o
+# 'sqlite' (base en modo WAL compartida con el dashboard; las muestras de un
+# ciclo o de un lote se insertan en una sola transacción). Con
+# python historico.py <destino> se exporta a JSON Lines o JSON.
+FORMATO_HISTORICO = 'jsonl'
+
+# Lo que sale de la ventana de MAX_REGISTROS_HISTORICOS se guarda en segmentos
+# diarios comprimidos (historico/<id>/archivado/, ver archivado.py) en lugar
+# de descartarse; se consulta con historico.consultar_rango(con_archivo=True)
+ARCHIVAR_HISTORICO = True
+
+# Compresión con pérdida del histórico (solo con FORMATO_HISTORICO = 'jsonl',
+# ver compresion.py): por canal, ('banda', umbral) o ('puerta', umbral) en las
+# unidades del canal. Un valor se guarda solo cuando cambia más que el umbral
+# (o al menos cada compresion.MAX_SIN_GUARDAR segundos) y los lectores
+# reconstruyen el resto por interpolación. Vacío = se guarda cada muestra
+# completa. Por ejemplo:
+# {'Frequency': ('banda', 0.05), 'V1': ('puerta', 0.5), 'V2': ('puerta', 0.5), 'V3': ('puerta', 0.5)}
+COMPRESION_HISTORICO = {}
+
+# Detección de anomalías en la ingesta (valores atípicos, lecturas pegadas y
+# desbalance entre fases, ver anomalias.py); las banderas se publican en
+# historico/<id>/anomalias.json y en el canal de eventos
+DETECTAR_ANOMALIAS = True
+
+# Cada cuántos segundos se escribe la instantánea que carga el dashboard al
+# arrancar (ventana de cada sensor ya en columnas, en historico/instantanea/,
+# ver instantanea.py); 0 = no se escribe
+INTERVALO_INSTANTANEA = 600
+
+# Escritura diferida: cada muestra se anota en un diario secuencial
+# (historico/diario/, ver diario.py) y datos/ y el histórico se escriben en
+# tandas de hasta MAX_PENDIENTES_DIARIO entradas o cada MAX_ESPERA_DIARIO
+# segundos. FSYNC_DIARIO: 'siempre' (cada muestra espera a estar en disco; las
+# que llegan juntas comparten el fsync) o 'nunca'. Al arrancar se recupera lo
+# que quedó en el diario sin vaciar. False = se escribe cada muestra al llegar
+ESCRITURA_DIFERIDA = True
+MAX_PENDIENTES_DIARIO = 512
+MAX_ESPERA_DIARIO = 60
+FSYNC_DIARIO = 'siempre'
+
+# Registro: nivel ('DEBUG' muestra cada GET, PATCH y escritura del histórico;
+# 'INFO' solo avisos y estadísticas) y formato ('texto' o 'json')
+NIVEL_LOG = 'INFO'
+FORMATO_LOG = 'texto'
+
+# Puerto del endpoint de métricas en formato Prometheus (/metrics); 0 = desactivado.
+# Con varios fragmentos, el fragmento k usa PUERTO_METRICAS + k
+PUERTO_METRICAS = 9108
+
+# Puerto del canal de eventos (Server-Sent Events en /eventos, solo en
+# localhost): cada escritura del histórico se publica ahí para que el
+# dashboard la muestre sin revisar el disco; 0 = desactivado. Con varios
+# fragmentos, el fragmento k usa PUERTO_EVENTOS + k (URLS_EVENTOS en app.py
+# debe listar uno por fragmento). Los rangos de métricas y de eventos no deben
+# cruzarse: con FRAGMENTOS fragmentos se usan PUERTO_METRICAS .. + FRAGMENTOS - 1
+# y PUERTO_EVENTOS .. + FRAGMENTOS - 1
+PUERTO_EVENTOS = 9200
+
+# Procesos recolectores: el registro se reparte entre FRAGMENTOS procesos por
+# hashing consistente (ver sensores.py). Cada sensor pertenece a un solo
+# fragmento, que es el único que escribe sus archivos en datos/ e historico/.
+# También se puede indicar con: python getter.py --fragmentos N
+FRAGMENTOS = 1
+
+# Segundos de espera antes de relanzar un fragmento que terminó con error
+ESPERA_REINICIO_FRAGMENTO = 10
+
+# Código de salida de un fragmento que no puede arrancar por su configuración
+# (por ejemplo, un puerto ocupado): no se relanza, relanzarlo fallaría igual
+SALIDA_CONFIGURACION = 78
+
 # ===== CREAR CARPETAS SI NO EXISTEN =====
 Path(CARPETA_DATOS_ACTUALES).mkdir(parents=True, exist_ok=True)
 Path(CARPETA_HISTORICO).mkdir(parents=True, exist_ok=True)
@@ -57,14 +188,96 @@ estadisticas = {
     'get_fallidos': 0,
     'patch_exitosos': 0,
     'patch_fallidos': 0,
+    'get_no_modificados': 0,
+    'patch_omitidos': 0,
+    'lotes_exitosos': 0,
+    'lotes_fallidos': 0,
     'ultima_actualizacion': None
 }
+_lock_estadisticas = threading.Lock()
+
+log = logging.getLogger('getter')
+
+# ===== CONEXIONES HTTP =====
+# Sesión compartida por todos los hilos: reutiliza conexiones keep-alive
+# en lugar de abrir una conexión nueva por cada sensor.
+sesion_http = requests.Session()
+_adaptador = HTTPAdapter(pool_connections=4, pool_maxsize=MAX_CONCURRENCIA)
+sesion_http.mount('http://', _adaptador)
+sesion_http.mount('https://', _adaptador)
+
+# Próximo instante (time.monotonic) en que cada host acepta una solicitud
+_turnos_por_host = {}
+_lock_turnos = threading.Lock()
+
+def contar(clave, cantidad=1):
+    """
+    Incrementa un contador de estadísticas de forma segura entre hilos.
+    """
+    with _lock_estadisticas:
+        estadisticas[clave] += cantidad
+
+def esperar_turno_host(url):
+    """
+    Limita la tasa de solicitudes por host a LIMITE_POR_HOST por segundo.
+    Cada llamada reserva el siguiente turno libre del host y duerme hasta él.
+    """
+    if LIMITE_POR_HOST <= 0:
+        return
+
+    host = urlsplit(url).netloc
+    with _lock_turnos:
+        ahora = time.monotonic()
+        turno = max(ahora, _turnos_por_host.get(host, ahora))
+        _turnos_por_host[host] = turno + 1.0 / LIMITE_POR_HOST
+
+    espera = turno - ahora
+    if espera > 0:
+        time.sleep(espera)
+
+# ===== CACHÉS POR SENSOR =====
+# Validadores HTTP (ETag / Last-Modified) y último payload recibido de cada sensor
+_validadores_http = {}
+
+# Huella del último payload aplicado en datos/ y contenido publicado del archivo
+_ultimo_patch = {}
+
+def huella_payload(datos):
+    """
+    Huella de contenido de un payload, independiente del orden de las claves.
+    """
+    serializado = json.dumps(datos, sort_keys=True, ensure_ascii=False).encode('utf-8')
+    return hashlib.blake2b(serializado, digest_size=16).hexdigest()
+
+def escribir_json_atomico(ruta, datos, sincronizar=True):
+    """
+    Escribe un JSON en un archivo temporal de la misma carpeta y lo publica con
+    un rename atómico: un lector ve el archivo anterior o el nuevo, nunca uno
+    truncado. Sin `sincronizar` no se hace fsync (el diario sincroniza la
+    tanda completa).
+    """
+    carpeta = os.path.dirname(ruta) or '.'
+    fd, temporal = tempfile.mkstemp(dir=carpeta, prefix='.tmp_', suffix='.json')
+    try:
+        os.chmod(temporal, 0o644)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(datos, f, indent=2, ensure_ascii=False)
+            if sincronizar:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(temporal, ruta)
+    except BaseException:
+        if os.path.exists(temporal):
+            os.remove(temporal)
+        raise
 
 # ===== FUNCIONES PRINCIPALES =====
 
 def obtener_datos_sensor(sensor_id):
     """
     Realiza GET request a un sensor específico en el servidor.
+    Usa GET condicional (If-None-Match / If-Modified-Since): si el servidor
+    responde 304 se reutiliza el último payload sin transferir el cuerpo.
     """
     try:
         # Construir URL completa dinámicamente
@@ -75,162 +288,613 @@ def obtener_datos_sensor(sensor_id):
             'fiware-service': 'openiot',
             'fiware-servicepath': '/'
         }
+
+        validadores = _validadores_http.get(sensor_id)
+        if validadores:
+            if validadores['etag']:
+                headers['If-None-Match'] = validadores['etag']
+            if validadores['last_modified']:
+                headers['If-Modified-Since'] = validadores['last_modified']
         
-        response = requests.get(url, headers=headers, timeout=10)
+        esperar_turno_host(url)
+        with metricas.medir('getter_etapa_segundos', sensor=sensor_id, etapa='http'):
+            response = sesion_http.get(url, headers=headers, timeout=TIMEOUT_GET)
+
+        if response.status_code == 304 and validadores:
+            log.debug("♻️ GET %s: Sin cambios en el servidor (304)", sensor_id, extra={'sensor': sensor_id})
+            contar('get_exitosos')
+            contar('get_no_modificados')
+            metricas.incrementar('getter_get_total', sensor=sensor_id, resultado='no_modificado')
+            return validadores['datos']
         
         if response.status_code == 200:
-            datos = response.json()
-            print(f"✅ GET {sensor_id}: Datos obtenidos correctamente del servidor")
-            estadisticas['get_exitosos'] += 1
+            with metricas.medir('getter_etapa_segundos', sensor=sensor_id, etapa='json'):
+                datos = response.json()
+            etag = response.headers.get('ETag')
+            last_modified = response.headers.get('Last-Modified')
+            if etag or last_modified:
+                _validadores_http[sensor_id] = {'etag': etag, 'last_modified': last_modified, 'datos': datos}
+            log.debug("✅ GET %s: Datos obtenidos correctamente del servidor", sensor_id, extra={'sensor': sensor_id})
+            contar('get_exitosos')
+            metricas.incrementar('getter_get_total', sensor=sensor_id, resultado='ok')
             return datos
         else:
-            print(f"❌ GET {sensor_id}: Error {response.status_code} al obtener datos del servidor")
-            estadisticas['get_fallidos'] += 1
+            log.warning("❌ GET %s: Error %s al obtener datos del servidor", sensor_id, response.status_code,
+                        extra={'sensor': sensor_id, 'estado_http': response.status_code})
+            contar('get_fallidos')
+            metricas.incrementar('getter_get_total', sensor=sensor_id, resultado='error_http')
             return None
             
     except requests.exceptions.Timeout:
-        print(f"⏱️ GET {sensor_id}: Timeout al conectar con el servidor")
-        estadisticas['get_fallidos'] += 1
+        log.warning("⏱️ GET %s: Timeout al conectar con el servidor", sensor_id, extra={'sensor': sensor_id})
+        contar('get_fallidos')
+        metricas.incrementar('getter_get_total', sensor=sensor_id, resultado='timeout')
         return None
     except requests.exceptions.ConnectionError:
-        print(f"🔌 GET {sensor_id}: Error de conexión con el servidor")
-        estadisticas['get_fallidos'] += 1
+        log.warning("🔌 GET %s: Error de conexión con el servidor", sensor_id, extra={'sensor': sensor_id})
+        contar('get_fallidos')
+        metricas.incrementar('getter_get_total', sensor=sensor_id, resultado='conexion')
         return None
     except Exception as e:
-        print(f"💥 GET {sensor_id}: Error inesperado - {e}")
-        estadisticas['get_fallidos'] += 1
+        log.error("💥 GET %s: Error inesperado - %s", sensor_id, e, extra={'sensor': sensor_id})
+        contar('get_fallidos')
+        metricas.incrementar('getter_get_total', sensor=sensor_id, resultado='error')
         return None
 
+def obtener_datos_lote(sensores):
+    """
+    Obtiene varias entidades con una sola consulta NGSI v2
+    (GET URL_NGSI/entities?id=a,b,c&attrs=...), pidiendo solo ATRIBUTOS_LOTE.
+    Devuelve {sensor_id: datos} con las entidades recibidas, en el mismo
+    formato que obtener_datos_sensor; si la consulta falla devuelve {}.
+    """
+    entidades = {f"{PREFIJO_ENTIDAD}{sensor_id}": sensor_id for sensor_id in sensores}
+    url = f"{URL_NGSI}/entities"
+    params = {
+        'id': ','.join(entidades),
+        'type': TIPO_ENTIDAD,
+        'attrs': ','.join(ATRIBUTOS_LOTE),
+        'limit': len(entidades)
+    }
+    headers = {
+        'Accept': 'application/json',
+        'fiware-service': 'openiot',
+        'fiware-servicepath': '/'
+    }
+    contar('total_get_requests')
+
+    try:
+        esperar_turno_host(url)
+        with metricas.medir('getter_lote_segundos', etapa='http'):
+            response = sesion_http.get(url, params=params, headers=headers, timeout=TIMEOUT_GET)
+
+        if response.status_code != 200:
+            log.warning("❌ GET lote (%d entidades): Error %s al obtener datos del servidor",
+                        len(entidades), response.status_code, extra={'estado_http': response.status_code})
+            contar('get_fallidos')
+            contar('lotes_fallidos')
+            metricas.incrementar('getter_lote_total', resultado='error_http')
+            return {}
+
+        with metricas.medir('getter_lote_segundos', etapa='json'):
+            respuesta = response.json()
+        recibidos = {}
+        for entidad in respuesta:
+            sensor_id = entidades.get(entidad.get('id'))
+            if sensor_id:
+                recibidos[sensor_id] = entidad
+        log.debug("📦 GET lote: %d/%d entidades obtenidas en una solicitud", len(recibidos), len(entidades))
+        contar('get_exitosos')
+        contar('lotes_exitosos')
+        metricas.incrementar('getter_lote_total', resultado='ok')
+        metricas.incrementar('getter_lote_entidades_total', len(recibidos))
+        return recibidos
+
+    except requests.exceptions.Timeout:
+        log.warning("⏱️ GET lote (%d entidades): Timeout al conectar con el servidor", len(entidades))
+        metricas.incrementar('getter_lote_total', resultado='timeout')
+    except requests.exceptions.ConnectionError:
+        log.warning("🔌 GET lote (%d entidades): Error de conexión con el servidor", len(entidades))
+        metricas.incrementar('getter_lote_total', resultado='conexion')
+    except Exception as e:
+        log.error("💥 GET lote (%d entidades): Error inesperado - %s", len(entidades), e)
+        metricas.incrementar('getter_lote_total', resultado='error')
+    contar('get_fallidos')
+    contar('lotes_fallidos')
+    return {}
+
 def patch_archivo_local(sensor_id, nuevos_datos):
     """
     Simula la acción de PATCH modificando un archivo JSON local.
-    Lee el archivo, actualiza los datos y lo vuelve a escribir.
+    Si el payload es idéntico al último aplicado no se toca el disco; si hubo
+    cambios, el archivo se publica de forma atómica (temporal + rename).
     """
     id_corto = sensor_id.replace('SmartMeter_', '')
     ruta_archivo = os.path.join(CARPETA_DATOS_ACTUALES, f"{id_corto}.json")
 
     try:
-        # Leer el archivo actual si existe, si no, inicializar un diccionario vacío
-        if os.path.exists(ruta_archivo):
+        huella = huella_payload(nuevos_datos)
+        anterior = _ultimo_patch.get(id_corto)
+
+        if anterior and anterior['huella'] == huella:
+            log.debug("⏭️ PATCH Local %s: Sin cambios, archivo intacto", id_corto, extra={'sensor': id_corto})
+            contar('patch_omitidos')
+            metricas.incrementar('getter_patch_total', sensor=id_corto, resultado='omitido')
+            return True
+
+        # El contenido publicado se conserva en memoria; el archivo solo se lee
+        # la primera vez que se procesa el sensor
+        if anterior:
+            datos_existentes = anterior['datos']
+        elif os.path.exists(ruta_archivo):
             with open(ruta_archivo, 'r', encoding='utf-8') as f:
                 datos_existentes = json.load(f)
         else:
             datos_existentes = {}
 
         # Aplicar el "patch" actualizando los datos existentes con los nuevos
-        datos_existentes.update(nuevos_datos)
+        datos_actualizados = {**datos_existentes, **nuevos_datos}
+
+        if datos_actualizados == datos_existentes:
+            _ultimo_patch[id_corto] = {'huella': huella, 'datos': datos_actualizados}
+            log.debug("⏭️ PATCH Local %s: Sin cambios, archivo intacto", id_corto, extra={'sensor': id_corto})
+            contar('patch_omitidos')
+            metricas.incrementar('getter_patch_total', sensor=id_corto, resultado='omitido')
+            return True
 
-        # Escribir los datos actualizados de vuelta al archivo
-        with open(ruta_archivo, 'w', encoding='utf-8') as f:
-            json.dump(datos_existentes, f, indent=2, ensure_ascii=False)
+        # Escribir los datos actualizados de forma atómica (con el diario
+        # activo, el archivo se reescribe en la próxima tanda)
+        if diario.activo():
+            diario.anotar([{'tipo': 'datos', 'sensor': id_corto, 'datos': datos_actualizados}])
+        else:
+            escribir_json_atomico(ruta_archivo, datos_actualizados)
+        # Solo lo que quedó escrito (o anotado) cuenta como publicado: si la
+        # escritura falla, el próximo ciclo con el mismo payload la reintenta
+        _ultimo_patch[id_corto] = {'huella': huella, 'datos': datos_actualizados}
         
-        print(f"✅ PATCH Local {id_corto}: Archivo actualizado correctamente")
-        estadisticas['patch_exitosos'] += 1
+        log.debug("✅ PATCH Local %s: Archivo actualizado correctamente", id_corto, extra={'sensor': id_corto})
+        contar('patch_exitosos')
+        metricas.incrementar('getter_patch_total', sensor=id_corto, resultado='escrito')
         return True
     
     except Exception as e:
-        print(f"❌ PATCH Local {id_corto}: Error al modificar el archivo local - {e}")
-        estadisticas['patch_fallidos'] += 1
+        log.error("❌ PATCH Local %s: Error al modificar el archivo local - %s", id_corto, e, extra={'sensor': id_corto})
+        contar('patch_fallidos')
+        metricas.incrementar('getter_patch_total', sensor=id_corto, resultado='error')
         return False
 
-def actualizar_historico(sensor_id, datos):
+def registro_historico(datos, instante=None):
+    """
+    Registro del histórico con los canales de la entidad. `instante` es el
+    tick del planificador al que corresponde la muestra (por defecto, ahora).
+    """
+    return {
+        'timestamp': (instante or datetime.now()).isoformat(),
+        'ActivePower': datos.get('ActivePower', {}).get('value', 0),
+        'TotalPowerFactor': datos.get('TotalPowerFactor', {}).get('value', 0),
+        'RelativeTHDVoltage': datos.get('RelativeTHDVoltage', {}).get('value', 0),
+        'Frequency': datos.get('Frequency', {}).get('value', 60),
+        'V1': datos.get('V1', {}).get('value', 0),
+        'V2': datos.get('V2', {}).get('value', 0),
+        'V3': datos.get('V3', {}).get('value', 0),
+        'I1': datos.get('I1', {}).get('value', 0),
+        'I2': datos.get('I2', {}).get('value', 0),
+        'I3': datos.get('I3', {}).get('value', 0)
+    }
+
+# Timestamp (segundos, ver anillo.a_epoch) del último registro escrito en el
+# histórico de cada sensor, para no repetir registros al vaciar el diario
+_ultimo_guardado = {}
+
+def escribir_historico(registros):
+    """
+    Escribe en el histórico un registro por sensor ({id_corto: registro}) en
+    el formato FORMATO_HISTORICO (ver historico.py; con 'sqlite' todos van en
+    una sola transacción) y los suma a los agregados. Devuelve {id_corto:
+    registros en el histórico}; si el histórico falla, lanza la excepción.
+    """
+    totales = historico.anexar_registros(
+        CARPETA_HISTORICO, registros, MAX_REGISTROS_HISTORICOS, FORMATO_HISTORICO, ARCHIVAR_HISTORICO,
+        COMPRESION_HISTORICO
+    )
+    for id_corto, registro in registros.items():
+        _ultimo_guardado[id_corto] = anillo.a_epoch(registro['timestamp'])
+        try:
+            # Los agregados por minuto/15 min/hora/día se mantienen en la ingesta
+            agregados.acumular_registro(CARPETA_HISTORICO, id_corto, registro)
+        except Exception as e:
+            log.error("❌ Error actualizando agregados de %s: %s", id_corto, e, extra={'sensor': id_corto})
+    return totales
+
+def guardar_historico(registros):
     """
-    Actualiza el histórico del sensor agregando el nuevo registro.
+    Agrega al histórico un registro por sensor ({id_corto: registro}): con el
+    diario activo se anotan ahí y se escriben en la próxima tanda (ver
+    vaciar_diario), si no, en el momento (ver escribir_historico). La
+    detección de anomalías y el aviso al dashboard no esperan a la tanda.
     """
+    if not registros:
+        return
+    totales = None
     try:
-        id_corto = sensor_id.replace('SmartMeter_', '')
-        ruta_historico = os.path.join(CARPETA_HISTORICO, f"{id_corto}_historico.json")
-        
-        if os.path.exists(ruta_historico):
-            with open(ruta_historico, 'r', encoding='utf-8') as f:
-                historico = json.load(f)
+        if diario.activo():
+            diario.anotar([{'tipo': 'registro', 'sensor': s, 'registro': r} for s, r in registros.items()])
         else:
-            historico = {
-                'sensor_id': sensor_id,
-                'registros': []
-            }
-        
-        nuevo_registro = {
-            'timestamp': datetime.now().isoformat(),
-            'ActivePower': datos.get('ActivePower', {}).get('value', 0),
-            'TotalPowerFactor': datos.get('TotalPowerFactor', {}).get('value', 0),
-            'RelativeTHDVoltage': datos.get('RelativeTHDVoltage', {}).get('value', 0),
-            'Frequency': datos.get('Frequency', {}).get('value', 60),
-            'V1': datos.get('V1', {}).get('value', 0),
-            'V2': datos.get('V2', {}).get('value', 0),
-            'V3': datos.get('V3', {}).get('value', 0),
-            'I1': datos.get('I1', {}).get('value', 0),
-            'I2': datos.get('I2', {}).get('value', 0),
-            'I3': datos.get('I3', {}).get('value', 0)
-        }
-        
-        historico['registros'].append(nuevo_registro)
-        
-        if len(historico['registros']) > MAX_REGISTROS_HISTORICOS:
-            historico['registros'] = historico['registros'][-MAX_REGISTROS_HISTORICOS:]
-        
-        with open(ruta_historico, 'w', encoding='utf-8') as f:
-            json.dump(historico, f, indent=2, ensure_ascii=False)
-        
-        print(f"📈 {id_corto}: Histórico actualizado ({len(historico['registros'])} registros)")
-        
+            totales = escribir_historico(registros)
     except Exception as e:
-        print(f"❌ Error actualizando histórico de {sensor_id}: {e}")
+        for id_corto in registros:
+            log.error("❌ Error actualizando histórico de %s: %s", id_corto, e, extra={'sensor': id_corto})
+            metricas.incrementar('getter_historico_total', sensor=id_corto, resultado='error')
+        return
+    
+    banderas = {}
+    for id_corto, registro in registros.items():
+        try:
+            if DETECTAR_ANOMALIAS:
+                banderas[id_corto] = anomalias.observar(CARPETA_HISTORICO, id_corto, registro)
+                metricas.fijar('getter_anomalias_activas', len(banderas[id_corto]), sensor=id_corto)
+                for bandera in banderas[id_corto]:
+                    if bandera['desde'] == registro['timestamp']:
+                        log.warning("⚠️ %s: %s", id_corto, anomalias.describir(bandera), extra={'sensor': id_corto})
+            
+            if totales is not None:
+                log.debug("📈 %s: Histórico actualizado (%d registros)", id_corto, totales[id_corto], extra={'sensor': id_corto})
+            else:
+                log.debug("📝 %s: Registro anotado en el diario", id_corto, extra={'sensor': id_corto})
+            metricas.incrementar('getter_historico_total', sensor=id_corto, resultado='ok')
+            
+        except Exception as e:
+            log.error("❌ Error actualizando histórico de %s: %s", id_corto, e, extra={'sensor': id_corto})
+            metricas.incrementar('getter_historico_total', sensor=id_corto, resultado='error')
+    
+    # Aviso inmediato al dashboard (si está suscrito) con las muestras nuevas
+    # y las banderas de anomalías
+    if eventos.hay_suscriptores():
+        eventos.publicar({'registros': registros, 'anomalias': banderas})
 
-def procesar_todos_sensores():
+def eventos_pendientes():
     """
-    Procesa todos los sensores: obtiene datos del servidor, aplica el "patch" en archivos locales y actualiza históricos.
+    Eventos que recibe primero cada suscriptor nuevo del dashboard: los
+    registros anotados en el diario que todavía no están en el histórico
+    ({'registros': {id_corto: [registros en orden]}}). Sin ellos, un dashboard
+    que se conecta o se reconecta se pone al día con el disco y no ve las
+    muestras de la tanda pendiente, que ya se publicaron antes.
     """
-    print("\n" + "="*70)
-    print(f"🔄 Iniciando ciclo de actualización - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-    print("="*70)
+    registros = {}
+    for entrada in (diario.entradas_pendientes() if diario.activo() else ()):
+        if entrada['tipo'] == 'registro':
+            registros.setdefault(entrada['sensor'], []).append(entrada['registro'])
+    return [{'registros': registros}] if registros else []
+
+def _ultimo_en_historico(id_corto):
+    if id_corto not in _ultimo_guardado:
+        ultimos = historico.leer_registros(CARPETA_HISTORICO, id_corto, 1)
+        _ultimo_guardado[id_corto] = anillo.a_epoch(ultimos[-1]['timestamp']) if ultimos else None
+    return _ultimo_guardado[id_corto]
+
+def vaciar_diario(entradas):
+    """
+    Escribe una tanda de entradas del diario: el último contenido de cada
+    archivo de datos/ (una sola reescritura por sensor) y los registros del
+    histórico en orden, omitiendo los que el histórico ya tiene (los de un
+    diario recuperado o de una tanda que se reintenta).
+    """
+    contenidos = {}
+    colas = {}
+    for entrada in entradas:
+        if entrada['tipo'] == 'datos':
+            contenidos[entrada['sensor']] = entrada['datos']
+        else:
+            colas.setdefault(entrada['sensor'], []).append(entrada['registro'])
     
-    for sensor_id in SENSORES:
-        estadisticas['total_get_requests'] += 1
-        
-        # 1. Realizar GET para obtener los datos más recientes del servidor
+    for id_corto, contenido in contenidos.items():
+        escribir_json_atomico(os.path.join(CARPETA_DATOS_ACTUALES, f"{id_corto}.json"), contenido, sincronizar=False)
+    
+    for id_corto, cola in colas.items():
+        ultimo = _ultimo_en_historico(id_corto)
+        colas[id_corto] = [r for r in cola if ultimo is None or anillo.a_epoch(r['timestamp']) > ultimo]
+    # Como en un ciclo: primero el registro más viejo de cada sensor, juntos
+    for i in range(max(map(len, colas.values()), default=0)):
+        escribir_historico({id_corto: cola[i] for id_corto, cola in colas.items() if i < len(cola)})
+    
+    metricas.incrementar('getter_diario_tandas_total')
+    log.debug("💾 Diario vaciado: %d archivos de datos, %d registros",
+              len(contenidos), sum(map(len, colas.values())))
+
+def escribir_instantanea(bloques, nombre):
+    """
+    Pone al día las series de los sensores de este proceso (`bloques`, se
+    conserva entre llamadas) y escribe la instantánea del dashboard.
+    """
+    ids = [sensor_id.replace('SmartMeter_', '') for sensor_id in SENSORES]
+    instantanea.actualizar(CARPETA_HISTORICO, bloques, ids)
+    banderas = None
+    if DETECTAR_ANOMALIAS:
+        banderas = {id_corto: anomalias.leer_banderas(CARPETA_HISTORICO, id_corto) for id_corto in bloques}
+    instantanea.escribir(instantanea.ruta_instantanea(CARPETA_HISTORICO, nombre), bloques, banderas=banderas)
+
+def _bucle_instantanea(nombre):
+    bloques = {}
+    while True:
+        time.sleep(INTERVALO_INSTANTANEA)
+        inicio = time.perf_counter()
+        try:
+            escribir_instantanea(bloques, nombre)
+        except Exception as e:
+            log.error("❌ Error escribiendo la instantánea %s: %s", nombre, e)
+            continue
+        duracion = time.perf_counter() - inicio
+        metricas.fijar('getter_instantanea_segundos', duracion)
+        log.debug("📸 Instantánea %s: %d sensores en %.2f s", nombre, len(bloques), duracion)
+
+def actualizar_historico(sensor_id, datos, instante=None):
+    """
+    Actualiza el histórico del sensor agregando el nuevo registro (ver
+    registro_historico y guardar_historico).
+    """
+    id_corto = sensor_id.replace('SmartMeter_', '')
+    guardar_historico({id_corto: registro_historico(datos, instante)})
+
+def procesar_sensor(sensor_id, datos=None, instante=None, pendientes=None):
+    """
+    Ciclo completo de un sensor: GET, "patch" local y actualización del histórico.
+    Si ya se recibieron sus datos en una consulta por lote se omite el GET.
+    Con `pendientes` (un diccionario) el registro del histórico se deja ahí
+    para guardarlo junto con los de los demás sensores del ciclo.
+    Devuelve True si se obtuvieron datos.
+    """
+    # 1. Realizar GET para obtener los datos más recientes del servidor
+    if datos is None:
+        contar('total_get_requests')
         datos = obtener_datos_sensor(sensor_id)
-        
-        if datos:
-            # 2. Aplicar el "patch" a los archivos JSON locales con los datos obtenidos
+
+    if datos:
+        # 2. Aplicar el "patch" a los archivos JSON locales con los datos obtenidos
+        with metricas.medir('getter_etapa_segundos', sensor=sensor_id, etapa='patch'):
             patch_archivo_local(sensor_id, datos)
 
-            # 3. Actualizar el histórico con los nuevos datos
-            actualizar_historico(sensor_id, datos)
-        
-        time.sleep(0.5)
+        # 3. Actualizar el histórico con los nuevos datos
+        if pendientes is not None:
+            pendientes[sensor_id.replace('SmartMeter_', '')] = registro_historico(datos, instante)
+        else:
+            with metricas.medir('getter_etapa_segundos', sensor=sensor_id, etapa='historico'):
+                actualizar_historico(sensor_id, datos, instante)
+
+    return bool(datos)
+
+def procesar_lote(sensores, instante=None, pendientes=None):
+    """
+    Ciclo completo de un lote de sensores con una sola consulta NGSI; los
+    sensores que no llegaron en la respuesta hacen su GET individual. Los
+    registros del lote se guardan juntos en el histórico, o se dejan en
+    `pendientes` como en procesar_sensor.
+    Devuelve True si la consulta por lote tuvo éxito.
+    """
+    recibidos = obtener_datos_lote(sensores)
+    registros = {} if pendientes is None else pendientes
+    for sensor_id in sensores:
+        procesar_sensor(sensor_id, recibidos.get(sensor_id), instante, registros)
+    if pendientes is None:
+        with metricas.medir('getter_lote_segundos', etapa='historico'):
+            guardar_historico(registros)
+    return bool(recibidos)
+
+def procesar_todos_sensores():
+    """
+    Procesa todos los sensores: obtiene datos del servidor, aplica el "patch" en archivos locales y actualiza históricos.
+    """
+    log.info("🔄 Iniciando ciclo de actualización - %s", datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+    inicio_ciclo = time.perf_counter()
     
+    # Los sensores se consultan en paralelo con un número acotado de hilos;
+    # un medidor lento solo ocupa su propio hilo y no retrasa a los demás.
+    hilos = max(1, min(MAX_CONCURRENCIA, len(SENSORES)))
+    with ThreadPoolExecutor(max_workers=hilos, thread_name_prefix='sensor') as pool:
+        if MODO_ADQUISICION == 'lote':
+            # Una solicitud por lote; los sensores que no llegaron en su lote
+            # (consulta fallida o entidad ausente) hacen su GET individual
+            lotes = [SENSORES[i:i + TAMANO_LOTE] for i in range(0, len(SENSORES), TAMANO_LOTE)]
+            recibidos = {}
+            for parcial in pool.map(obtener_datos_lote, lotes):
+                recibidos.update(parcial)
+            datos = [recibidos.get(s) for s in SENSORES]
+        else:
+            datos = [None] * len(SENSORES)
+        # Los registros del histórico del ciclo se guardan juntos al final
+        pendientes = {}
+        list(pool.map(procesar_sensor, SENSORES, datos, [None] * len(SENSORES), [pendientes] * len(SENSORES)))
+    
+    with metricas.medir('getter_lote_segundos', etapa='historico'):
+        guardar_historico(pendientes)
+
+    duracion = time.perf_counter() - inicio_ciclo
+    metricas.observar('getter_ciclo_segundos', duracion)
+    if duracion > INTERVALO_ACTUALIZACION:
+        metricas.incrementar('getter_ciclos_excedidos_total')
+
     estadisticas['total_local_patches'] += len([s for s in SENSORES if s in SENSORES]) # Contar patches exitosos
     estadisticas['ultima_actualizacion'] = datetime.now().isoformat()
     
-    print("\n" + "-"*70)
-    print(f"📊 ESTADÍSTICAS:")
-    print(f"   Total GET requests: {estadisticas['total_get_requests']}")
-    print(f"   Total PATCH locales: {estadisticas['total_local_patches']}")
-    print(f"   GET Exitosos: {estadisticas['get_exitosos']}")
-    print(f"   GET Fallidos: {estadisticas['get_fallidos']}")
-    print(f"   PATCH Exitosos: {estadisticas['patch_exitosos']}")
-    print(f"   PATCH Fallidos: {estadisticas['patch_fallidos']}")
-    print(f"   Próxima actualización: {INTERVALO_ACTUALIZACION} segundos")
-    print("-"*70 + "\n")
+    mostrar_estadisticas()
+
+def mostrar_estadisticas(plan=None):
+    """
+    Registra (en nivel INFO) las estadísticas acumuladas y, si se indica, las
+    del planificador.
+    """
+    if not log.isEnabledFor(logging.INFO):
+        return
+    lineas = [
+        "📊 ESTADÍSTICAS:",
+        f"   Total GET requests: {estadisticas['total_get_requests']}",
+        f"   Total PATCH locales: {estadisticas['total_local_patches']}",
+        f"   GET Exitosos: {estadisticas['get_exitosos']}",
+        f"   GET Fallidos: {estadisticas['get_fallidos']}",
+        f"   PATCH Exitosos: {estadisticas['patch_exitosos']}",
+        f"   PATCH Fallidos: {estadisticas['patch_fallidos']}",
+        f"   GET sin cambios (304): {estadisticas['get_no_modificados']}",
+        f"   PATCH omitidos (sin cambios): {estadisticas['patch_omitidos']}"
+    ]
+    if MODO_ADQUISICION == 'lote':
+        lineas.append(f"   Lotes exitosos/fallidos: {estadisticas['lotes_exitosos']}/{estadisticas['lotes_fallidos']}")
+    if plan is not None:
+        resumen = planificador.resumen(plan)
+        lineas += [
+            f"   Ticks ejecutados: {resumen['ejecuciones']}",
+            f"   Ticks perdidos (atrasados o en curso): {resumen['perdidos']}",
+            f"   Ticks omitidos por retroceso: {resumen['omitidos']}",
+            f"   Circuitos abiertos: {resumen['circuitos_abiertos']}"
+        ]
+    lineas.append(f"   Próxima actualización: {INTERVALO_ACTUALIZACION} segundos")
+    log.info("\n".join(lineas))
+
+def unidades_planificadas():
+    """
+    Unidades del planificador con su intervalo: un sensor cada una en modo
+    'individual', o un lote de TAMANO_LOTE sensores en modo 'lote' (el lote
+    usa el menor intervalo de sus sensores). Devuelve (intervalos, lotes).
+    """
+    if MODO_ADQUISICION == 'lote':
+        lotes = {
+            f"lote_{i // TAMANO_LOTE + 1}": SENSORES[i:i + TAMANO_LOTE]
+            for i in range(0, len(SENSORES), TAMANO_LOTE)
+        }
+        intervalos = {
+            nombre: min(INTERVALOS_POR_SENSOR.get(s, INTERVALO_ACTUALIZACION) for s in sensores)
+            for nombre, sensores in lotes.items()
+        }
+        return intervalos, lotes
+
+    intervalos = {s: INTERVALOS_POR_SENSOR.get(s, INTERVALO_ACTUALIZACION) for s in SENSORES}
+    return intervalos, {}
 
-def ejecutar_servicio():
+def ejecutar_servicio(fragmento=None):
     """
-    Ejecuta el servicio de recolección de datos en loop infinito.
+    Ejecuta el servicio de recolección de datos en loop infinito. `fragmento`
+    es (k, total) cuando el proceso atiende solo una parte del registro.
     """
+    global PUERTO_METRICAS, PUERTO_EVENTOS
+    
+    campos = None
+    if fragmento is not None:
+        SENSORES[:] = [s['id'] for s in sensores.sensores_del_fragmento(REGISTRO_SENSORES, *fragmento)]
+        if PUERTO_METRICAS:
+            PUERTO_METRICAS += fragmento[0]
+        if PUERTO_EVENTOS:
+            PUERTO_EVENTOS += fragmento[0]
+        campos = {'fragmento': f"{fragmento[0]}/{fragmento[1]}"}
+    
+    metricas.configurar_registro(NIVEL_LOG, FORMATO_LOG, campos)
+    compresion.validar(COMPRESION_HISTORICO)
+    try:
+        if PUERTO_METRICAS:
+            metricas.iniciar_servidor(PUERTO_METRICAS)
+        if PUERTO_EVENTOS:
+            eventos.iniciar_servidor(PUERTO_EVENTOS, al_suscribir=eventos_pendientes)
+    except OSError as e:
+        log.critical("❌ No se pudo abrir el puerto de métricas (%s) o de eventos (%s): %s",
+                     PUERTO_METRICAS, PUERTO_EVENTOS, e)
+        raise SystemExit(SALIDA_CONFIGURACION)
+    nombre = f"fragmento_{fragmento[0]}" if fragmento is not None else 'recolector'
+    if ESCRITURA_DIFERIDA:
+        # Lo que quedó sin vaciar en una ejecución anterior se escribe antes
+        # de aceptar muestras nuevas
+        recuperadas = diario.iniciar(
+            os.path.join(CARPETA_HISTORICO, diario.CARPETA, nombre), vaciar_diario,
+            MAX_PENDIENTES_DIARIO, MAX_ESPERA_DIARIO, FSYNC_DIARIO
+        )
+        if recuperadas:
+            log.warning("♻️ %d entradas recuperadas del diario", recuperadas)
+    if INTERVALO_INSTANTANEA:
+        threading.Thread(target=_bucle_instantanea, args=(nombre,), name='instantanea', daemon=True).start()
+    
     print("🚀 Servicio de Recolección de Datos UPB")
+    if fragmento is not None:
+        print(f"🧩 Fragmento {fragmento[0]} de {fragmento[1]} (0 .. {fragmento[1] - 1})")
     print(f"📡 URL Base (GET): {BASE_URL}")
-    print(f"⏱️  Intervalo: {INTERVALO_ACTUALIZACION} segundos")
+    if MODO_ADQUISICION == 'lote':
+        print(f"📦 Adquisición por lotes: {URL_NGSI}/entities, {TAMANO_LOTE} entidades por solicitud")
+    print(f"⏱️  Intervalo: {INTERVALO_ACTUALIZACION} segundos, alineado al reloj (jitter hasta {JITTER_MAX} s)")
+    if INTERVALOS_POR_SENSOR:
+        print(f"⏱️  Intervalos propios: {INTERVALOS_POR_SENSOR}")
+    print(f"🧵 Concurrencia: {MAX_CONCURRENCIA} hilos, {LIMITE_POR_HOST or 'sin límite de'} req/s por host")
     print(f"📂 Directorio de datos: {CARPETA_DATOS_ACTUALES}")
     print(f"📚 Directorio de históricos: {CARPETA_HISTORICO}")
+    if COMPRESION_HISTORICO and FORMATO_HISTORICO == historico.FORMATO_JSONL:
+        print(f"🗜️  Compresión del histórico: {COMPRESION_HISTORICO}")
     print(f"🔢 Sensores monitoreados: {len(SENSORES)}")
+    if PUERTO_METRICAS:
+        print(f"📏 Métricas: http://localhost:{PUERTO_METRICAS}/metrics")
+    if PUERTO_EVENTOS:
+        print(f"📣 Eventos: http://localhost:{PUERTO_EVENTOS}/eventos")
+    if ESCRITURA_DIFERIDA:
+        print(f"💾 Escritura diferida: tandas de {MAX_PENDIENTES_DIARIO} entradas o cada {MAX_ESPERA_DIARIO} s, fsync del diario: {FSYNC_DIARIO}")
+    if INTERVALO_INSTANTANEA:
+        print(f"📸 Instantánea del dashboard cada {INTERVALO_INSTANTANEA} s en {instantanea.carpeta_instantaneas(CARPETA_HISTORICO)}")
+    print(f"📝 Registro: nivel {NIVEL_LOG}, formato {FORMATO_LOG}")
     print("\n⚠️  Presiona Ctrl+C para detener el servicio\n")
     
+    intervalos, lotes = unidades_planificadas()
+    # Registros del histórico de cada tick, de todas sus unidades: se guardan
+    # juntos (una sola escritura o transacción) cuando el tick se cierra
+    tandas = {}
+    lock_tandas = threading.Lock()
+    
+    def tarea(nombre, tick):
+        if plan['detener'].is_set():
+            # Tick que quedó en la cola del pool al detener: no se empieza
+            return False
+        # La muestra se registra con el instante nominal del tick
+        instante = datetime.fromtimestamp(tick)
+        with lock_tandas:
+            pendientes = tandas.setdefault(tick, {})
+        if nombre in lotes:
+            exito = procesar_lote(lotes[nombre], instante, pendientes)
+        else:
+            exito = procesar_sensor(nombre, instante=instante, pendientes=pendientes)
+        contar('total_local_patches', len(lotes.get(nombre, [nombre])))
+        estadisticas['ultima_actualizacion'] = datetime.now().isoformat()
+        return exito
+    
+    def cerrar_tick(tick):
+        with lock_tandas:
+            pendientes = tandas.pop(tick, None)
+        if pendientes:
+            with metricas.medir('getter_lote_segundos', etapa='historico'):
+                guardar_historico(pendientes)
+    
+    plan = planificador.crear_planificador(
+        tarea, intervalos,
+        max_hilos=max(1, min(MAX_CONCURRENCIA, len(intervalos))),
+        jitter_max=JITTER_MAX,
+        tolerancia=TOLERANCIA_RETRASO,
+        backoff_max=BACKOFF_MAX,
+        umbral_circuito=UMBRAL_CIRCUITO,
+        espera_circuito=ESPERA_CIRCUITO,
+        al_cerrar_tick=cerrar_tick
+    )
+    hilo = threading.Thread(target=planificador.ejecutar, args=(plan,), name='planificador', daemon=True)
+    hilo.start()
+    
     try:
         while True:
-            procesar_todos_sensores()
-            time.sleep(INTERVALO_ACTUALIZACION)
+            # Las estadísticas se imprimen una vez por intervalo, después de
+            # que se despacharon los ticks de ese intervalo
+            ahora = time.time()
+            time.sleep(planificador.tick_alineado(ahora, INTERVALO_ACTUALIZACION) + JITTER_MAX + 1 - ahora)
+            mostrar_estadisticas(plan)
     except KeyboardInterrupt:
+        planificador.detener(plan)
+        # Se espera a que terminen los ticks en curso; después se escribe lo
+        # recolectado en los ticks sin cerrar y lo pendiente en el diario
+        hilo.join(ESPERA_DETENCION)
+        if hilo.is_alive():
+            log.warning("⚠️ Quedan ticks en curso tras %s s; sus muestras no se guardan", ESPERA_DETENCION)
+        with lock_tandas:
+            abiertos = sorted(tandas)
+        for tick in abiertos:
+            cerrar_tick(tick)
+        diario.detener()
         print("\n\n🛑 Servicio detenido por el usuario")
         print(f"📊 Resumen final:")
         print(f"   Total de GET requests realizados: {estadisticas['total_get_requests']}")
@@ -239,31 +903,131 @@ def ejecutar_servicio():
         print(f"   GET requests fallidos: {estadisticas['get_fallidos']}")
         print(f"   PATCH locales exitosos: {estadisticas['patch_exitosos']}")
         print(f"   PATCH locales fallidos: {estadisticas['patch_fallidos']}")
+        print(f"   GET sin cambios (304): {estadisticas['get_no_modificados']}")
+        print(f"   PATCH locales omitidos: {estadisticas['patch_omitidos']}")
         print("\n✅ Servicio finalizado correctamente\n")
 
-def obtener_historico_sensor(sensor_id, ultimas_horas=24):
+def consultar_historico(sensor_ids, inicio, fin=None, canales=None, resolucion=None):
+    """
+    Consulta por rango de tiempo del histórico de varios sensores en una sola
+    llamada. inicio y fin pueden ser datetime o timestamps ISO (fin=None es
+    ahora). Devuelve {sensor_id: registros}.
+    
+    Para cada sensor se usan las muestras crudas si el histórico crudo cubre
+    todo el rango; si no, las filas agregadas del nivel más fino que lo
+    responde con pocas filas (ver agregados.py). Con resolucion (segundos por
+    fila, uno de agregados.NIVELES) se fuerza el nivel.
+    """
+    desde = historico.a_segundos(inicio)
+    hasta = historico.a_segundos(fin if fin is not None else datetime.now())
+    nivel = resolucion or agregados.elegir_nivel(hasta - desde)
+    
+    resultado = {}
+    crudos = {}
+    for sensor_id in sensor_ids:
+        id_corto = sensor_id.replace('SmartMeter_', '')
+        primero = historico.primer_timestamp(CARPETA_HISTORICO, id_corto)
+        cubre_rango = primero is not None and primero <= desde
+        
+        if resolucion is None and (cubre_rango or not agregados.existen_agregados(CARPETA_HISTORICO, id_corto, nivel)):
+            crudos[id_corto] = sensor_id
+        else:
+            resultado[sensor_id] = agregados.consultar_agregados(
+                CARPETA_HISTORICO, id_corto, nivel, desde, hasta, canales
+            )
+    
+    por_id_corto = historico.consultar_rango_sensores(CARPETA_HISTORICO, crudos, desde, hasta, canales)
+    for id_corto, registros in por_id_corto.items():
+        resultado[crudos[id_corto]] = registros
+    
+    return {sensor_id: resultado[sensor_id] for sensor_id in sensor_ids}
+
+def obtener_historico_sensor(sensor_id, ultimas_horas=24, resolucion=None):
     """
-    Lee el histórico de un sensor para usar en el dashboard.
+    Lee el histórico de un sensor para usar en el dashboard: todo lo
+    registrado en las últimas `ultimas_horas` horas (ver consultar_historico).
     """
     try:
-        ruta_historico = os.path.join(CARPETA_HISTORICO, f"{sensor_id.replace('SmartMeter_', '')}_historico.json")
+        id_corto = sensor_id.replace('SmartMeter_', '')
         
-        if not os.path.exists(ruta_historico):
-            print(f"⚠️ No existe histórico para {sensor_id}")
+        if not historico.existe_historico(CARPETA_HISTORICO, id_corto):
+            log.warning("⚠️ No existe histórico para %s", sensor_id, extra={'sensor': sensor_id})
             return []
         
-        with open(ruta_historico, 'r', encoding='utf-8') as f:
-            historico = json.load(f)
-        
-        registros = historico.get('registros', [])
-        registros_por_hora = int((ultimas_horas * 3600) / INTERVALO_ACTUALIZACION)
-        
-        # Retorna solo los últimos N registros, si hay suficientes
-        return registros[-registros_por_hora:]
+        inicio = datetime.now() - timedelta(hours=ultimas_horas)
+        return consultar_historico([sensor_id], inicio, resolucion=resolucion)[sensor_id]
         
     except Exception as e:
-        print(f"❌ Error leyendo histórico de {sensor_id}: {e}")
+        log.error("❌ Error leyendo histórico de %s: %s", sensor_id, e, extra={'sensor': sensor_id})
         return []
 
+def ejecutar_fragmentos(total):
+    """
+    Lanza un proceso recolector por fragmento y los relanza si terminan con
+    error. Ctrl+C llega a todos los procesos, que se detienen por su cuenta.
+    """
+    print(f"🧩 Recolección repartida en {total} procesos por hashing consistente")
+    asignacion = sensores.asignar_fragmentos(SENSORES, total)
+    for fragmento in range(total):
+        cantidad = sum(1 for k in asignacion.values() if k == fragmento)
+        print(f"   Fragmento {fragmento}: {cantidad} sensores")
+    
+    def lanzar(fragmento):
+        proceso = multiprocessing.Process(
+            target=ejecutar_servicio, args=((fragmento, total),), name=f"fragmento_{fragmento}"
+        )
+        proceso.start()
+        return proceso
+    
+    procesos = {fragmento: lanzar(fragmento) for fragmento in range(total)}
+    try:
+        while procesos:
+            time.sleep(1)
+            for fragmento, proceso in list(procesos.items()):
+                if proceso.is_alive():
+                    continue
+                if proceso.exitcode == 0:
+                    del procesos[fragmento]
+                    continue
+                if proceso.exitcode == SALIDA_CONFIGURACION:
+                    log.critical("💥 Fragmento %d no pudo arrancar por su configuración; se detienen todos",
+                                 fragmento)
+                    for otro in procesos.values():
+                        if otro.is_alive():
+                            otro.terminate()
+                            otro.join()
+                    raise SystemExit(SALIDA_CONFIGURACION)
+                log.error("💥 Fragmento %d terminó con código %s, se relanza en %s s",
+                          fragmento, proceso.exitcode, ESPERA_REINICIO_FRAGMENTO)
+                time.sleep(ESPERA_REINICIO_FRAGMENTO)
+                procesos[fragmento] = lanzar(fragmento)
+    except KeyboardInterrupt:
+        for proceso in procesos.values():
+            proceso.join(timeout=5)
+            if proceso.is_alive():
+                # La interrupción no le llegó (por ejemplo, solo se señaló a este proceso)
+                proceso.terminate()
+                proceso.join()
+
 if __name__ == '__main__':
-    ejecutar_servicio()
+    parser = argparse.ArgumentParser(description='Servicio de recolección de datos UPB')
+    parser.add_argument('--fragmentos', type=int, default=FRAGMENTOS,
+                        help='procesos recolectores entre los que se reparte el registro de sensores')
+    parser.add_argument('--fragmento', type=int, default=None,
+                        help='ejecuta solo este fragmento (0 .. fragmentos-1), por ejemplo en otra máquina')
+    args = parser.parse_args()
+    if args.fragmentos < 1:
+        parser.error('--fragmentos debe ser al menos 1')
+    if args.fragmento is not None and not 0 <= args.fragmento < args.fragmentos:
+        parser.error(f'--fragmento debe estar entre 0 y {args.fragmentos - 1}')
+    if (PUERTO_METRICAS and PUERTO_EVENTOS
+            and abs(PUERTO_EVENTOS - PUERTO_METRICAS) < args.fragmentos):
+        parser.error(f'con {args.fragmentos} fragmentos los puertos de métricas ({PUERTO_METRICAS}+k) '
+                     f'y de eventos ({PUERTO_EVENTOS}+k) se cruzan')
+    
+    if args.fragmento is not None:
+        ejecutar_servicio((args.fragmento, args.fragmentos))
+    elif args.fragmentos > 1:
+        ejecutar_fragmentos(args.fragmentos)
+    else:
+        ejecutar_servicio()
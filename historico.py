@@ -0,0 +1,876 @@
+"""
+Almacenamiento del histórico de sensores.
+
+Hay tres formatos: segmentos append-only en JSON Lines (por defecto), un
+buffer circular binario mapeado en memoria (ver anillo.py) y una base SQLite
+compartida por todos los sensores de la carpeta (ver basedatos.py). Los
+lectores detectan el formato de cada sensor: si el sensor está en la base
+SQLite se lee de ahí; si no, del anillo, y si no, de los segmentos. Con
+exportar() cualquier histórico se vuelca de nuevo a JSON Lines o al JSON
+antiguo. Con archivar=True, lo que la retención descarta en cualquiera de los
+formatos pasa al archivo diario comprimido de largo plazo (ver archivado.py).
+
+Formato JSON Lines:
+Cada sensor tiene su propia carpeta dentro del directorio de históricos con
+segmentos numerados (000001.jsonl, 000002.jsonl, ...). Cada muestra nueva se
+agrega como una línea al final del segmento activo, de modo que el costo de
+escritura no depende del tamaño de la ventana de retención. Cuando el segmento
+activo se llena se rota a uno nuevo y se aplica la retención: se eliminan los
+segmentos que quedan completamente fuera de la ventana y se compacta el más
+antiguo que sobrevive. Con `umbrales`, las líneas llevan solo los canales que
+cambiaron lo suficiente y los lectores reconstruyen el resto (ver
+compresion.py).
+"""
+
+import argparse
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import anillo
+import archivado
+import basedatos
+import compresion
+
+FORMATO_JSONL = 'jsonl'
+FORMATO_ANILLO = 'anillo'
+FORMATO_SQLITE = 'sqlite'
+
+# Registros por segmento antes de rotar (360 registros = 3 horas a 30 segundos)
+REGISTROS_POR_SEGMENTO = 360
+
+EXTENSION_SEGMENTO = '.jsonl'
+SUFIJO_LEGADO = '_historico.json'
+
+# Estado de escritura por sensor: segmento activo y líneas de cada segmento
+_estado_escritura = {}
+# Anillos abiertos para escritura y para lectura, por ruta
+_anillos_escritura = {}
+_anillos_lectura = {}
+_lock_estado = threading.Lock()
+# Timestamp y canales de la primera línea de cada segmento, por ruta (con su
+# inodo)
+_primeras_lineas = {}
+# (ruta de la base, sensor) ya presentes en la base SQLite
+_sensores_sqlite = set()
+
+
+# ===== RUTAS =====
+def carpeta_sensor(carpeta, sensor_id):
+    return os.path.join(carpeta, sensor_id)
+
+
+def ruta_legado(carpeta, sensor_id):
+    return os.path.join(carpeta, f"{sensor_id}{SUFIJO_LEGADO}")
+
+
+def ruta_segmento(carpeta, sensor_id, indice):
+    return os.path.join(carpeta_sensor(carpeta, sensor_id), f"{indice:06d}{EXTENSION_SEGMENTO}")
+
+
+def ruta_anillo(carpeta, sensor_id):
+    return os.path.join(carpeta, f"{sensor_id}{anillo.EXTENSION}")
+
+
+def ruta_sqlite(carpeta):
+    return os.path.join(carpeta, basedatos.ARCHIVO)
+
+
+def _base_sqlite(carpeta, sensor_id):
+    """
+    Ruta de la base SQLite si el sensor guarda su histórico ahí, o None.
+    """
+    ruta = ruta_sqlite(carpeta)
+    return ruta if basedatos.contiene(ruta, sensor_id) else None
+
+
+def listar_segmentos(carpeta, sensor_id):
+    """
+    Devuelve los índices de los segmentos del sensor en orden cronológico.
+    """
+    try:
+        nombres = os.listdir(carpeta_sensor(carpeta, sensor_id))
+    except (FileNotFoundError, NotADirectoryError):
+        return []
+
+    indices = []
+    for nombre in nombres:
+        base, extension = os.path.splitext(nombre)
+        if extension == EXTENSION_SEGMENTO and base.isdigit():
+            indices.append(int(base))
+    return sorted(indices)
+
+
+def listar_sensores(carpeta):
+    """
+    Lista los sensores con histórico en cualquiera de los formatos: segmentos,
+    anillo, base SQLite o JSON antiguo (<id>_historico.json).
+    """
+    sensores = set(basedatos.listar_sensores(ruta_sqlite(carpeta)))
+    try:
+        nombres = os.listdir(carpeta)
+    except FileNotFoundError:
+        return []
+
+    for nombre in nombres:
+        if nombre.endswith(SUFIJO_LEGADO):
+            sensores.add(nombre[:-len(SUFIJO_LEGADO)])
+        elif nombre.endswith(anillo.EXTENSION):
+            sensores.add(nombre[:-len(anillo.EXTENSION)])
+        elif listar_segmentos(carpeta, nombre):
+            sensores.add(nombre)
+    return sorted(sensores)
+
+
+def existe_historico(carpeta, sensor_id):
+    return (
+        bool(listar_segmentos(carpeta, sensor_id))
+        or os.path.exists(ruta_anillo(carpeta, sensor_id))
+        or os.path.exists(ruta_legado(carpeta, sensor_id))
+        or _base_sqlite(carpeta, sensor_id) is not None
+    )
+
+
+# ===== LECTURA =====
+def _leer_lineas(ruta):
+    """
+    Lee los registros de un segmento. Una línea incompleta (por ejemplo, tras
+    un corte de energía a mitad de escritura) se descarta.
+    """
+    registros = []
+    try:
+        with open(ruta, 'r', encoding='utf-8') as f:
+            for linea in f:
+                if not linea.endswith('\n'):
+                    break
+                try:
+                    registros.append(json.loads(linea))
+                except ValueError:
+                    continue
+    except FileNotFoundError:
+        # El segmento pudo ser eliminado por la retención mientras se leía
+        pass
+    return registros
+
+
+def _contar_lineas(ruta):
+    with open(ruta, 'rb') as f:
+        return sum(1 for _ in f)
+
+
+def _leer_segmento(ruta):
+    """
+    Registros completos de un segmento (ver compresion.reconstruir).
+    """
+    return compresion.reconstruir(_leer_lineas(ruta))[0]
+
+
+def leer_registros(carpeta, sensor_id, max_registros=None):
+    """
+    Devuelve los registros del sensor en orden cronológico, limitados a los
+    últimos max_registros si se indica. Solo se leen los segmentos necesarios,
+    empezando por el más reciente.
+    """
+    base = _base_sqlite(carpeta, sensor_id)
+    if base is not None:
+        return basedatos.leer_registros(base, sensor_id, max_registros)
+
+    lector = _lector_anillo(carpeta, sensor_id)
+    if lector is not None:
+        arreglo = anillo.leer_ordenado(lector)
+        return anillo.a_registros(arreglo[-max_registros:] if max_registros else arreglo)
+
+    indices = listar_segmentos(carpeta, sensor_id)
+
+    if not indices:
+        ruta = ruta_legado(carpeta, sensor_id)
+        if not os.path.exists(ruta):
+            return []
+        with open(ruta, 'r', encoding='utf-8') as f:
+            registros = json.load(f).get('registros', [])
+        return registros[-max_registros:] if max_registros else registros
+
+    bloques = []
+    total = 0
+    for indice in reversed(indices):
+        registros = _leer_lineas(ruta_segmento(carpeta, sensor_id, indice))
+        bloques.append(registros)
+        total += len(registros)
+        if max_registros and total >= max_registros:
+            break
+
+    # La primera línea de cada segmento está completa, así que las líneas
+    # comprimidas se reconstruyen sin leer segmentos anteriores
+    registros, _ = compresion.reconstruir([r for bloque in reversed(bloques) for r in bloque])
+    return registros[-max_registros:] if max_registros else registros
+
+
+def leer_arreglo(carpeta, sensor_id, max_registros=None):
+    """
+    Si el sensor guarda su histórico en anillo o en la base SQLite, devuelve
+    los registros (los últimos max_registros, si se indica) como arreglo
+    NumPy estructurado (ver anillo.ESTRUCTURA); el del anillo es una vista de
+    solo lectura del archivo mapeado. En otro caso devuelve None.
+    """
+    base = _base_sqlite(carpeta, sensor_id)
+    if base is not None:
+        return basedatos.leer_arreglo(base, sensor_id, max_registros)
+
+    lector = _lector_anillo(carpeta, sensor_id)
+    if lector is None:
+        return None
+    arreglo = anillo.leer_ordenado(lector)
+    return arreglo[-max_registros:] if max_registros else arreglo
+
+
+def _lector_anillo(carpeta, sensor_id):
+    """
+    Mapeo de solo lectura del anillo del sensor, reutilizado entre llamadas.
+    """
+    ruta = ruta_anillo(carpeta, sensor_id)
+    if not os.path.exists(ruta):
+        _anillos_lectura.pop(ruta, None)
+        return None
+
+    lector = _anillos_lectura.get(ruta)
+    identidad = os.stat(ruta).st_ino
+    if lector is None or lector['inodo'] != identidad:
+        # El archivo es nuevo o fue recreado (por ejemplo, al redimensionarlo)
+        lector = anillo.abrir_lectura(ruta)
+        lector['inodo'] = identidad
+        _anillos_lectura[ruta] = lector
+    return lector
+
+
+# ===== LECTURA INCREMENTAL =====
+def _leer_desde(ruta, offset):
+    """
+    Lee las líneas completas de un segmento a partir de un offset en bytes.
+    Devuelve los registros y el offset donde termina la última línea completa.
+    """
+    with open(ruta, 'rb') as f:
+        f.seek(offset)
+        bloque = f.read()
+
+    fin = bloque.rfind(b'\n') + 1
+    return _parsear_bloque(bloque[:fin]), offset + fin
+
+
+def _puntos_previos(ruta, offset):
+    """
+    Últimos puntos guardados de cada canal en las líneas del segmento antes
+    de `offset` (ver compresion.reconstruir), o None si el segmento ya no está.
+    """
+    try:
+        with open(ruta, 'rb') as f:
+            bloque = f.read(offset)
+    except FileNotFoundError:
+        return None
+    return compresion.reconstruir(_parsear_bloque(bloque[:bloque.rfind(b'\n') + 1]))[1]
+
+
+def _parsear_bloque(bloque):
+    registros = []
+    for linea in bloque.splitlines():
+        try:
+            registros.append(json.loads(linea))
+        except ValueError:
+            continue
+    return registros
+
+
+def posicion_lectura(carpeta, sensor_id):
+    """
+    Marca el final actual del histórico del sensor. Se pasa luego a
+    leer_nuevos para obtener solo lo que se agregue después. Conviene tomarla
+    antes de la lectura completa; un registro que aparezca en ambas lecturas
+    se descarta comparando timestamps.
+    """
+    base = _base_sqlite(carpeta, sensor_id)
+    if base is not None:
+        return {'formato': FORMATO_SQLITE, 'ts': basedatos.extremo(base, sensor_id, ultimo=True)}
+
+    lector = _lector_anillo(carpeta, sensor_id)
+    if lector is not None:
+        return {'formato': FORMATO_ANILLO, 'escritos': anillo.escritos(lector)}
+
+    indices = listar_segmentos(carpeta, sensor_id)
+    if indices:
+        ruta = ruta_segmento(carpeta, sensor_id, indices[-1])
+        try:
+            info = os.stat(ruta)
+        except FileNotFoundError:
+            return {'formato': None}
+        return {'formato': FORMATO_JSONL, 'segmento': indices[-1], 'offset': info.st_size,
+                'mtime': info.st_mtime}
+
+    ruta = ruta_legado(carpeta, sensor_id)
+    if os.path.exists(ruta):
+        info = os.stat(ruta)
+        return {'formato': 'legado', 'mtime': info.st_mtime, 'tamano': info.st_size}
+    return {'formato': None}
+
+
+def leer_nuevos(carpeta, sensor_id, posicion):
+    """
+    Devuelve los registros agregados desde `posicion` (ver posicion_lectura)
+    y actualiza `posicion` en el lugar. Devuelve None cuando no es posible
+    leer solo la cola (cambió el formato, el anillo dio más de una vuelta o el
+    archivo antiguo fue reescrito): en ese caso hay que recargar el sensor.
+    """
+    actual = posicion_lectura(carpeta, sensor_id)
+    formato = posicion.get('formato')
+
+    if actual['formato'] != formato:
+        return None
+
+    if formato == FORMATO_SQLITE:
+        if actual['ts'] == posicion['ts']:
+            return []
+        nuevos = basedatos.leer_posteriores(ruta_sqlite(carpeta), sensor_id, posicion['ts'] or float('-inf'))
+        if nuevos:
+            posicion['ts'] = anillo.a_epoch(nuevos[-1]['timestamp'])
+        return nuevos
+
+    if formato == FORMATO_ANILLO:
+        nuevos = actual['escritos'] - posicion['escritos']
+        if nuevos <= 0:
+            return []
+        lector = _lector_anillo(carpeta, sensor_id)
+        if nuevos > lector['capacidad']:
+            return None
+        posicion['escritos'] = actual['escritos']
+        return anillo.a_registros(anillo.leer_ordenado(lector)[-nuevos:])
+
+    if formato == FORMATO_JSONL:
+        if actual['segmento'] == posicion['segmento'] and actual['offset'] == posicion['offset']:
+            return []
+        indices = listar_segmentos(carpeta, sensor_id)
+        if posicion['segmento'] not in indices:
+            # El segmento donde íbamos ya salió de la ventana de retención
+            return None
+        registros = []
+        segmento, offset = posicion['segmento'], posicion['offset']
+        for indice in indices:
+            if indice < posicion['segmento']:
+                continue
+            ruta = ruta_segmento(carpeta, sensor_id, indice)
+            desde = offset if indice == posicion['segmento'] else 0
+            try:
+                if os.path.getsize(ruta) < desde:
+                    # El segmento fue compactado: los offsets ya no son válidos
+                    return None
+                nuevos, fin = _leer_desde(ruta, desde)
+            except FileNotFoundError:
+                return None
+            registros.extend(nuevos)
+            posicion['segmento'], posicion['offset'] = indice, fin
+        posicion['mtime'] = actual['mtime']
+        if not registros:
+            return registros
+
+        # Histórico comprimido: los canales que faltan se reconstruyen a partir
+        # de los últimos puntos guardados, que se conservan en la posición
+        canales = _primera_linea_segmento(ruta_segmento(carpeta, sensor_id, posicion['segmento']))[1]
+        if 'previos' not in posicion and compresion.incompleto(registros, canales):
+            posicion['previos'] = _puntos_previos(ruta_segmento(carpeta, sensor_id, segmento), offset)
+            if posicion['previos'] is None:
+                return None
+        if 'previos' in posicion:
+            registros, posicion['previos'] = compresion.reconstruir(registros, posicion['previos'], canales)
+        return registros
+
+    if formato == 'legado':
+        if (actual['mtime'], actual['tamano']) != (posicion['mtime'], posicion['tamano']):
+            return None
+        return []
+
+    return []
+
+
+# ===== CONSULTAS POR RANGO DE TIEMPO =====
+# Las líneas de cada segmento están ordenadas por timestamp, así que los
+# límites del rango se ubican con búsqueda binaria sobre los offsets en bytes
+# del archivo (cada paso lee una sola línea) y después se lee únicamente el
+# bloque de bytes comprendido entre ellos. No depende de que las muestras
+# estén equiespaciadas: los huecos y los cambios de intervalo no importan.
+def a_segundos(instante):
+    """
+    Acepta datetime, timestamp ISO o segundos desde anillo.EPOCA.
+    """
+    if instante is None or isinstance(instante, (int, float)):
+        return instante
+    if isinstance(instante, datetime):
+        return (instante - anillo.EPOCA).total_seconds()
+    return anillo.a_epoch(instante)
+
+
+def _timestamp_desde(f, posicion):
+    """
+    Devuelve (timestamp en segundos, offset) de la primera línea completa y
+    válida que empieza en `posicion` o después. Al final del archivo el
+    timestamp es None.
+    """
+    f.seek(max(posicion - 1, 0))
+    if posicion:
+        # Termina de consumir la línea en curso (si posicion ya es el inicio
+        # de una línea, solo se consume el salto de línea anterior)
+        f.readline()
+    while True:
+        inicio = f.tell()
+        linea = f.readline()
+        if not linea.endswith(b'\n'):
+            return None, inicio
+        try:
+            return anillo.a_epoch(json.loads(linea)['timestamp']), inicio
+        except (ValueError, KeyError, TypeError):
+            continue
+
+
+def _buscar_offset(f, tamano, segundos, incluir_iguales=True):
+    """
+    Offset de la primera línea con timestamp >= segundos (o > segundos si
+    incluir_iguales es False).
+    """
+    bajo, alto = 0, tamano
+    while bajo < alto:
+        medio = (bajo + alto) // 2
+        timestamp, _ = _timestamp_desde(f, medio)
+        if timestamp is None or timestamp > segundos or (incluir_iguales and timestamp == segundos):
+            alto = medio
+        else:
+            bajo = medio + 1
+    return _timestamp_desde(f, bajo)[1]
+
+
+def _leer_rango_segmento(ruta, desde, hasta):
+    try:
+        with open(ruta, 'rb') as f:
+            tamano = os.fstat(f.fileno()).st_size
+            inicio = 0 if desde is None else _buscar_offset(f, tamano, desde)
+            fin = tamano if hasta is None else _buscar_offset(f, tamano, hasta, incluir_iguales=False)
+            if fin <= inicio:
+                return []
+            f.seek(inicio)
+            bloque = f.read(fin - inicio)
+    except FileNotFoundError:
+        # El segmento pudo ser eliminado por la retención mientras se leía
+        return []
+    return _parsear_bloque(bloque[:bloque.rfind(b'\n') + 1])
+
+
+def _primera_linea_segmento(ruta):
+    """
+    (timestamp, canales) de la primera línea del segmento, que siempre está
+    completa. Se guarda por inodo: agregar líneas no la cambia y la
+    compactación reemplaza el archivo.
+    """
+    try:
+        inodo = os.stat(ruta).st_ino
+    except FileNotFoundError:
+        return None, ()
+
+    guardado = _primeras_lineas.get(ruta)
+    if guardado is not None and guardado[0] == inodo:
+        return guardado[1:]
+
+    try:
+        with open(ruta, 'rb') as f:
+            timestamp, inicio = _timestamp_desde(f, 0)
+            f.seek(inicio)
+            linea = f.readline()
+    except FileNotFoundError:
+        return None, ()
+    if timestamp is None:
+        return None, ()
+    canales = tuple(c for c in json.loads(linea) if c != 'timestamp' and c != compresion.CLAVE_ANTERIOR)
+    _primeras_lineas[ruta] = (inodo, timestamp, canales)
+    return timestamp, canales
+
+
+def _primer_timestamp_segmento(ruta):
+    return _primera_linea_segmento(ruta)[0]
+
+
+def _filtrar_canales(registros, canales):
+    if canales is None:
+        return registros
+    return [{'timestamp': r['timestamp'], **{canal: r.get(canal) for canal in canales}} for r in registros]
+
+
+def primer_timestamp(carpeta, sensor_id):
+    """
+    Timestamp (segundos desde anillo.EPOCA) del registro más antiguo que se
+    conserva del sensor, o None si no hay histórico.
+    """
+    base = _base_sqlite(carpeta, sensor_id)
+    if base is not None:
+        return basedatos.extremo(base, sensor_id)
+
+    arreglo = leer_arreglo(carpeta, sensor_id)
+    if arreglo is not None:
+        return float(arreglo['timestamp'][0]) if len(arreglo) else None
+
+    for indice in listar_segmentos(carpeta, sensor_id):
+        timestamp = _primer_timestamp_segmento(ruta_segmento(carpeta, sensor_id, indice))
+        if timestamp is not None:
+            return timestamp
+
+    registros = leer_registros(carpeta, sensor_id)
+    return anillo.a_epoch(registros[0]['timestamp']) if registros else None
+
+
+def _registros_archivados(arreglo):
+    canales = arreglo.dtype.names[1:]
+    return [
+        {'timestamp': anillo.desde_epoch(fila[0]).isoformat(), **dict(zip(canales, fila[1:]))}
+        for fila in arreglo.tolist()
+    ]
+
+
+def consultar_rango(carpeta, sensor_id, inicio=None, fin=None, canales=None, con_archivo=False):
+    """
+    Registros del sensor con timestamp en [inicio, fin], en orden
+    cronológico. inicio y fin pueden ser datetime, timestamps ISO o segundos
+    desde anillo.EPOCA (None deja el extremo abierto). Con `canales` cada
+    registro trae solo el timestamp y esos canales. Con con_archivo el rango
+    puede empezar antes de la ventana de retención: esa parte se lee del
+    archivo de largo plazo, abriendo solo los días necesarios.
+    """
+    desde, hasta = a_segundos(inicio), a_segundos(fin)
+    registros = _consultar_ventana(carpeta, sensor_id, desde, hasta, canales)
+    if not con_archivo:
+        return registros
+
+    primero = primer_timestamp(carpeta, sensor_id)
+    if primero is not None and desde is not None and desde >= primero:
+        return registros
+    limite = primero if hasta is None else (hasta if primero is None else min(hasta, primero))
+    arreglo = archivado.leer_rango(carpeta, sensor_id, desde, limite, canales)
+    if primero is not None:
+        arreglo = arreglo[arreglo['timestamp'] < primero]
+    return _registros_archivados(arreglo) + registros
+
+
+def _consultar_ventana(carpeta, sensor_id, desde, hasta, canales):
+    """
+    consultar_rango dentro de la ventana de retención (desde y hasta en
+    segundos).
+    """
+    base = _base_sqlite(carpeta, sensor_id)
+    if base is not None:
+        return _filtrar_canales(basedatos.leer_rango(base, sensor_id, desde, hasta), canales)
+
+    arreglo = leer_arreglo(carpeta, sensor_id)
+    if arreglo is not None:
+        tiempos = arreglo['timestamp']
+        primero = 0 if desde is None else int(tiempos.searchsorted(desde, 'left'))
+        ultimo = len(tiempos) if hasta is None else int(tiempos.searchsorted(hasta, 'right'))
+        return _filtrar_canales(anillo.a_registros(arreglo[primero:ultimo]), canales)
+
+    indices = listar_segmentos(carpeta, sensor_id)
+    if not indices:
+        registros = [
+            r for r in leer_registros(carpeta, sensor_id)
+            if (desde is None or anillo.a_epoch(r['timestamp']) >= desde)
+            and (hasta is None or anillo.a_epoch(r['timestamp']) <= hasta)
+        ]
+        return _filtrar_canales(registros, canales)
+
+    rutas = [ruta_segmento(carpeta, sensor_id, indice) for indice in indices]
+    primeros = [_primer_timestamp_segmento(ruta) for ruta in rutas]
+
+    registros = []
+    for i, ruta in enumerate(rutas):
+        if hasta is not None and primeros[i] is not None and primeros[i] > hasta:
+            break
+        siguiente = next((t for t in primeros[i + 1:] if t is not None), None)
+        if desde is not None and siguiente is not None and siguiente < desde:
+            # Todo el segmento es anterior al rango
+            continue
+        bloque = _leer_rango_segmento(ruta, desde, hasta)
+        if compresion.incompleto(bloque, _primera_linea_segmento(ruta)[1]):
+            # Segmento comprimido: se reconstruye completo (empieza y termina
+            # con líneas completas) y se toma el rango
+            bloque = [
+                r for r in _leer_segmento(ruta)
+                if (desde is None or anillo.a_epoch(r['timestamp']) >= desde)
+                and (hasta is None or anillo.a_epoch(r['timestamp']) <= hasta)
+            ]
+        registros.extend(bloque)
+    return _filtrar_canales(registros, canales)
+
+
+def consultar_rango_sensores(carpeta, sensor_ids, inicio=None, fin=None, canales=None, max_hilos=8,
+                             con_archivo=False):
+    """
+    consultar_rango para varios sensores en una sola llamada, leyendo en
+    paralelo. Devuelve {sensor_id: registros}.
+    """
+    sensor_ids = list(sensor_ids)
+    if not sensor_ids:
+        return {}
+
+    def consultar(sensor_id):
+        return consultar_rango(carpeta, sensor_id, inicio, fin, canales, con_archivo)
+
+    hilos = max(1, min(max_hilos, len(sensor_ids)))
+    with ThreadPoolExecutor(max_workers=hilos, thread_name_prefix='consulta') as pool:
+        return dict(zip(sensor_ids, pool.map(consultar, sensor_ids)))
+
+
+# ===== ESCRITURA =====
+def _escribir_segmento(ruta, registros):
+    """
+    Reescribe un segmento completo de forma atómica (archivo temporal + rename).
+    """
+    temporal = ruta + '.tmp'
+    with open(temporal, 'w', encoding='utf-8') as f:
+        for registro in registros:
+            f.write(json.dumps(registro, ensure_ascii=False) + '\n')
+    os.replace(temporal, ruta)
+
+
+def _migrar_legado(carpeta, sensor_id):
+    """
+    Convierte un histórico en el formato JSON antiguo a segmentos y renombra el
+    archivo original a .migrado para conservarlo como respaldo.
+    """
+    ruta = ruta_legado(carpeta, sensor_id)
+    with open(ruta, 'r', encoding='utf-8') as f:
+        registros = json.load(f).get('registros', [])
+
+    for i in range(0, len(registros), REGISTROS_POR_SEGMENTO):
+        indice = i // REGISTROS_POR_SEGMENTO + 1
+        _escribir_segmento(ruta_segmento(carpeta, sensor_id, indice), registros[i:i + REGISTROS_POR_SEGMENTO])
+
+    os.replace(ruta, ruta + '.migrado')
+
+
+def _cerrar_linea_incompleta(ruta):
+    """
+    Si el segmento activo quedó con una línea a medio escribir, la termina para
+    que el siguiente registro empiece en una línea propia.
+    """
+    with open(ruta, 'rb+') as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell() == 0:
+            return
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) != b'\n':
+            f.write(b'\n')
+
+
+def _obtener_estado(carpeta, sensor_id):
+    """
+    Devuelve el estado de escritura del sensor, inicializándolo la primera vez
+    (migración del formato antiguo y conteo de líneas de cada segmento).
+    """
+    clave = carpeta_sensor(carpeta, sensor_id)
+    with _lock_estado:
+        estado = _estado_escritura.get(clave)
+        if estado is not None:
+            return estado
+
+        os.makedirs(clave, exist_ok=True)
+        if not listar_segmentos(carpeta, sensor_id) and os.path.exists(ruta_legado(carpeta, sensor_id)):
+            _migrar_legado(carpeta, sensor_id)
+
+        conteos = {
+            indice: _contar_lineas(ruta_segmento(carpeta, sensor_id, indice))
+            for indice in listar_segmentos(carpeta, sensor_id)
+        }
+        if conteos:
+            _cerrar_linea_incompleta(ruta_segmento(carpeta, sensor_id, max(conteos)))
+        estado = {
+            'activo': max(conteos) if conteos else 1,
+            'conteos': conteos,
+            'total': sum(conteos.values())
+        }
+        _estado_escritura[clave] = estado
+        return estado
+
+
+def _aplicar_retencion(carpeta, sensor_id, estado, max_registros, archivar=False):
+    """
+    Elimina los segmentos cerrados que quedaron fuera de la ventana de
+    retención y compacta el más antiguo que sobrevive para que el histórico
+    conserve exactamente max_registros registros. Con archivar, los registros
+    que salen se pasan antes al archivo de largo plazo.
+    """
+    conteos = estado['conteos']
+    total = estado['total']
+
+    for indice in sorted(conteos):
+        if indice == estado['activo'] or total - conteos[indice] < max_registros:
+            break
+        total -= conteos.pop(indice)
+        ruta = ruta_segmento(carpeta, sensor_id, indice)
+        try:
+            if archivar:
+                archivado.archivar(carpeta, sensor_id, anillo.desde_registros(_leer_segmento(ruta)))
+            os.remove(ruta)
+        except FileNotFoundError:
+            pass
+
+    exceso = total - max_registros
+    mas_antiguo = min(conteos)
+    if exceso > 0 and mas_antiguo != estado['activo']:
+        ruta = ruta_segmento(carpeta, sensor_id, mas_antiguo)
+        lineas = _leer_lineas(ruta)
+        completos, _ = compresion.reconstruir(lineas)
+        if archivar:
+            archivado.archivar(carpeta, sensor_id, anillo.desde_registros(completos[:exceso]))
+        # La nueva primera línea va completa, como la de cualquier segmento
+        registros = completos[exceso:exceso + 1] + lineas[exceso + 1:]
+        _escribir_segmento(ruta, registros)
+        total += len(registros) - conteos[mas_antiguo]
+        conteos[mas_antiguo] = len(registros)
+
+    estado['total'] = total
+
+
+def _anexar_anillo(carpeta, sensor_id, registro, max_registros, archivar=False):
+    """
+    Escribe el registro en el anillo del sensor. Un anillo nuevo se precarga
+    con el histórico existente en segmentos o en JSON antiguo. Con archivar,
+    el registro que se sobrescribe pasa antes al archivo de largo plazo.
+    """
+    ruta = ruta_anillo(carpeta, sensor_id)
+    with _lock_estado:
+        destino = _anillos_escritura.get(ruta)
+        if destino is None:
+            iniciales = None
+            if not os.path.exists(ruta):
+                iniciales = anillo.desde_registros(leer_registros(carpeta, sensor_id, max_registros))
+            destino = anillo.abrir_escritura(ruta, max_registros, iniciales)
+            _anillos_escritura[ruta] = destino
+
+    if archivar and destino['escritos'] >= destino['capacidad']:
+        cabeza = destino['escritos'] % destino['capacidad']
+        archivado.archivar(carpeta, sensor_id, destino['vista'][cabeza:cabeza + 1].copy())
+    return anillo.escribir(destino, anillo.a_epoch(registro['timestamp']), registro)
+
+
+def _anexar_sqlite(carpeta, registros, max_registros, archivar=False):
+    """
+    Inserta los registros en la base SQLite en una sola transacción. Un
+    sensor que todavía no está en la base se precarga con su histórico en
+    segmentos, anillo o JSON antiguo. Con archivar, las filas que borra la
+    retención pasan al archivo de largo plazo después del commit.
+    """
+    ruta = ruta_sqlite(carpeta)
+    filas = []
+    for sensor_id, registro in registros.items():
+        if (ruta, sensor_id) not in _sensores_sqlite:
+            if not basedatos.contiene(ruta, sensor_id):
+                filas.extend((sensor_id, r) for r in leer_registros(carpeta, sensor_id, max_registros))
+            _sensores_sqlite.add((ruta, sensor_id))
+        filas.append((sensor_id, registro))
+    descartados = {} if archivar else None
+    conservados = basedatos.anexar(ruta, filas, max_registros, descartados)
+    for sensor_id, arreglo in (descartados or {}).items():
+        archivado.archivar(carpeta, sensor_id, arreglo)
+    return conservados
+
+
+def anexar_registros(carpeta, registros, max_registros, formato=FORMATO_JSONL, archivar=False, umbrales=None):
+    """
+    Agrega un registro por sensor ({sensor_id: registro}), por ejemplo los de
+    un ciclo completo. Con formato 'sqlite' todo va en una sola transacción.
+    Devuelve {sensor_id: registros que conserva el histórico}.
+    """
+    if formato == FORMATO_SQLITE:
+        return _anexar_sqlite(carpeta, registros, max_registros, archivar)
+    return {
+        sensor_id: anexar_registro(carpeta, sensor_id, registro, max_registros, formato, archivar, umbrales)
+        for sensor_id, registro in registros.items()
+    }
+
+
+def anexar_registro(carpeta, sensor_id, registro, max_registros, formato=FORMATO_JSONL, archivar=False,
+                    umbrales=None):
+    """
+    Agrega un registro al histórico del sensor: al final del segmento activo,
+    con formato 'anillo' en la cabeza del buffer circular o con formato
+    'sqlite' como una fila de la base. Con archivar, los registros que salen
+    de la ventana de retención van al archivo de largo plazo en lugar de
+    perderse. Con `umbrales` ({canal: (método, umbral)}, solo en JSON Lines)
+    cada canal se guarda cuando cambia más que su umbral (ver compresion.py).
+    Devuelve la cantidad de registros que conserva el histórico.
+    """
+    if formato == FORMATO_ANILLO:
+        return _anexar_anillo(carpeta, sensor_id, registro, max_registros, archivar)
+    if formato == FORMATO_SQLITE:
+        return _anexar_sqlite(carpeta, {sensor_id: registro}, max_registros, archivar)[sensor_id]
+
+    estado = _obtener_estado(carpeta, sensor_id)
+    conteos = estado['conteos']
+
+    if conteos.get(estado['activo'], 0) >= REGISTROS_POR_SEGMENTO:
+        estado['activo'] += 1
+        _aplicar_retencion(carpeta, sensor_id, estado, max_registros, archivar)
+
+    ruta = ruta_segmento(carpeta, sensor_id, estado['activo'])
+    if umbrales:
+        if 'compresion' not in estado:
+            estado['compresion'] = compresion.reanudar(_leer_lineas(ruta))
+        # La primera y la última línea de cada segmento van completas
+        escritas = conteos.get(estado['activo'], 0)
+        registro = compresion.comprimir(estado['compresion'], registro, umbrales,
+                                        completa=escritas in (0, REGISTROS_POR_SEGMENTO - 1))
+    else:
+        estado.pop('compresion', None)
+
+    linea = json.dumps(registro, ensure_ascii=False) + '\n'
+    with open(ruta, 'a', encoding='utf-8') as f:
+        f.write(linea)
+
+    conteos[estado['activo']] = conteos.get(estado['activo'], 0) + 1
+    estado['total'] += 1
+    return min(estado['total'], max_registros)
+
+
+# ===== EXPORTACIÓN =====
+def exportar(carpeta, sensor_id, destino, formato=FORMATO_JSONL):
+    """
+    Vuelca el histórico del sensor, en el formato que tenga, a la carpeta
+    `destino`: como segmentos JSON Lines ('jsonl') o como el JSON antiguo
+    <id>_historico.json ('json'). Devuelve la cantidad de registros.
+    """
+    registros = leer_registros(carpeta, sensor_id)
+    os.makedirs(destino, exist_ok=True)
+
+    if formato == 'json':
+        with open(ruta_legado(destino, sensor_id), 'w', encoding='utf-8') as f:
+            json.dump({'sensor_id': sensor_id, 'registros': registros}, f, indent=2, ensure_ascii=False)
+        return len(registros)
+
+    os.makedirs(carpeta_sensor(destino, sensor_id), exist_ok=True)
+    for indice in listar_segmentos(destino, sensor_id):
+        os.remove(ruta_segmento(destino, sensor_id, indice))
+    for i in range(0, len(registros), REGISTROS_POR_SEGMENTO):
+        indice = i // REGISTROS_POR_SEGMENTO + 1
+        _escribir_segmento(ruta_segmento(destino, sensor_id, indice), registros[i:i + REGISTROS_POR_SEGMENTO])
+    return len(registros)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Exporta el histórico de sensores a JSON Lines o JSON')
+    parser.add_argument('destino', help='carpeta donde se escribe la exportación')
+    parser.add_argument('sensores', nargs='*', help='IDs a exportar (por defecto, todos)')
+    parser.add_argument('--carpeta', default='./historico', help='carpeta de históricos')
+    parser.add_argument('--formato', choices=(FORMATO_JSONL, 'json'), default=FORMATO_JSONL)
+    args = parser.parse_args()
+
+    if os.path.abspath(args.destino) == os.path.abspath(args.carpeta):
+        parser.error('el destino debe ser distinto de la carpeta de históricos')
+    for sensor_id in args.sensores or listar_sensores(args.carpeta):
+        cantidad = exportar(args.carpeta, sensor_id, args.destino, args.formato)
+        print(f"📤 {sensor_id}: {cantidad} registros")
+
+
+if __name__ == '__main__':
+    main()
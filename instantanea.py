@@ -0,0 +1,254 @@
+"""
+Instantáneas del histórico para el arranque rápido del dashboard.
+
+Una instantánea guarda, para cada sensor, la ventana de registros que muestra
+el dashboard ya en columnas (tiempos en ms y un arreglo por KPI), la posición
+de lectura del histórico que corresponde a esas columnas (ver
+historico.posicion_lectura) y las banderas de anomalías. El recolector la
+escribe cada tanto en historico/instantanea/ (un archivo .npz por fragmento)
+y el dashboard la carga al arrancar sin parsear ningún timestamp: después
+lee solo lo que se agregó al histórico desde esa posición, como en cualquier
+refresco incremental.
+
+Si no hay instantánea válida para un sensor (no existe, es de otra versión
+del formato o guarda otros canales o menos registros), se carga desde el
+histórico; con muchos sensores, repartidos entre varios procesos.
+"""
+
+import glob
+import json
+import multiprocessing
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+import historico
+import series
+
+FORMATO = 1
+
+CARPETA = 'instantanea'
+EXTENSION = '.npz'
+
+# Canales que guarda la instantánea (los KPIs del dashboard)
+CANALES = ('ActivePower', 'TotalPowerFactor', 'RelativeTHDVoltage')
+
+# Registros por sensor (igual que MAX_REGISTROS_DASHBOARD en app.py)
+MAX_REGISTROS = 2880
+
+# Por debajo de esta cantidad de sensores la carga desde el histórico se hace
+# en el mismo proceso (lanzar procesos cuesta más que lo que ahorra)
+MIN_SENSORES_PARALELO = 32
+
+
+# ===== RUTAS =====
+def carpeta_instantaneas(carpeta):
+    return os.path.join(carpeta, CARPETA)
+
+
+def ruta_instantanea(carpeta, nombre):
+    return os.path.join(carpeta_instantaneas(carpeta), f"{nombre}{EXTENSION}")
+
+
+# ===== CARGA DESDE EL HISTÓRICO =====
+def columnas_registros(registros, canales):
+    """
+    Convierte registros del histórico (diccionarios con timestamp ISO) a
+    columnas NumPy: (tiempos en ms, {canal: valores}).
+    """
+    tiempos = series.tiempos_desde_iso([r['timestamp'] for r in registros])
+    columnas = {canal: np.array([r.get(canal) for r in registros], dtype=np.float64) for canal in canales}
+    return tiempos, columnas
+
+
+def cargar_sensor(carpeta, sensor_id, canales=CANALES, max_registros=MAX_REGISTROS):
+    """
+    Carga la ventana de un sensor desde su histórico: {'serie', 'posicion'},
+    o None si no tiene registros. La posición de lectura se toma antes de
+    leer para que el refresco incremental continúe desde ahí.
+    """
+    posicion = historico.posicion_lectura(carpeta, sensor_id)
+
+    # Con histórico en anillo las columnas salen directo de la vista mapeada
+    # (y con SQLite, de un arreglo armado con las filas de la consulta)
+    arreglo = historico.leer_arreglo(carpeta, sensor_id, max_registros)
+    if arreglo is not None:
+        if not len(arreglo):
+            return None
+        tiempos = (arreglo['timestamp'] * 1000).astype(np.int64)
+        columnas = {canal: arreglo[canal] for canal in canales}
+    else:
+        registros = historico.leer_registros(carpeta, sensor_id, max_registros)
+        if not registros:
+            return None
+        tiempos, columnas = columnas_registros(registros, canales)
+
+    serie = series.crear_serie(canales, capacidad=max(1024, len(tiempos) * 3 // 2))
+    series.anexar_serie(serie, tiempos, columnas, max_registros)
+    return {'serie': serie, 'posicion': posicion}
+
+
+def _cargar_lote(carpeta, sensor_ids, canales, max_registros):
+    """
+    Carga varios sensores en un proceso trabajador. Devuelve
+    {sensor_id: datos, None o el texto del error}.
+    """
+    resultado = {}
+    for sensor_id in sensor_ids:
+        try:
+            resultado[sensor_id] = cargar_sensor(carpeta, sensor_id, canales, max_registros)
+        except Exception as e:
+            resultado[sensor_id] = f"{type(e).__name__}: {e}"
+    return resultado
+
+
+def cargar_sensores(carpeta, sensor_ids, canales=CANALES, max_registros=MAX_REGISTROS, procesos=None):
+    """
+    Carga varios sensores desde el histórico repartiéndolos entre `procesos`
+    procesos (None = uno por CPU). Devuelve {sensor_id: datos, None o el
+    texto del error}.
+
+    Los procesos se crean con fork: con spawn cada trabajador volvería a
+    importar el módulo principal (el dashboard, que carga los datos al
+    importarse), así que donde fork no existe la carga es secuencial.
+    """
+    sensor_ids = list(sensor_ids)
+    procesos = procesos or os.cpu_count() or 1
+    if (procesos <= 1 or len(sensor_ids) < MIN_SENSORES_PARALELO
+            or 'fork' not in multiprocessing.get_all_start_methods()):
+        return _cargar_lote(carpeta, sensor_ids, canales, max_registros)
+
+    # Varios lotes por proceso, así uno con sensores pesados no retrasa al resto
+    lotes = [sensor_ids[i::procesos * 4] for i in range(procesos * 4)]
+    resultado = {}
+    with ProcessPoolExecutor(procesos, mp_context=multiprocessing.get_context('fork')) as ejecutor:
+        futuros = [ejecutor.submit(_cargar_lote, carpeta, lote, canales, max_registros) for lote in lotes if lote]
+        for futuro in futuros:
+            resultado.update(futuro.result())
+    return {sensor_id: resultado[sensor_id] for sensor_id in sensor_ids}
+
+
+def actualizar(carpeta, bloques, sensor_ids, canales=CANALES, max_registros=MAX_REGISTROS):
+    """
+    Pone al día `bloques` ({sensor_id: {'serie', 'posicion'}}) leyendo solo lo
+    que se agregó a cada histórico; un sensor se recarga completo cuando su
+    histórico cambió de forma no incremental.
+    """
+    for sensor_id in sensor_ids:
+        datos = bloques.get(sensor_id)
+        nuevos = None
+        if datos is not None:
+            nuevos = historico.leer_nuevos(carpeta, sensor_id, datos['posicion'])
+
+        if nuevos is None:
+            datos = cargar_sensor(carpeta, sensor_id, canales, max_registros)
+            if datos is None:
+                bloques.pop(sensor_id, None)
+            else:
+                bloques[sensor_id] = datos
+            continue
+
+        if nuevos:
+            tiempos, columnas = columnas_registros(nuevos, canales)
+            ultimo_ts = series.ultimo_tiempo(datos['serie'])
+            if ultimo_ts is not None:
+                recientes = tiempos > ultimo_ts
+                tiempos = tiempos[recientes]
+                columnas = {canal: valores[recientes] for canal, valores in columnas.items()}
+            series.anexar_serie(datos['serie'], tiempos, columnas, max_registros)
+
+    for sensor_id in set(bloques) - set(sensor_ids):
+        del bloques[sensor_id]
+
+
+# ===== ESCRITURA Y LECTURA =====
+def escribir(ruta, bloques, canales=CANALES, max_registros=MAX_REGISTROS, banderas=None):
+    """
+    Guarda `bloques` ({sensor_id: {'serie', 'posicion'}}) y las banderas de
+    anomalías ({sensor_id: banderas}) en un .npz sin comprimir: todas las
+    series concatenadas por canal y un JSON con el índice de cada sensor.
+    Reemplaza el archivo de una vez.
+    """
+    banderas = banderas or {}
+    ids = sorted(bloques)
+    tiempos = [series.columnas_serie(bloques[s]['serie'], canales[0])[0] for s in ids]
+    inicios = np.zeros(len(ids) + 1, dtype=np.int64)
+    inicios[1:] = np.cumsum([len(t) for t in tiempos])
+
+    meta = {
+        'formato': FORMATO,
+        'creado': datetime.now().isoformat(timespec='seconds'),
+        'canales': list(canales),
+        'max_registros': max_registros,
+        'sensores': [
+            {'id': s, 'posicion': bloques[s]['posicion'], 'anomalias': banderas.get(s, [])} for s in ids
+        ]
+    }
+    arreglos = {
+        'meta': np.frombuffer(json.dumps(meta, ensure_ascii=False).encode('utf-8'), dtype=np.uint8),
+        'inicios': inicios,
+        'tiempos': np.concatenate(tiempos) if ids else np.empty(0, dtype=np.int64)
+    }
+    for canal in canales:
+        columnas = [series.columnas_serie(bloques[s]['serie'], canal)[1] for s in ids]
+        arreglos[f"canal_{canal}"] = np.concatenate(columnas) if ids else np.empty(0)
+
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    temporal = ruta + '.tmp'
+    with open(temporal, 'wb') as f:
+        np.savez(f, **arreglos)
+    os.replace(temporal, ruta)
+
+
+def leer(ruta, canales=CANALES, max_registros=MAX_REGISTROS):
+    """
+    Lee una instantánea: (creado, {sensor_id: {'serie', 'posicion',
+    'anomalias'}}), o None si el archivo no sirve (falta, está dañado, es de
+    otra versión del formato o no tiene los canales o registros pedidos).
+    """
+    try:
+        with np.load(ruta) as archivo:
+            meta = json.loads(archivo['meta'].tobytes().decode('utf-8'))
+            if (meta.get('formato') != FORMATO or not set(canales) <= set(meta['canales'])
+                    or meta['max_registros'] < max_registros):
+                return None
+            inicios = archivo['inicios']
+            tiempos = archivo['tiempos']
+            columnas = {canal: archivo[f"canal_{canal}"] for canal in canales}
+    except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+        return None
+
+    bloques = {}
+    for i, info in enumerate(meta['sensores']):
+        tramo = slice(inicios[i], inicios[i + 1])
+        cantidad = inicios[i + 1] - inicios[i]
+        if not cantidad:
+            continue
+        serie = series.crear_serie(canales, capacidad=max(1024, cantidad * 3 // 2))
+        series.anexar_serie(serie, tiempos[tramo], {canal: columnas[canal][tramo] for canal in canales},
+                            max_registros)
+        bloques[info['id']] = {'serie': serie, 'posicion': info['posicion'], 'anomalias': info['anomalias']}
+    return meta['creado'], bloques
+
+
+def leer_instantaneas(carpeta, canales=CANALES, max_registros=MAX_REGISTROS):
+    """
+    Junta las instantáneas válidas de historico/instantanea/ (una por
+    fragmento del recolector). Si un sensor aparece en varias (por ejemplo,
+    después de cambiar la cantidad de fragmentos), se usa la más reciente.
+    """
+    bloques = {}
+    creados = {}
+    for ruta in sorted(glob.glob(os.path.join(carpeta_instantaneas(carpeta), f"*{EXTENSION}"))):
+        leida = leer(ruta, canales, max_registros)
+        if leida is None:
+            continue
+        creado, sensores_archivo = leida
+        for sensor_id, datos in sensores_archivo.items():
+            if sensor_id not in creados or creado > creados[sensor_id]:
+                bloques[sensor_id] = datos
+                creados[sensor_id] = creado
+    return bloques
@@ -0,0 +1,236 @@
+"""
+Métricas de operación y registro estructurado.
+
+Contadores, valores instantáneos e histogramas de latencia con etiquetas
+(por ejemplo, por sensor y por etapa), expuestos en formato de texto de
+Prometheus por un servidor HTTP mínimo:
+
+    GET http://<host>:<puerto>/metrics
+
+El registro usa el módulo logging con un formato de una línea por evento
+('texto', con los campos extra como clave=valor) o JSON Lines ('json'). Los
+mensajes por muestra van en nivel DEBUG, así que con el nivel INFO el camino
+caliente no escribe nada.
+"""
+
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Límites superiores de las cubetas de latencia, en segundos
+LIMITES_LATENCIA = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# (nombre, etiquetas ordenadas) -> valor o histograma
+_contadores = {}
+_valores = {}
+_histogramas = {}
+_lock_metricas = threading.Lock()
+
+
+# ===== MÉTRICAS =====
+def _clave(nombre, etiquetas):
+    return nombre, tuple(sorted((k, str(v)) for k, v in etiquetas.items()))
+
+
+def incrementar(nombre, cantidad=1, **etiquetas):
+    """
+    Suma `cantidad` a un contador (por convención, nombres terminados en _total).
+    """
+    clave = _clave(nombre, etiquetas)
+    with _lock_metricas:
+        _contadores[clave] = _contadores.get(clave, 0) + cantidad
+
+
+def fijar(nombre, valor, **etiquetas):
+    """
+    Fija el valor actual de una métrica instantánea (gauge).
+    """
+    with _lock_metricas:
+        _valores[_clave(nombre, etiquetas)] = valor
+
+
+def observar(nombre, valor, limites=LIMITES_LATENCIA, **etiquetas):
+    """
+    Registra una observación en un histograma.
+    """
+    clave = _clave(nombre, etiquetas)
+    with _lock_metricas:
+        histograma = _histogramas.get(clave)
+        if histograma is None:
+            histograma = _histogramas[clave] = {'limites': limites, 'cubetas': [0] * len(limites),
+                                                'suma': 0.0, 'conteo': 0}
+        for i, limite in enumerate(histograma['limites']):
+            if valor <= limite:
+                histograma['cubetas'][i] += 1
+                break
+        histograma['suma'] += valor
+        histograma['conteo'] += 1
+
+
+@contextmanager
+def medir(nombre, **etiquetas):
+    """
+    Mide la duración del bloque y la registra en el histograma `nombre`.
+    """
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        observar(nombre, time.perf_counter() - inicio, **etiquetas)
+
+
+# ===== EXPOSICIÓN =====
+def _escapar(valor):
+    return valor.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _formatear_etiquetas(etiquetas, extra=()):
+    pares = list(etiquetas) + list(extra)
+    if not pares:
+        return ''
+    return '{' + ','.join(f'{k}="{_escapar(v)}"' for k, v in pares) + '}'
+
+
+def _numero(valor):
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+def exponer():
+    """
+    Devuelve todas las métricas en formato de texto de Prometheus (0.0.4).
+    """
+    with _lock_metricas:
+        contadores = sorted(_contadores.items())
+        valores = sorted(_valores.items())
+        histogramas = sorted(
+            (clave, {**h, 'cubetas': list(h['cubetas'])}) for clave, h in _histogramas.items()
+        )
+
+    lineas = []
+    tipos_emitidos = set()
+
+    def tipo(nombre, clase):
+        if nombre not in tipos_emitidos:
+            tipos_emitidos.add(nombre)
+            lineas.append(f"# TYPE {nombre} {clase}")
+
+    for (nombre, etiquetas), valor in contadores:
+        tipo(nombre, 'counter')
+        lineas.append(f"{nombre}{_formatear_etiquetas(etiquetas)} {_numero(valor)}")
+
+    for (nombre, etiquetas), valor in valores:
+        tipo(nombre, 'gauge')
+        lineas.append(f"{nombre}{_formatear_etiquetas(etiquetas)} {_numero(valor)}")
+
+    for (nombre, etiquetas), histograma in histogramas:
+        tipo(nombre, 'histogram')
+        acumulado = 0
+        for limite, cantidad in zip(histograma['limites'], histograma['cubetas']):
+            acumulado += cantidad
+            lineas.append(f"{nombre}_bucket{_formatear_etiquetas(etiquetas, [('le', repr(float(limite)))])} {acumulado}")
+        lineas.append(f"{nombre}_bucket{_formatear_etiquetas(etiquetas, [('le', '+Inf')])} {histograma['conteo']}")
+        lineas.append(f"{nombre}_sum{_formatear_etiquetas(etiquetas)} {_numero(histograma['suma'])}")
+        lineas.append(f"{nombre}_count{_formatear_etiquetas(etiquetas)} {histograma['conteo']}")
+
+    return '\n'.join(lineas) + '\n'
+
+
+class _ManejadorMetricas(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?', 1)[0] != '/metrics':
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        cuerpo = exponer().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, *args):
+        pass
+
+
+def iniciar_servidor(puerto, host='0.0.0.0'):
+    """
+    Sirve /metrics en un hilo en segundo plano. Devuelve el servidor.
+    """
+    servidor = ThreadingHTTPServer((host, puerto), _ManejadorMetricas)
+    servidor.daemon_threads = True
+    threading.Thread(target=servidor.serve_forever, name='metricas', daemon=True).start()
+    return servidor
+
+
+# ===== REGISTRO ESTRUCTURADO =====
+# Atributos propios de LogRecord; el resto son campos pasados con extra={...}
+_ATRIBUTOS_REGISTRO = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+def _campos_extra(registro):
+    return {k: v for k, v in vars(registro).items() if k not in _ATRIBUTOS_REGISTRO}
+
+
+class FormatoTexto(logging.Formatter):
+    """
+    Una línea por evento: hora, nivel, origen, mensaje y campos clave=valor.
+    """
+
+    def format(self, registro):
+        linea = f"{self.formatTime(registro, '%Y-%m-%dT%H:%M:%S')} {registro.levelname:<7} {registro.name}: {registro.getMessage()}"
+        campos = _campos_extra(registro)
+        if campos:
+            linea += ' | ' + ' '.join(f"{k}={v}" for k, v in campos.items())
+        if registro.exc_info:
+            linea += '\n' + self.formatException(registro.exc_info)
+        return linea
+
+
+class FormatoJSON(logging.Formatter):
+    """
+    Un objeto JSON por línea con el mensaje y los campos extra.
+    """
+
+    def format(self, registro):
+        evento = {
+            'ts': self.formatTime(registro, '%Y-%m-%dT%H:%M:%S'),
+            'nivel': registro.levelname,
+            'origen': registro.name,
+            'mensaje': registro.getMessage()
+        }
+        evento.update(_campos_extra(registro))
+        if registro.exc_info:
+            evento['excepcion'] = self.formatException(registro.exc_info)
+        return json.dumps(evento, ensure_ascii=False, default=str)
+
+
+class _CamposFijos(logging.Filter):
+    def __init__(self, campos):
+        super().__init__()
+        self.campos = campos
+
+    def filter(self, registro):
+        for clave, valor in self.campos.items():
+            setattr(registro, clave, valor)
+        return True
+
+
+def configurar_registro(nivel='INFO', formato='texto', campos=None):
+    """
+    Configura el registro raíz con el nivel y el formato ('texto' o 'json')
+    dados. `campos` se agregan a todos los eventos (por ejemplo, el fragmento
+    del proceso recolector).
+    """
+    manejador = logging.StreamHandler()
+    manejador.setFormatter(FormatoJSON() if formato == 'json' else FormatoTexto())
+    if campos:
+        manejador.addFilter(_CamposFijos(campos))
+    raiz = logging.getLogger()
+    raiz.handlers[:] = [manejador]
+    raiz.setLevel(nivel)
+    # El detalle de cada conexión de urllib3 no aporta en DEBUG y es muy ruidoso
+    logging.getLogger('urllib3').setLevel(logging.WARNING)
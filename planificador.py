@@ -0,0 +1,237 @@
+"""
+Planificador de tareas periódicas a tasa fija, alineado al reloj.
+
+Cada unidad (un sensor o un lote de sensores) tiene su propio intervalo y se
+ejecuta en los instantes múltiplos de ese intervalo (por ejemplo, :00 y :30
+para 30 s), sin importar cuánto tarden las ejecuciones anteriores: el
+siguiente tick se calcula a partir del tick nominal, no de la hora en que
+terminó la tarea, así que los timestamps no se corren con la carga.
+
+- Jitter: cada unidad se despacha con un desfase fijo dentro de su tick (el
+  timestamp sigue siendo el tick nominal) para repartir la carga.
+- Retroceso exponencial: tras fallas consecutivas se omiten ticks, duplicando
+  la espera hasta backoff_max.
+- Circuito: con umbral_circuito fallas seguidas la unidad queda suspendida
+  espera_circuito segundos; después se prueba un solo tick.
+- Recuperación: si una unidad sigue en curso cuando llega su siguiente tick, o
+  el tick se despacha con más retraso que `tolerancia` (fracción del
+  intervalo), ese tick se omite y se cuenta como perdido; nunca se acumulan
+  ejecuciones atrasadas.
+- Cierre de tick: al_cerrar_tick(tick) se llama una vez que todas las
+  unidades de ese tick terminaron o se omitieron, por ejemplo para guardar
+  juntos los resultados de todas.
+"""
+
+import hashlib
+import heapq
+import logging
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metricas
+
+log = logging.getLogger('planificador')
+
+
+def tick_alineado(instante, intervalo):
+    """
+    Primer múltiplo de `intervalo` (en segundos de reloj) mayor o igual a instante.
+    """
+    return math.ceil(instante / intervalo) * intervalo
+
+
+def _desfase(nombre, jitter_max, intervalo):
+    """
+    Desfase de despacho fijo por unidad, repartido de forma uniforme según un
+    hash del nombre.
+    """
+    if jitter_max <= 0:
+        return 0.0
+    fraccion = int(hashlib.md5(str(nombre).encode()).hexdigest()[:8], 16) / 0xFFFFFFFF
+    return fraccion * min(jitter_max, intervalo / 2)
+
+
+def crear_planificador(tarea, intervalos, max_hilos=8, jitter_max=0.0, tolerancia=0.5,
+                       backoff_max=600, umbral_circuito=5, espera_circuito=300, al_cerrar_tick=None):
+    """
+    `tarea(nombre, tick)` se ejecuta en un hilo del pool y devuelve True si
+    tuvo éxito. `intervalos` mapea cada unidad a su intervalo en segundos.
+    `al_cerrar_tick(tick)`, si se indica, se llama (en el hilo de la última
+    unidad) cuando ninguna unidad tiene pendiente ese tick.
+    """
+    ahora = time.time()
+    unidades = {}
+    agenda = []
+    abiertos = {}
+    for nombre, intervalo in intervalos.items():
+        unidad = {
+            'intervalo': intervalo,
+            'desfase': _desfase(nombre, jitter_max, intervalo),
+            'en_curso': False,
+            'fallas': 0,
+            'bloqueada_hasta': 0.0,
+            'circuito': 'cerrado',
+            'ejecuciones': 0,
+            'perdidos': 0,
+            'omitidos': 0
+        }
+        unidades[nombre] = unidad
+        tick = tick_alineado(ahora, intervalo)
+        heapq.heappush(agenda, (tick + unidad['desfase'], tick, nombre))
+        abiertos[tick] = abiertos.get(tick, 0) + 1
+
+    return {
+        'tarea': tarea,
+        'unidades': unidades,
+        'agenda': agenda,
+        'max_hilos': max_hilos,
+        'tolerancia': tolerancia,
+        'backoff_max': backoff_max,
+        'umbral_circuito': umbral_circuito,
+        'espera_circuito': espera_circuito,
+        'al_cerrar_tick': al_cerrar_tick,
+        # Unidades que todavía tienen cada tick agendado o en curso
+        'abiertos': abiertos,
+        'lock': threading.Lock(),
+        'detener': threading.Event()
+    }
+
+
+def _cerrar_tick(planificador, tick):
+    """
+    Una unidad terminó (u omitió) el tick; con la última se llama a
+    al_cerrar_tick.
+    """
+    with planificador['lock']:
+        planificador['abiertos'][tick] -= 1
+        cerrado = not planificador['abiertos'][tick]
+        if cerrado:
+            del planificador['abiertos'][tick]
+    if cerrado and planificador['al_cerrar_tick']:
+        try:
+            planificador['al_cerrar_tick'](tick)
+        except Exception as e:
+            log.error("💥 Error al cerrar el tick %s - %s", tick, e)
+
+
+def _registrar_resultado(planificador, nombre, tick, exito):
+    unidad = planificador['unidades'][nombre]
+    with planificador['lock']:
+        unidad['en_curso'] = False
+        unidad['ejecuciones'] += 1
+        if exito:
+            if unidad['circuito'] != 'cerrado':
+                log.info("🟢 %s: Circuito cerrado, vuelve a responder", nombre, extra={'unidad': nombre})
+                metricas.fijar('planificador_circuito_abierto', 0, unidad=nombre)
+            unidad['fallas'] = 0
+            unidad['bloqueada_hasta'] = 0.0
+            unidad['circuito'] = 'cerrado'
+            return
+
+        unidad['fallas'] += 1
+        if unidad['fallas'] >= planificador['umbral_circuito']:
+            if unidad['circuito'] == 'cerrado':
+                log.warning("🔴 %s: Circuito abierto tras %d fallas, se reintenta en %s s",
+                            nombre, unidad['fallas'], planificador['espera_circuito'], extra={'unidad': nombre})
+            elif unidad['circuito'] == 'semiabierto':
+                log.warning("🔴 %s: Sigue sin responder, se reintenta en %s s",
+                            nombre, planificador['espera_circuito'], extra={'unidad': nombre})
+            metricas.fijar('planificador_circuito_abierto', 1, unidad=nombre)
+            unidad['circuito'] = 'abierto'
+            unidad['bloqueada_hasta'] = time.time() + planificador['espera_circuito']
+        else:
+            # Se omiten ticks hasta que pase la espera: tras la primera falla se
+            # reintenta en el tick siguiente y después cada 2, 4, 8... intervalos
+            espera = min(unidad['intervalo'] * 2 ** (unidad['fallas'] - 1), planificador['backoff_max'])
+            unidad['bloqueada_hasta'] = tick + espera
+
+
+def _ejecutar_tick(planificador, nombre, tick):
+    exito = False
+    inicio = time.perf_counter()
+    try:
+        exito = bool(planificador['tarea'](nombre, tick))
+    except Exception as e:
+        log.error("💥 %s: Error en la tarea planificada - %s", nombre, e, extra={'unidad': nombre})
+    finally:
+        duracion = time.perf_counter() - inicio
+        metricas.observar('planificador_tick_segundos', duracion, unidad=nombre)
+        if duracion > planificador['unidades'][nombre]['intervalo']:
+            metricas.incrementar('planificador_ticks_excedidos_total', unidad=nombre)
+        _registrar_resultado(planificador, nombre, tick, exito)
+        _cerrar_tick(planificador, tick)
+
+
+def _despachar(planificador, pool, nombre, tick):
+    """
+    Decide si el tick se ejecuta y programa el siguiente de la unidad.
+    """
+    unidad = planificador['unidades'][nombre]
+    intervalo = unidad['intervalo']
+    ahora = time.time()
+
+    siguiente = tick + intervalo
+    if siguiente + unidad['desfase'] <= ahora:
+        # El planificador se atrasó más de un intervalo: se salta a la grilla actual
+        perdidos = int((ahora - unidad['desfase'] - siguiente) // intervalo) + 1
+        unidad['perdidos'] += perdidos
+        metricas.incrementar('planificador_ticks_perdidos_total', perdidos, unidad=nombre)
+        siguiente += perdidos * intervalo
+    heapq.heappush(planificador['agenda'], (siguiente + unidad['desfase'], siguiente, nombre))
+
+    with planificador['lock']:
+        abiertos = planificador['abiertos']
+        abiertos[siguiente] = abiertos.get(siguiente, 0) + 1
+        ejecutar = False
+        if unidad['en_curso'] or ahora - tick - unidad['desfase'] > planificador['tolerancia'] * intervalo:
+            unidad['perdidos'] += 1
+            metricas.incrementar('planificador_ticks_perdidos_total', unidad=nombre)
+        elif tick < unidad['bloqueada_hasta']:
+            unidad['omitidos'] += 1
+            metricas.incrementar('planificador_ticks_omitidos_total', unidad=nombre)
+        else:
+            if unidad['circuito'] == 'abierto':
+                # Pasó la espera: se prueba un solo tick antes de cerrar el circuito
+                unidad['circuito'] = 'semiabierto'
+            unidad['en_curso'] = ejecutar = True
+
+    if ejecutar:
+        pool.submit(_ejecutar_tick, planificador, nombre, tick)
+    else:
+        _cerrar_tick(planificador, tick)
+
+
+def ejecutar(planificador):
+    """
+    Bucle del planificador; bloquea hasta que se llame a detener().
+    """
+    agenda = planificador['agenda']
+    with ThreadPoolExecutor(max_workers=planificador['max_hilos'], thread_name_prefix='tick') as pool:
+        while agenda and not planificador['detener'].is_set():
+            despacho, tick, nombre = agenda[0]
+            espera = despacho - time.time()
+            if espera > 0:
+                planificador['detener'].wait(espera)
+                continue
+            heapq.heappop(agenda)
+            _despachar(planificador, pool, nombre, tick)
+
+
+def detener(planificador):
+    planificador['detener'].set()
+
+
+def resumen(planificador):
+    """
+    Totales de ejecuciones, ticks perdidos, ticks omitidos por retroceso y
+    unidades con el circuito abierto.
+    """
+    unidades = planificador['unidades'].values()
+    return {
+        'ejecuciones': sum(u['ejecuciones'] for u in unidades),
+        'perdidos': sum(u['perdidos'] for u in unidades),
+        'omitidos': sum(u['omitidos'] for u in unidades),
+        'circuitos_abiertos': sum(1 for u in unidades if u['circuito'] == 'abierto')
+    }
@@ -0,0 +1,121 @@
+"""
+Registro de sensores compartido por el recolector (getter.py) y el dashboard
+(app.py).
+
+La flota se describe en un archivo JSON (por defecto sensores.json, junto a
+este módulo) con una entrada por medidor:
+
+    {"id": "SM_B3_RECT", "nombre": "Bloque 03 - Rectoria",
+     "lat": 6.2434, "lon": -75.5895, "grupo": "Bloque 03", "intervalo": 60}
+
+Solo 'id' es obligatorio. 'intervalo' (segundos entre consultas) es opcional:
+sin él se usa el intervalo general del recolector. Un medidor sin 'lat' y
+'lon' se recolecta pero no aparece en el mapa.
+
+Para repartir la flota entre varios procesos recolectores, cada sensor se
+asigna a un fragmento por hashing consistente: al cambiar la cantidad de
+fragmentos solo se mueve la fracción mínima de sensores, y un sensor siempre
+queda en un único fragmento, dueño exclusivo de sus archivos.
+"""
+
+import bisect
+import hashlib
+import json
+import os
+
+ARCHIVO_SENSORES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'sensores.json')
+
+# Puntos de cada fragmento en el anillo de hashing; más puntos reparten mejor
+NODOS_VIRTUALES = 64
+
+
+# ===== REGISTRO =====
+def cargar_sensores(ruta=ARCHIVO_SENSORES):
+    """
+    Lee el registro de sensores. Devuelve la lista de entradas en el orden
+    del archivo.
+    """
+    with open(ruta, 'r', encoding='utf-8') as f:
+        entradas = json.load(f)
+
+    vistos = set()
+    for posicion, entrada in enumerate(entradas):
+        sensor_id = entrada.get('id')
+        if not sensor_id:
+            raise ValueError(f"{ruta}: la entrada {posicion} no tiene 'id'")
+        if sensor_id in vistos:
+            raise ValueError(f"{ruta}: el sensor {sensor_id} está repetido")
+        vistos.add(sensor_id)
+    return entradas
+
+
+def ids_sensores(registro):
+    return [entrada['id'] for entrada in registro]
+
+
+def intervalos_propios(registro):
+    """
+    {sensor_id: intervalo} de los sensores con intervalo propio.
+    """
+    return {entrada['id']: entrada['intervalo'] for entrada in registro if entrada.get('intervalo')}
+
+
+def ubicaciones(registro):
+    """
+    {sensor_id: {'lat', 'lon', 'nombre', 'grupo'}} de los sensores con
+    coordenadas, para el mapa.
+    """
+    return {
+        entrada['id']: {
+            'lat': entrada['lat'],
+            'lon': entrada['lon'],
+            'nombre': entrada.get('nombre', entrada['id']),
+            'grupo': entrada.get('grupo')
+        }
+        for entrada in registro
+        if entrada.get('lat') is not None and entrada.get('lon') is not None
+    }
+
+
+# ===== FRAGMENTOS =====
+def _hash(texto):
+    return int(hashlib.md5(texto.encode()).hexdigest()[:16], 16)
+
+
+def _anillo_fragmentos(total):
+    puntos = sorted(
+        (_hash(f"fragmento_{fragmento}#{virtual}"), fragmento)
+        for fragmento in range(total)
+        for virtual in range(NODOS_VIRTUALES)
+    )
+    return [punto for punto, _ in puntos], [fragmento for _, fragmento in puntos]
+
+
+def fragmento_de(sensor_id, total):
+    """
+    Fragmento (0 .. total-1) al que pertenece el sensor.
+    """
+    return asignar_fragmentos([sensor_id], total)[sensor_id]
+
+
+def asignar_fragmentos(sensor_ids, total):
+    """
+    {sensor_id: fragmento} por hashing consistente: cada sensor va al primer
+    punto del anillo que sigue a su hash.
+    """
+    if total <= 1:
+        return {sensor_id: 0 for sensor_id in sensor_ids}
+    puntos, fragmentos = _anillo_fragmentos(total)
+    asignacion = {}
+    for sensor_id in sensor_ids:
+        posicion = bisect.bisect(puntos, _hash(sensor_id)) % len(puntos)
+        asignacion[sensor_id] = fragmentos[posicion]
+    return asignacion
+
+
+def sensores_del_fragmento(registro, fragmento, total):
+    """
+    Entradas del registro que pertenecen al fragmento, en el orden del archivo.
+    """
+    asignacion = asignar_fragmentos(ids_sensores(registro), total)
+    return [entrada for entrada in registro if asignacion[entrada['id']] == fragmento]
@@ -0,0 +1,301 @@
+"""
+Series temporales columnares y operaciones vectorizadas con NumPy.
+
+Los tiempos se representan como int64 en milisegundos desde 1970-01-01 en hora
+local, sin zona horaria: la misma convención que usan anillo.py y
+numpy.datetime64 al leer los timestamps ISO del histórico.
+"""
+
+import numpy as np
+
+# Anchos de intervalo disponibles para agregar, en segundos
+INTERVALOS_AGREGACION = {
+    30: '30 s',
+    300: '5 min',
+    3600: '1 hora',
+    86400: '1 día'
+}
+
+# Por encima de esta cantidad de intervalos vacíos se agrupa ordenando en lugar
+# de usar bincount sobre todo el rango
+_MAX_RANGO_BINCOUNT = 5_000_000
+
+
+# ===== SERIES COLUMNARES =====
+# Una serie guarda un arreglo int64 de tiempos y un arreglo float64 por canal,
+# con capacidad de sobra al final para crecer sin copiar en cada muestra.
+# El estado visible ('actual') se reemplaza de una sola vez al agregar datos, y
+# lo ya publicado nunca se modifica: un lector que tomó sus columnas puede
+# seguir usándolas aunque otro hilo agregue registros en paralelo.
+def crear_serie(canales, capacidad=1024):
+    actual = {'inicio': 0, 'fin': 0, 'tiempos': np.empty(capacidad, dtype=np.int64)}
+    actual.update({canal: np.empty(capacidad) for canal in canales})
+    return {'canales': tuple(canales), 'actual': actual}
+
+
+def anexar_serie(serie, tiempos_ms, columnas, max_registros=None):
+    """
+    Agrega registros al final de la serie. `columnas` mapea cada canal a sus
+    valores. Con max_registros se descartan los más antiguos (moviendo el
+    inicio; la memoria se recupera en la siguiente reubicación).
+    """
+    cantidad = len(tiempos_ms)
+    if not cantidad:
+        return
+    if max_registros and cantidad > max_registros:
+        tiempos_ms = tiempos_ms[-max_registros:]
+        columnas = {canal: valores[-max_registros:] for canal, valores in columnas.items()}
+        cantidad = max_registros
+
+    actual = serie['actual']
+    inicio, fin = actual['inicio'], actual['fin']
+
+    if fin + cantidad > len(actual['tiempos']):
+        # Sin espacio al final: se copian los registros vigentes a arreglos nuevos
+        conservar = fin - inicio
+        if max_registros:
+            conservar = min(conservar, max_registros - cantidad)
+        capacidad = max(1024, (conservar + cantidad) * 3 // 2)
+        nuevo = {'tiempos': np.empty(capacidad, dtype=np.int64)}
+        nuevo.update({canal: np.empty(capacidad) for canal in serie['canales']})
+        for clave, arreglo in nuevo.items():
+            arreglo[:conservar] = actual[clave][fin - conservar:fin]
+        actual, inicio, fin = nuevo, 0, conservar
+
+    actual['tiempos'][fin:fin + cantidad] = tiempos_ms
+    for canal in serie['canales']:
+        actual[canal][fin:fin + cantidad] = columnas.get(canal, np.nan)
+    fin += cantidad
+    if max_registros and fin - inicio > max_registros:
+        inicio = fin - max_registros
+
+    serie['actual'] = {**actual, 'inicio': inicio, 'fin': fin}
+
+
+def intercalar_serie(serie, tiempos_ms, columnas, max_registros=None):
+    """
+    Como anexar_serie, pero los registros pueden ser anteriores al último de
+    la serie (muestras que llegaron tarde o por dos caminos): se intercalan en
+    orden y los tiempos que la serie ya tiene se descartan. Si todos van
+    después del último se anexan sin copiar; si no, se arma un estado nuevo.
+    Devuelve la cantidad de registros agregados.
+    """
+    tiempos_ms = np.asarray(tiempos_ms, dtype=np.int64)
+    columnas = {
+        canal: np.broadcast_to(np.asarray(columnas.get(canal, np.nan), dtype=np.float64), tiempos_ms.shape)
+        for canal in serie['canales']
+    }
+    vigentes, valores = foto_serie(serie)
+    # Tiempos nuevos, en orden y sin repetir (gana el primero)
+    tiempos_ms, primeros = np.unique(tiempos_ms, return_index=True)
+    nuevos = ~np.isin(tiempos_ms, vigentes)
+    primeros = primeros[nuevos]
+    tiempos_ms = tiempos_ms[nuevos]
+    if not len(tiempos_ms):
+        return 0
+    columnas = {canal: v[primeros] for canal, v in columnas.items()}
+
+    if not len(vigentes) or tiempos_ms[0] > vigentes[-1]:
+        anexar_serie(serie, tiempos_ms, columnas, max_registros)
+        return len(tiempos_ms)
+
+    tiempos = np.concatenate((vigentes, tiempos_ms))
+    orden = np.argsort(tiempos, kind='stable')
+    if max_registros:
+        orden = orden[-max_registros:]
+    capacidad = max(1024, len(orden) * 3 // 2)
+    actual = {'inicio': 0, 'fin': len(orden), 'tiempos': np.empty(capacidad, dtype=np.int64)}
+    actual['tiempos'][:len(orden)] = tiempos[orden]
+    for canal in serie['canales']:
+        actual[canal] = np.empty(capacidad)
+        actual[canal][:len(orden)] = np.concatenate((valores[canal], columnas[canal]))[orden]
+    serie['actual'] = actual
+    return len(tiempos_ms)
+
+
+def columnas_serie(serie, canal):
+    """
+    Devuelve (tiempos_ms, valores) del canal como vistas sin copia.
+    """
+    actual = serie['actual']
+    tramo = slice(actual['inicio'], actual['fin'])
+    return actual['tiempos'][tramo], actual[canal][tramo]
+
+
+def foto_serie(serie):
+    """
+    Devuelve (tiempos_ms, {canal: valores}) de todos los canales tomados del
+    mismo estado publicado, como vistas sin copia.
+    """
+    actual = serie['actual']
+    tramo = slice(actual['inicio'], actual['fin'])
+    return actual['tiempos'][tramo], {canal: actual[canal][tramo] for canal in serie['canales']}
+
+
+def longitud_serie(serie):
+    actual = serie['actual']
+    return actual['fin'] - actual['inicio']
+
+
+def ultimo_tiempo(serie):
+    actual = serie['actual']
+    return int(actual['tiempos'][actual['fin'] - 1]) if actual['fin'] > actual['inicio'] else None
+
+
+def tiempos_desde_iso(timestamps):
+    """
+    Convierte una secuencia de timestamps ISO a int64 en milisegundos.
+    """
+    return np.array(timestamps, dtype='datetime64[ms]').astype(np.int64)
+
+
+def agregar_por_intervalo(tiempos_ms, valores, ancho_s):
+    """
+    Promedia los valores dentro de intervalos fijos de ancho_s segundos,
+    alineados a múltiplos del ancho (por ejemplo, :00 y :30 para 30 s).
+    Devuelve (inicio de cada intervalo en ms, promedio, cantidad de muestras),
+    solo para los intervalos que tienen al menos una muestra válida.
+    """
+    tiempos_ms = np.asarray(tiempos_ms, dtype=np.int64)
+    valores = np.asarray(valores, dtype=np.float64)
+
+    validos = np.isfinite(valores)
+    if not validos.all():
+        tiempos_ms, valores = tiempos_ms[validos], valores[validos]
+    if not len(valores):
+        vacio = np.empty(0, dtype=np.int64)
+        return vacio, np.empty(0), vacio
+
+    ancho_ms = int(ancho_s * 1000)
+    cubetas = tiempos_ms // ancho_ms
+    primera = int(cubetas.min())
+    rango = int(cubetas.max()) - primera + 1
+
+    if rango <= _MAX_RANGO_BINCOUNT:
+        indices = cubetas - primera
+        conteos = np.bincount(indices, minlength=rango)
+        sumas = np.bincount(indices, weights=valores, minlength=rango)
+        ocupadas = np.flatnonzero(conteos)
+        inicios = (ocupadas + primera) * ancho_ms
+        return inicios, sumas[ocupadas] / conteos[ocupadas], conteos[ocupadas]
+
+    unicas, indices = np.unique(cubetas, return_inverse=True)
+    conteos = np.bincount(indices)
+    sumas = np.bincount(indices, weights=valores)
+    return unicas * ancho_ms, sumas / conteos, conteos
+
+
+def clasificar_por_percentil(valores, percentiles=(33, 66)):
+    """
+    Devuelve para cada valor el índice del tramo en que cae según los
+    percentiles dados (0 = por debajo del primero). Los percentiles se
+    calculan una sola vez para toda la serie.
+    """
+    valores = np.asarray(valores, dtype=np.float64)
+    if not len(valores):
+        return np.empty(0, dtype=np.intp)
+    cortes = np.percentile(valores, percentiles)
+    return np.searchsorted(cortes, valores, side='right')
+
+
+def etiquetas_intervalo(inicios_ms, ancho_s):
+    """
+    Etiquetas de texto para el inicio de cada intervalo, con el nivel de
+    detalle que corresponde al ancho.
+    """
+    texto = np.datetime_as_string(np.asarray(inicios_ms, dtype='datetime64[ms]'), unit='s')
+    if ancho_s >= 86400:
+        return [t[:10] for t in texto]
+    if ancho_s >= 3600:
+        return [f"{t[8:10]}/{t[5:7]} {t[11:16]}" for t in texto]
+    if ancho_s >= 60:
+        return [t[11:16] for t in texto]
+    return [t[11:19] for t in texto]
+
+
+# ===== REDUCCIÓN DE PUNTOS PARA GRAFICAR =====
+def reducir_lttb(x, y, umbral):
+    """
+    Largest-Triangle-Three-Buckets: elige `umbral` puntos que conservan la
+    forma visual de la serie. Siempre se conservan el primero y el último.
+    Devuelve los índices elegidos, en orden.
+    """
+    n = len(x)
+    if umbral >= n or umbral < 3:
+        return np.arange(n)
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # Límites de las cubetas intermedias (la primera y la última son un punto)
+    limites = np.linspace(1, n - 1, umbral - 1).astype(np.intp)
+
+    elegidos = np.empty(umbral, dtype=np.intp)
+    elegidos[0] = 0
+    elegidos[-1] = n - 1
+    anterior = 0
+
+    for i in range(umbral - 2):
+        inicio, fin = limites[i], limites[i + 1]
+        # Promedio de la cubeta siguiente, el tercer vértice del triángulo
+        sig_inicio, sig_fin = fin, (limites[i + 2] if i + 2 < len(limites) else n)
+        x_prom = x[sig_inicio:sig_fin].mean()
+        y_prom = y[sig_inicio:sig_fin].mean()
+
+        xa, ya = x[anterior], y[anterior]
+        areas = np.abs((xa - x_prom) * (y[inicio:fin] - ya) - (xa - x[inicio:fin]) * (y_prom - ya))
+        anterior = inicio + int(areas.argmax())
+        elegidos[i + 1] = anterior
+
+    return elegidos
+
+
+def reducir_min_max(x, y, umbral):
+    """
+    Envolvente mínimo/máximo: divide la serie en umbral/2 cubetas por posición
+    y conserva el mínimo y el máximo de cada una. Devuelve los índices
+    elegidos, en orden.
+    """
+    n = len(x)
+    if umbral >= n or umbral < 2:
+        return np.arange(n)
+
+    y = np.asarray(y, dtype=np.float64)
+    cubetas = np.arange(n) * (umbral // 2) // n
+    # Dentro de cada cubeta el primer índice ordenado por valor es el mínimo
+    # y el último es el máximo
+    orden = np.lexsort((y, cubetas))
+    cortes = np.flatnonzero(np.diff(cubetas[orden])) + 1
+    minimos = orden[np.concatenate(([0], cortes))]
+    maximos = orden[np.concatenate((cortes - 1, [n - 1]))]
+    return np.unique(np.concatenate((minimos, maximos)))
+
+
+def reducir_serie(tiempos_ms, valores, umbral, metodo='lttb'):
+    """
+    Reduce una serie a lo sumo a `umbral` puntos para graficarla, descartando
+    antes los valores no finitos. Devuelve (tiempos_ms, valores).
+    """
+    tiempos_ms = np.asarray(tiempos_ms, dtype=np.int64)
+    valores = np.asarray(valores, dtype=np.float64)
+
+    validos = np.isfinite(valores)
+    if not validos.all():
+        tiempos_ms, valores = tiempos_ms[validos], valores[validos]
+
+    if len(valores) <= umbral:
+        return tiempos_ms, valores
+
+    reducir = reducir_min_max if metodo == 'min_max' else reducir_lttb
+    indices = reducir(tiempos_ms, valores, umbral)
+    return tiempos_ms[indices], valores[indices]
+
+
+def recortar_rango(tiempos_ms, valores, inicio_ms=None, fin_ms=None):
+    """
+    Recorta una serie ordenada al rango [inicio_ms, fin_ms] con búsqueda
+    binaria, incluyendo un punto a cada lado para que la línea no se corte en
+    los bordes del gráfico.
+    """
+    desde = 0 if inicio_ms is None else max(int(np.searchsorted(tiempos_ms, inicio_ms, 'left')) - 1, 0)
+    hasta = len(tiempos_ms) if fin_ms is None else int(np.searchsorted(tiempos_ms, fin_ms, 'right')) + 1
+    return tiempos_ms[desde:hasta], valores[desde:hasta]
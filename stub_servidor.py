@@ -0,0 +1,225 @@
+"""
+Servidor local de prueba para el recolector (getter.py).
+
+Sirve las entidades de los medidores a partir de los JSON de una carpeta
+(por defecto ./datos) con los dos modos de adquisición de getter.py:
+
+- GET /data/<id>.json: una entidad por solicitud, con ETag (responde 304 si
+  no cambió).
+- GET /v2/entities?id=a,b,c&attrs=...&limit=...: varias entidades por
+  solicitud, al estilo NGSI v2.
+
+Los valores numéricos varían un poco en cada periodo para que el recolector
+vea datos nuevos. Con --sinteticos N se sirve una flota de N medidores
+(SM_SINT_00001, ...) clonados de las plantillas, y con --latencia y
+--tasa-fallas se simula un servidor lento o inestable. Uso:
+
+    python stub_servidor.py --puerto 5555 --periodo 30
+
+y en getter.py:
+
+    BASE_URL = "http://127.0.0.1:5555/data"
+    URL_NGSI = "http://127.0.0.1:5555/v2"
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# ===== CONFIGURACIÓN =====
+PUERTO = 5555
+CARPETA_PLANTILLAS = './datos'
+
+# Cada cuántos segundos cambian los valores servidos
+PERIODO_CAMBIO = 30
+
+# Variación relativa máxima de los valores numéricos
+VARIACION = 0.05
+
+# Máximo de entidades por respuesta de /v2/entities (límite de NGSI v2)
+LIMITE_NGSI = 1000
+
+
+def cargar_plantillas(carpeta):
+    """
+    Lee los JSON de entidades de la carpeta. Devuelve {id_entidad: entidad}.
+    """
+    plantillas = {}
+    for nombre in sorted(os.listdir(carpeta)):
+        if not nombre.endswith('.json'):
+            continue
+        with open(os.path.join(carpeta, nombre), 'r', encoding='utf-8') as f:
+            entidad = json.load(f)
+        entidad.setdefault('id', f"SmartMeter_{nombre[:-len('.json')]}")
+        plantillas[entidad['id']] = entidad
+    return plantillas
+
+
+def generar_flota(plantillas, cantidad):
+    """
+    Flota sintética de `cantidad` medidores con la forma de las plantillas
+    (se reparten en orden). Devuelve {id_entidad: entidad}.
+    """
+    modelos = list(plantillas.values())
+    flota = {}
+    for i in range(cantidad):
+        id_entidad = f"SmartMeter_SM_SINT_{i + 1:05d}"
+        flota[id_entidad] = {**modelos[i % len(modelos)], 'id': id_entidad}
+    return flota
+
+
+def ids_sensores(plantillas):
+    """
+    IDs cortos (los que usa getter.SENSORES) de las entidades servidas.
+    """
+    return [id_entidad[len('SmartMeter_'):] for id_entidad in plantillas]
+
+
+def entidad_en_periodo(entidad, periodo, variacion):
+    """
+    Copia de la entidad con los valores numéricos desplazados de forma
+    determinista según el periodo: dentro de un periodo la respuesta (y su
+    ETag) es siempre la misma.
+    """
+    resultado = {}
+    for clave, atributo in entidad.items():
+        if isinstance(atributo, dict) and isinstance(atributo.get('value'), (int, float)):
+            semilla = int(hashlib.md5(f"{entidad['id']}{clave}{periodo}".encode()).hexdigest()[:8], 16)
+            factor = 1 + variacion * math.sin(semilla)
+            resultado[clave] = {**atributo, 'value': round(atributo['value'] * factor, 3)}
+        else:
+            resultado[clave] = atributo
+    return resultado
+
+
+class ManejadorStub(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    # Se configuran al crear el servidor
+    plantillas = {}
+    periodo_cambio = PERIODO_CAMBIO
+    variacion = VARIACION
+    latencia = 0.0
+    tasa_fallas = 0.0
+    sin_lotes = False
+
+    def entidad(self, id_entidad):
+        periodo = int(time.time() // self.periodo_cambio)
+        return entidad_en_periodo(self.plantillas[id_entidad], periodo, self.variacion)
+
+    def responder(self, codigo, cuerpo=None, encabezados=None):
+        datos = b'' if cuerpo is None else json.dumps(cuerpo, ensure_ascii=False).encode('utf-8')
+        self.send_response(codigo)
+        for clave, valor in (encabezados or {}).items():
+            self.send_header(clave, valor)
+        if cuerpo is not None:
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(datos)))
+        self.end_headers()
+        self.wfile.write(datos)
+
+    def do_GET(self):
+        if self.latencia:
+            time.sleep(self.latencia)
+        if self.tasa_fallas and random.random() < self.tasa_fallas:
+            self.responder(503, {'error': 'ServiceUnavailable'})
+            return
+
+        partes = urlsplit(self.path)
+        if partes.path.startswith('/data/') and partes.path.endswith('.json'):
+            self.servir_individual(partes.path[len('/data/'):-len('.json')])
+        elif partes.path == '/v2/entities' and not self.sin_lotes:
+            self.servir_lote(parse_qs(partes.query))
+        else:
+            self.responder(404, {'error': 'NotFound'})
+
+    def servir_individual(self, sensor_id):
+        id_entidad = f"SmartMeter_{sensor_id}"
+        if id_entidad not in self.plantillas:
+            self.responder(404, {'error': 'NotFound'})
+            return
+
+        entidad = self.entidad(id_entidad)
+        etag = '"%s"' % hashlib.md5(json.dumps(entidad, sort_keys=True).encode()).hexdigest()
+        if self.headers.get('If-None-Match') == etag:
+            self.responder(304, encabezados={'ETag': etag})
+            return
+        self.responder(200, entidad, {'ETag': etag})
+
+    def servir_lote(self, consulta):
+        ids = consulta.get('id', [''])[0].split(',') if 'id' in consulta else list(self.plantillas)
+        atributos = consulta['attrs'][0].split(',') if 'attrs' in consulta else None
+        limite = min(int(consulta.get('limit', ['20'])[0]), LIMITE_NGSI)
+
+        entidades = []
+        for id_entidad in ids:
+            if id_entidad not in self.plantillas:
+                continue
+            entidad = self.entidad(id_entidad)
+            if atributos is not None:
+                entidad = {clave: valor for clave, valor in entidad.items()
+                           if clave in ('id', 'type') or clave in atributos}
+            entidades.append(entidad)
+        self.responder(200, entidades[:limite])
+
+    def log_message(self, *args):
+        pass
+
+
+class ServidorStub(ThreadingHTTPServer):
+    # Cola de conexiones amplia: el recolector abre muchas a la vez
+    request_queue_size = 256
+    daemon_threads = True
+
+
+def crear_servidor(plantillas, puerto=0, periodo=PERIODO_CAMBIO, latencia=0.0, tasa_fallas=0.0,
+                   sin_lotes=False, en_segundo_plano=False):
+    """
+    Crea el servidor de prueba (puerto 0 = uno libre; ver
+    servidor.server_address). Con en_segundo_plano se atiende en un hilo.
+    """
+    manejador = type('ManejadorConfigurado', (ManejadorStub,), {
+        'plantillas': plantillas,
+        'periodo_cambio': periodo,
+        'latencia': latencia,
+        'tasa_fallas': tasa_fallas,
+        'sin_lotes': sin_lotes
+    })
+    servidor = ServidorStub(('127.0.0.1', puerto), manejador)
+    if en_segundo_plano:
+        threading.Thread(target=servidor.serve_forever, name='stub', daemon=True).start()
+    return servidor
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Servidor local de prueba para getter.py')
+    parser.add_argument('--puerto', type=int, default=PUERTO)
+    parser.add_argument('--carpeta', default=CARPETA_PLANTILLAS, help='JSON de entidades a servir')
+    parser.add_argument('--periodo', type=float, default=PERIODO_CAMBIO, help='segundos entre cambios de valores')
+    parser.add_argument('--latencia', type=float, default=0.0, help='demora artificial por solicitud, en segundos')
+    parser.add_argument('--tasa-fallas', type=float, default=0.0, help='fracción de solicitudes que responden 503')
+    parser.add_argument('--sinteticos', type=int, default=0, help='sirve N medidores sintéticos en lugar de las plantillas')
+    parser.add_argument('--sin-lotes', action='store_true', help='responde 404 en /v2/entities (prueba el respaldo individual)')
+    args = parser.parse_args()
+
+    plantillas = cargar_plantillas(args.carpeta)
+    if args.sinteticos:
+        plantillas = generar_flota(plantillas, args.sinteticos)
+
+    servidor = crear_servidor(plantillas, args.puerto, args.periodo, args.latencia, args.tasa_fallas, args.sin_lotes)
+    print(f"🧪 Servidor de prueba en http://127.0.0.1:{args.puerto} ({len(plantillas)} entidades)")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        print("\n🛑 Servidor de prueba detenido")
+
+
+if __name__ == '__main__':
+    main()